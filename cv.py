@@ -1,41 +1,56 @@
-import cv2
-
-STREAM_URL = "http://192.168.4.1/stream"
-
-cap = cv2.VideoCapture(STREAM_URL)
-
-if not cap.isOpened():
-    print(f"Ошибка: не удалось подключиться к потоку {STREAM_URL}")
-    exit()
-
-print("Подключено к видеопотоку. Нажмите 'q' для выхода.")
-
-# Создаём детектор QR-кода
-qr_decoder = cv2.QRCodeDetector()
-
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        print("Не удалось получить кадр.")
-        break
-
-    # Декодируем QR-код
-    data, bbox, _ = qr_decoder.detectAndDecode(frame)
-
-    if data:
-        print(f"QR-код распознан: {data}")
-        # Рисуем рамку, если есть координаты
-        if bbox is not None:
-            bbox = bbox[0].astype(int)
-            for i in range(len(bbox)):
-                pt1 = tuple(bbox[i])
-                pt2 = tuple(bbox[(i + 1) % len(bbox)])
-                cv2.line(frame, pt1, pt2, (0, 255, 0), 3)
-
-    cv2.imshow("QR Scanner - ESP32-CAM", frame)
-
-    if cv2.waitKey(1) & 0xFF == ord('q'):
-        break
-
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+"""
+Сканер QR по видеопотоку ESP32-CAM без сервиса: печатает каждый новый код один раз
+(повторы того же кода в течение --dedup секунд подавляются).
+
+    python cv.py
+    python cv.py --url http://192.168.4.1/stream --show
+
+Чтение потока и распознавание идут в фоновых потоках (service/robot_camera.py);
+в составе сервиса тот же сканер записывает коды в qr_store (WDR_ROBOT_CAMERA=1).
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'service'))
+
+import robot_camera  # noqa: E402
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--url', default=robot_camera.STREAM_URL)
+    p.add_argument('--dedup', type=float, default=robot_camera.DEDUP_SEC)
+    p.add_argument('--show', action='store_true', help="окно с последним кадром ('q' — выход)")
+    args = p.parse_args()
+
+    scanner = robot_camera.RobotCameraScanner(
+        args.url, locate=lambda: None, store=None, dedup_sec=args.dedup,
+        on_code=lambda code, node_id: print(f"QR-код распознан: {code}", flush=True))
+    scanner.start()
+    print(f"Сканер запущен: {args.url}. Выход — Ctrl+C{' или q в окне' if args.show else ''}.")
+    try:
+        if args.show:
+            import cv2
+            while True:
+                frame = scanner.latest_frame()
+                if frame is not None:
+                    cv2.imshow("QR Scanner - ESP32-CAM", frame)
+                if cv2.waitKey(30) & 0xFF == ord('q'):
+                    break
+            cv2.destroyAllWindows()
+        else:
+            while True:
+                time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        scanner.stop()
+        stats = scanner.stats()
+        print(f"Кадров: {stats['frames_read']}, распознавалось: {stats['frames_decoded']}, "
+              f"кодов: {stats['codes']}, повторов: {stats['duplicates']}")
+
+
+if __name__ == '__main__':
+    main()
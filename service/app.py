@@ -1,27 +1,64 @@
 import json
 import os
 import tempfile
+import time
 from pathlib import Path
 
-from flask import Flask, render_template, send_from_directory, request, jsonify, Response
+from flask import Flask, render_template, send_from_directory, request, jsonify, Response, stream_with_context
 
-from cv_topology import detect_walls_and_shelves
+import fleet
+import lazy
+from graph_store import load_graph, save_graph_binary
 from dronecontroller import (
     start_mission, land_manual, is_mission_active, is_available,
     get_current_waypoint_index, get_current_node_index,
     get_qr_results, set_qr_save_path, get_camera_frame_jpeg, get_camera_frame_with_qr,
+    get_leg_stats, set_checkpoint_path, get_checkpoint,
+    set_frame_recorder, get_frame_recorder_stats,
 )
-from robotcontroller import send_robot_to_node, get_robot_position, reset_robot_position, return_robot_to_start
+import metrics
+import profiling
+import robot_camera
+from events import acquire_stream, sse_stream
+from mission_plan import plan_scan_route, plan_levels_route, resume_route, estimate_route_time
+from qr_store import store as qr_store, slot_key, split_slot
+import streaming
+from trip_costs import costs as trip_costs
+from robotcontroller import (
+    send_robot_to_node, get_robot_telemetry, reset_robot_position, return_robot_to_start,
+    get_robot_node, set_robot_node, route_cache_stats, clear_route_cache,
+)
+from routing import set_graph_paths, get_routing_graph, apply_graph_patch, reset_graph
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
 
+# OpenCV и NumPy нужны только для распознавания схемы склада — грузятся при первом запросе
+cv_topology = lazy.module('cv_topology')
+
 DATA_DIR = Path(__file__).resolve().parent / 'data'
 GRAPH_PATH = DATA_DIR / 'graph.json'
+GRAPH_BIN_PATH = DATA_DIR / 'graph.bin'
+GRAPH_PATCH_PATH = DATA_DIR / 'graph_patches.jsonl'
 ROBOTS_PATH = DATA_DIR / 'robots.json'
 NODES_QR_PATH = DATA_DIR / 'nodes_qr.json'
+PROFILES_DIR = DATA_DIR / 'profiles'
+MISSION_CHECKPOINT_PATH = DATA_DIR / 'mission_checkpoint.json'
+FRAME_RECORD_PATH = DATA_DIR / 'frames.wdrf'
+DRONES_PATH = DATA_DIR / 'drones.json'
+TRIP_COSTS_PATH = DATA_DIR / 'trip_costs.json'
 
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 set_qr_save_path(NODES_QR_PATH)
+set_checkpoint_path(MISSION_CHECKPOINT_PATH)
+fleet.set_checkpoint_dir(DATA_DIR)
+fleet.load_config(DRONES_PATH)
+trip_costs.load(TRIP_COSTS_PATH)
+if os.environ.get('WDR_FRAME_RECORD', '').lower() in ('1', 'true', 'yes'):
+    set_frame_recorder(FRAME_RECORD_PATH, size_mb=float(os.environ.get('WDR_FRAME_RECORD_MB', 256)))
+if os.environ.get('WDR_ROBOT_CAMERA', '').lower() in ('1', 'true', 'yes'):
+    robot_camera.start()
+set_graph_paths(GRAPH_PATH, GRAPH_BIN_PATH, GRAPH_PATCH_PATH)
+profiling.install(app, PROFILES_DIR)
 
 _DEFAULT_ROBOTS = [
     {"id": 1, "name": "Робот 1", "status": "В сети", "model": "Pioneer-1"},
@@ -65,7 +102,7 @@ def api_analyze_topology():
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
             tmp_path = tmp.name
             f.save(tmp_path)
-        result = detect_walls_and_shelves(image_path=tmp_path)
+        result = cv_topology.detect_walls_and_shelves(image_path=tmp_path)
         if result is None:
             return jsonify({'error': 'Не удалось обработать изображение'}), 500
         return jsonify(result)
@@ -98,11 +135,14 @@ def _ensure_data_dir():
 @app.route('/api/graph', methods=['GET'])
 def api_graph_get():
     _ensure_data_dir()
-    if not GRAPH_PATH.exists():
-        return jsonify({'nodes': [], 'edges': [], 'meta': None})
     try:
-        with open(GRAPH_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = load_graph(GRAPH_PATH, GRAPH_BIN_PATH)
+        if data is None:
+            return jsonify({'nodes': [], 'edges': [], 'meta': None})
+        if GRAPH_PATCH_PATH.exists():
+            rg = get_routing_graph()
+            if rg is not None:
+                rg.annotate(data)
         return jsonify(data)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -110,6 +150,12 @@ def api_graph_get():
 
 @app.route('/api/drone/start', methods=['POST'])
 def api_drone_start():
+    """
+    Облёт маршрута route дроном. levelHeights — высоты уровней стеллажа (м, уровни
+    1..n): узлы осмотра маршрута снимаются на каждом уровне одной миссией, порядок
+    облёта строит mission_plan.plan_levels_route. only_stale — только узлы (ячейки
+    узел@уровень) без QR-данных или с данными старше max_age_sec.
+    """
     try:
         data = request.get_json()
         if data is None:
@@ -119,16 +165,147 @@ def api_drone_start():
         height = data.get('height')
         axis_y = data.get('axisY')
         return_start_index = data.get('return_start_index')
+        level_heights = data.get('levelHeights')
         if not route:
             return jsonify({'error': 'Маршрут пуст'}), 400
+        extra = {}
+        if level_heights:
+            try:
+                level_heights = [float(z) for z in level_heights]
+            except (TypeError, ValueError):
+                return jsonify({'error': 'levelHeights — список высот в метрах'}), 400
+            if not all(0.5 <= z <= 10 for z in level_heights):
+                return jsonify({'error': 'Высота уровня должна быть от 0.5 до 10 м'}), 400
+        if data.get('only_stale') or level_heights:
+            graph = get_routing_graph()
+            if graph is None:
+                return jsonify({'error': 'Граф не построен'}), 400
+            targets = list(dict.fromkeys(item.get('id') for item in route[:return_start_index]))
+            if level_heights:
+                targets = [(nid, k + 1) for nid in targets for k in range(len(level_heights))]
+            total = len(targets)
+            if data.get('only_stale'):
+                # Облететь только узлы маршрута без QR-данных или с данными старше max_age_sec
+                max_age = data.get('max_age_sec')
+                max_age = float(max_age) if max_age is not None else None
+                keys = [slot_key(*t) if isinstance(t, tuple) else t for t in targets]
+                targets = [split_slot(k) if level_heights else k for k in qr_store.stale_nodes(keys, max_age)]
+                if not targets:
+                    return jsonify({'error': 'Все узлы маршрута уже осмотрены'}), 400
+            if level_heights:
+                route, return_start_index, unreachable = plan_levels_route(
+                    graph, route[0].get('id'), targets, level_heights, start_height=height, meta=meta)
+                extra['estimate_sec'] = round(estimate_route_time(
+                    route, meta, height if height is not None else level_heights[0]), 1)
+            else:
+                route, return_start_index, unreachable = plan_scan_route(graph, route[0].get('id'), targets)
+            extra.update({'route': route, 'return_start_index': return_start_index,
+                          'targets': len(targets), 'skipped': total - len(targets), 'unreachable': unreachable})
         ok, msg = start_mission(route, meta, height=height, axis_y=axis_y, return_start_index=return_start_index)
         if ok:
-            return jsonify({'ok': True, 'message': msg})
+            return jsonify({'ok': True, 'message': msg, **extra})
+        return jsonify({'error': msg}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/drone/checkpoint')
+def api_drone_checkpoint():
+    """Контрольная точка последней миссии: маршрут, прогресс, статус узлов осмотра."""
+    cp = get_checkpoint()
+    if cp is None:
+        return jsonify({'error': 'Миссий ещё не было'}), 404
+    return jsonify(cp)
+
+
+@app.route('/api/drone/resume', methods=['POST'])
+def api_drone_resume():
+    """Продолжает прерванную миссию: облёт только узлов, до которых дрон не долетел."""
+    try:
+        cp = get_checkpoint()
+        if cp is None or cp.get('status') in ('completed', 'running'):
+            return jsonify({'error': 'Нет прерванной миссии'}), 400
+        route, return_start_index, unreachable = resume_route(cp, get_routing_graph())
+        if not any(item.get('scan') for item in route):
+            return jsonify({'error': 'Все узлы прерванной миссии уже осмотрены'}), 400
+        ok, msg = start_mission(route, cp.get('meta') or {}, height=cp.get('height'), axis_y=cp.get('axis_y'),
+                                return_start_index=return_start_index, resumed_from=cp.get('mission_id'),
+                                transit_height=cp.get('transit_height'))
+        if ok:
+            return jsonify({'ok': True, 'message': msg, 'route': route,
+                            'return_start_index': return_start_index, 'unreachable': unreachable})
         return jsonify({'error': msg}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/fleet')
+def api_fleet():
+    """Дроны флота (data/drones.json), их статус и план последней миссии флота."""
+    return jsonify(fleet.status())
+
+
+@app.route('/api/fleet/start', methods=['POST'])
+def api_fleet_start():
+    """
+    Облёт склада всеми дронами флота одновременно: узлы делятся на компактные
+    области по числу дронов. JSON: { targets?, home?, height?, axisY?, meta?,
+    only_stale?, max_age_sec?, altitude_step?, transit_step? }; без targets — все
+    узлы графа. transit_step = 0 отключает эшелоны транзита (см. fleet.py).
+    """
+    try:
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Ожидается JSON'}), 400
+        graph = get_routing_graph()
+        if graph is None:
+            return jsonify({'error': 'Граф не построен'}), 400
+        targets = data.get('targets') or [nid for nid in graph.node_ids() if graph.is_node_enabled(nid)]
+        skipped = 0
+        if data.get('only_stale'):
+            max_age = data.get('max_age_sec')
+            max_age = float(max_age) if max_age is not None else None
+            stale = qr_store.stale_nodes(targets, max_age)
+            skipped = len(targets) - len(stale)
+            targets = stale
+        if not targets:
+            return jsonify({'error': 'Нет узлов для облёта'}), 400
+        meta = data.get('meta') or graph.meta or {}
+        altitude_step = float(data.get('altitude_step', fleet.ALTITUDE_STEP))
+        transit_step = float(data.get('transit_step', fleet.TRANSIT_STEP))
+        ok, msg, plan = fleet.start(graph, meta, targets, height=data.get('height'), axis_y=data.get('axisY'),
+                                    home=data.get('home'), altitude_step=altitude_step, transit_step=transit_step)
+        if ok:
+            return jsonify({'ok': True, 'message': msg, 'targets': len(targets), 'skipped': skipped, 'plan': plan})
+        return jsonify({'error': msg, 'plan': plan}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/fleet/resume', methods=['POST'])
+def api_fleet_resume():
+    """
+    Продолжает прерванные миссии дронов флота (контрольные точки
+    data/mission_checkpoint.<id>.json): каждый дрон — только неосмотренные узлы.
+    """
+    try:
+        ok, msg, plan = fleet.resume(get_routing_graph())
+        if ok:
+            return jsonify({'ok': True, 'message': msg, 'plan': plan})
+        return jsonify({'error': msg, 'plan': plan}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/fleet/land', methods=['POST'])
+def api_fleet_land():
+    try:
+        fleet.land_all()
+        return jsonify({'ok': True, 'message': 'Посадка флота выполнена'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/drone/land', methods=['POST'])
 def api_drone_land():
     try:
@@ -148,10 +325,83 @@ def api_drone_status():
     })
 
 
+@app.route('/api/drone/legs')
+def api_drone_legs():
+    """Время полёта и задержка обнаружения прилёта по последним отрезкам миссии."""
+    return jsonify(get_leg_stats())
+
+
+@app.route('/api/drone/recorder', methods=['GET', 'POST'])
+def api_drone_recorder():
+    """
+    Запись кадров камеры в data/frames.wdrf (разбор — bench/replay_frames.py).
+    POST { enabled, size_mb? } — включить или выключить запись.
+    """
+    if request.method == 'GET':
+        return jsonify(get_frame_recorder_stats())
+    data = request.get_json()
+    if data is None:
+        return jsonify({'error': 'Ожидается JSON'}), 400
+    if not data.get('enabled'):
+        return jsonify(set_frame_recorder(None))
+    try:
+        size_mb = float(data.get('size_mb', 256))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'size_mb должен быть числом'}), 400
+    if not 1 <= size_mb <= 16384:
+        return jsonify({'error': 'size_mb должен быть от 1 до 16384'}), 400
+    try:
+        return jsonify(set_frame_recorder(FRAME_RECORD_PATH, size_mb=size_mb))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Метрики горячих путей в формате Prometheus (включаются WDR_METRICS=1)."""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/api/profiles')
+def api_profiles():
+    """Последние профили запросов (см. profiling.py: заголовок X-Profile)."""
+    if not profiling.is_allowed(request.remote_addr):
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    return jsonify(profiling.list_profiles())
+
+
+@app.route('/api/profiles/<path:name>')
+def api_profile_file(name):
+    if not profiling.is_allowed(request.remote_addr):
+        return jsonify({'error': 'Доступ запрещён'}), 403
+    return send_from_directory(profiling.profile_dir(), name, as_attachment=True)
+
+
+@app.route('/api/events')
+def api_events():
+    """
+    Push-канал (SSE): drone — статус миссии, qr — новые коды по узлам, robot — ход поездки,
+    telemetry — позиция робота.
+    ?topics=drone,qr ограничивает набор тем. Сверх events.MAX_STREAMS открытых потоков —
+    503: каждый поток держит поток сервера, и клиент переходит на опрос статуса.
+    """
+    slot = acquire_stream()
+    if slot is None:
+        resp = jsonify({'error': 'Слишком много подключений к push-каналу, используйте опрос'})
+        resp.headers['Retry-After'] = '30'
+        return resp, 503
+    topics = [t for t in request.args.get('topics', '').split(',') if t] or None
+    resp = Response(stream_with_context(sse_stream(topics, slot=slot)), mimetype='text/event-stream')
+    resp.call_on_close(slot.release)
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
 @app.route('/api/robot/send', methods=['POST'])
 def api_robot_send():
     _ensure_data_dir()
-    if not GRAPH_PATH.exists():
+    if not GRAPH_PATH.exists() and not GRAPH_BIN_PATH.exists():
         return jsonify({'error': 'Граф не построен'}), 400
     try:
         data = request.get_json()
@@ -165,8 +415,9 @@ def api_robot_send():
         return_to_start = data.get('return_to_start', False)
         wait_at_target_sec = int(data.get('wait_at_target_sec', 0))
         wait_at_target_sec = max(0, min(60, wait_at_target_sec))
-        with open(GRAPH_PATH, 'r', encoding='utf-8') as f:
-            graph = json.load(f)
+        graph = get_routing_graph()
+        if graph is None:
+            return jsonify({'error': 'Граф не построен'}), 400
         ok, msg = send_robot_to_node(
             graph, target_node_id,
             start_node_id=start_node_id,
@@ -183,53 +434,241 @@ def api_robot_send():
 
 @app.route('/api/nodes/qr')
 def api_nodes_qr():
-    result = {}
-    if NODES_QR_PATH.exists():
-        try:
-            with open(NODES_QR_PATH, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if isinstance(data, dict):
-                    result = {k: v for k, v in data.items() if v and str(v).strip()}
-        except Exception:
-            pass
-    mem = get_qr_results()
-    if isinstance(mem, dict):
-        for k, v in mem.items():
-            if v and str(v).strip():
-                result[k] = str(v).strip()
-    return jsonify(result)
+    """
+    Коды QR по узлам из памяти. Без параметров — { узел: код } целиком.
+    ?since=<rev> — только изменившиеся после ревизии rev: { rev, nodes, full }.
+    """
+    since = request.args.get('since')
+    if since is None:
+        return jsonify(get_qr_results())
+    try:
+        since = int(since)
+    except ValueError:
+        return jsonify({'error': 'since должен быть целым'}), 400
+    rev, nodes, full = qr_store.changes_since(since)
+    return jsonify({'rev': rev, 'nodes': nodes, 'full': full})
+
+
+@app.route('/api/inventory/search')
+def api_inventory_search():
+    """
+    Где лежит товар: ?q=<код> — точное совпадение (без учёта регистра), с
+    &prefix=1 — все коды, начинающиеся с q. Ответ: { results: [{code, node_id, level}] }
+    (level — уровень стеллажа или null).
+    """
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'error': 'Укажите q'}), 400
+    try:
+        limit = max(1, min(1000, int(request.args.get('limit', 50))))
+    except ValueError:
+        return jsonify({'error': 'limit должен быть целым'}), 400
+    if request.args.get('prefix') in ('1', 'true', 'yes'):
+        found = qr_store.search(q, limit)
+    else:
+        found = [(qr_store.get(key), key) for key in qr_store.find(q)[:limit]]
+    results = []
+    for code, key in found:
+        nid, level = split_slot(key)
+        results.append({'code': code, 'node_id': nid, 'level': level})
+    return jsonify({'query': q, 'results': results})
+
+
+@app.route('/api/inventory/dispatch', methods=['POST'])
+def api_inventory_dispatch():
+    """
+    Отправляет робота к товару: { code, prefix?, start_node_id?, base_url?,
+    return_to_start?, wait_at_target_sec? }. Если код есть на нескольких узлах —
+    едет к ближайшему по графу от start_node_id.
+    """
+    try:
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Ожидается JSON'}), 400
+        code = str(data.get('code') or '').strip()
+        if not code:
+            return jsonify({'error': 'Укажите code'}), 400
+        if data.get('prefix'):
+            found = qr_store.search(code, limit=100)
+            codes = sorted({c.casefold(): c for c, _ in found}.values())
+            if len(codes) > 1:
+                return jsonify({'error': 'Под префикс подходит несколько товаров', 'candidates': codes}), 400
+            slots = [key for _, key in found]
+        else:
+            slots = qr_store.find(code)
+        # Робот едет к узлу; уровень стеллажа, где лежит товар, — в ответе
+        slot_of = {}
+        for key in slots:
+            slot_of.setdefault(split_slot(key)[0], key)
+        nodes = list(slot_of)
+        if not nodes:
+            return jsonify({'error': 'Товар не найден'}), 404
+        graph = get_routing_graph()
+        if graph is None:
+            return jsonify({'error': 'Граф не построен'}), 400
+        nodes = [nid for nid in nodes if graph.is_node_enabled(nid)]
+        if not nodes:
+            return jsonify({'error': 'Узлы с товаром отключены в графе'}), 400
+        start_node_id = data.get('start_node_id')
+        target = nodes[0]
+        if len(nodes) > 1:
+            dist = graph.distances_from(start_node_id or graph.node_ids()[0])
+            target = min(nodes, key=lambda nid: dist.get(nid, float('inf')))
+        wait_at_target_sec = max(0, min(60, int(data.get('wait_at_target_sec', 0))))
+        ok, msg = send_robot_to_node(
+            graph, target,
+            start_node_id=start_node_id,
+            base_url=data.get('base_url', '192.168.4.1'),
+            return_to_start=data.get('return_to_start', False),
+            wait_at_target_sec=wait_at_target_sec,
+        )
+        if ok:
+            return jsonify({'ok': True, 'message': msg, 'node_id': target, 'level': split_slot(slot_of[target])[1],
+                            'code': qr_store.get(slot_of[target])})
+        return jsonify({'error': msg}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/drone/frame')
 def api_drone_frame():
-    frame_bytes = get_camera_frame_jpeg()
+    drone = fleet.get_drone(request.args.get('drone'))
+    if drone is None:
+        return jsonify({'error': 'Дрон не найден'}), 404
+    frame_bytes = get_camera_frame_jpeg(drone=drone)
     if frame_bytes is None:
         return '', 204
     return Response(frame_bytes, mimetype='image/jpeg')
 
 
+def _float_arg(name):
+    try:
+        return float(request.args[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
 @app.route('/api/drone/frame-with-qr')
 def api_drone_frame_with_qr():
+    """
+    Кадр с камеры дрона и найденные QR. С ?client=<id> поток адаптивный (см.
+    streaming.py): клиент передаёт lat (мс, доставка прошлого кадра), srv (мс,
+    время сервера на тот кадр — поле server_ms ответа), backlog (кадров дольше
+    интервала кадра ждут отрисовки) и желаемый fps, а в ответе получает stream —
+    ширину, качество и паузу next_ms перед следующим запросом.
+    """
     fast = request.args.get('fast', '').lower() in ('1', 'true', 'yes')
-    data = get_camera_frame_with_qr(skip_qr=fast)
-    if data is None:
-        return jsonify({'error': 'no_frame', 'debug': {}}), 200
+    drone = fleet.get_drone(request.args.get('drone'))
+    if drone is None:
+        return jsonify({'error': 'Дрон не найден'}), 404
+    client = request.args.get('client')
+    if not client:
+        data = get_camera_frame_with_qr(skip_qr=fast, drone=drone)
+        if data is None:
+            return jsonify({'error': 'no_frame', 'debug': {}}), 200
+        return jsonify(data)
+    ctl = streaming.get_controller(client[:64])
+    ctl.report(_float_arg('lat'), backlog=_float_arg('backlog') or 0, fps=_float_arg('fps'),
+               server_ms=_float_arg('srv'))
+    width, quality, _ = ctl.settings()
+    t0 = time.perf_counter()
+    data = get_camera_frame_with_qr(skip_qr=fast, drone=drone, max_width=width, quality=quality)
+    server_ms = (time.perf_counter() - t0) * 1000
+    ctl.delivered(server_ms)
+    data['server_ms'] = round(server_ms, 1)
+    data['stream'] = ctl.state()
     return jsonify(data)
 
 
+@app.route('/api/drone/stream-clients')
+def api_drone_stream_clients():
+    """Настройки адаптивного потока каждого зрителя."""
+    return jsonify(streaming.stats())
+
+
 @app.route('/api/robot/position', methods=['GET'])
 def api_robot_position():
     """Получает текущую позицию робота."""
     try:
         base_url = request.args.get('base_url', '192.168.4.1')
-        position, err = get_robot_position(base_url)
-        if err:
-            return jsonify({'error': err}), 400
-        return jsonify({'position': position})
+        snap = get_robot_telemetry(base_url)
+        if snap['position'] is None:
+            return jsonify({'error': snap['error'] or 'Нет данных о позиции робота'}), 400
+        # position — строка ответа робота, как раньше; x/y/angle и свежесть — из кэша телеметрии
+        return jsonify({'position': snap['raw'], **snap['position'],
+                        'ts': snap['ts'], 'age_sec': snap['age_sec'], 'stale': snap['stale']})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/robot/route-cache')
+def api_robot_route_cache():
+    """Статистика кэша скомпилированных маршрутов робота."""
+    return jsonify(route_cache_stats())
+
+
+@app.route('/api/robot/trip-report', methods=['GET', 'POST'])
+def api_robot_trip_report():
+    """
+    Предсказанное (по выученным временам рёбер и поворотов, trip_costs.py) и
+    фактическое (по телеметрии; null, если не измерено) время последних ?limit=
+    поездок робота и сводная ошибка.
+    POST { reset: true } — забыть выученные времена.
+    """
+    if request.method == 'POST':
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Ожидается JSON'}), 400
+        if data.get('reset'):
+            trip_costs.reset()
+    try:
+        limit = max(0, min(1000, int(request.args.get('limit', 50))))
+    except ValueError:
+        return jsonify({'error': 'limit должен быть целым'}), 400
+    return jsonify(trip_costs.report(limit))
+
+
+@app.route('/api/robot/camera', methods=['GET', 'POST'])
+def api_robot_camera():
+    """
+    Сканер QR по камере робота (robot_camera.py): код пишется к узлу, где
+    стоит робот, по отдельному ключу «узел#robot» (записи дрона не перезаписываются).
+    POST { enabled, url?, base_url? } — запустить или остановить сканер.
+    """
+    if request.method == 'GET':
+        return jsonify(robot_camera.stats())
+    data = request.get_json()
+    if data is None:
+        return jsonify({'error': 'Ожидается JSON'}), 400
+    if not data.get('enabled'):
+        robot_camera.stop()
+        return jsonify(robot_camera.stats())
+    return jsonify(robot_camera.start(url=data.get('url') or None, base_url=data.get('base_url') or None))
+
+
+@app.route('/api/robot/node', methods=['GET', 'POST'])
+def api_robot_node():
+    """
+    Узел графа, где сейчас робот (по выполненным командам и одометрии).
+    POST { node_id, heading?, home?, base_url? } — робот поставлен в узел вручную.
+    """
+    if request.method == 'GET':
+        return jsonify(get_robot_node(request.args.get('base_url', '192.168.4.1')))
+    data = request.get_json()
+    if data is None:
+        return jsonify({'error': 'Ожидается JSON'}), 400
+    node_id = data.get('node_id')
+    graph = get_routing_graph()
+    if not node_id or graph is None or not graph.has_node(node_id):
+        return jsonify({'error': 'Узел не найден'}), 400
+    try:
+        heading = float(data.get('heading', 90))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'heading должен быть числом'}), 400
+    return jsonify(set_robot_node(data.get('base_url', '192.168.4.1'), node_id,
+                                  heading=heading, home=bool(data.get('home'))))
+
+
 @app.route('/api/robot/reset-position', methods=['POST'])
 def api_robot_reset_position():
     """Сбрасывает позицию робота в исходную точку."""
@@ -250,7 +689,7 @@ def api_robot_return_to_start():
     try:
         data = request.get_json() or {}
         base_url = data.get('base_url', '192.168.4.1')
-        ok, msg = return_robot_to_start(base_url)
+        ok, msg = return_robot_to_start(base_url, graph=get_routing_graph())
         if ok:
             return jsonify({'ok': True, 'message': msg})
         return jsonify({'error': msg}), 400
@@ -271,10 +710,33 @@ def api_graph_post():
         payload = {'nodes': nodes, 'edges': edges, 'meta': meta}
         with open(GRAPH_PATH, 'w', encoding='utf-8') as f:
             json.dump(payload, f, ensure_ascii=False, indent=2)
+        try:
+            save_graph_binary(payload, GRAPH_BIN_PATH)
+        except Exception:
+            # JSON остаётся основным форматом; без бинарной копии граф читается из него
+            if GRAPH_BIN_PATH.exists():
+                GRAPH_BIN_PATH.unlink()
+        reset_graph()
+        clear_route_cache()
         return jsonify({'ok': True})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/graph/patch', methods=['POST'])
+def api_graph_patch():
+    """Точечные правки графа: блокировка/разблокировка узлов и рёбер, длины рёбер."""
+    try:
+        data = request.get_json()
+        if data is None:
+            return jsonify({'error': 'Ожидается JSON'}), 400
+        rg = apply_graph_patch(data.get('ops'))
+        return jsonify({'ok': True, 'version': rg.version})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
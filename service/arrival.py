@@ -0,0 +1,249 @@
+"""
+Отслеживание прилёта дрона в точку без опроса «раз в 100 мс» в потоке миссии.
+
+ArrivalMonitor держит один фоновый поток на подключение к дрону. На время отрезка
+(begin -> wait) он опрашивает point_reached() с адаптивным интервалом: по
+телеметрии get_local_position_lps() оценивает оставшееся время полёта и
+спрашивает часто только у самой цели, редко — пока до неё далеко. Поток миссии
+спит на Condition и просыпается сразу, как только прилёт замечен (или миссию
+прервали через cancel()).
+
+cancel() может прийти между проверкой «миссия идёт» и begin() следующего отрезка.
+Поэтому каждый cancel() увеличивает номер generation(): миссия запоминает номер
+при старте и передаёт его в begin(), и отрезок, начатый после отмены, сразу
+заканчивается как 'cancelled', а не ждёт прилёта до таймаута.
+
+По каждому отрезку запоминается время полёта и задержка обнаружения прилёта —
+верхняя граница: сколько прошло между последним «ещё не долетел» и «долетел».
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+MIN_POLL = 0.01
+MAX_POLL = 0.2
+# Без телеметрии расстояние неизвестно — опрашиваем с постоянным коротким шагом
+BLIND_POLL = 0.02
+# Доля оставшегося времени полёта, через которую спрашиваем снова
+POLL_FRACTION = 0.25
+NOMINAL_SPEED = 0.5
+# point_reached, пришедший, когда до цели дальше STALE_RADIUS, может относиться к
+# прошлой точке — или телеметрия отстаёт от дрона. Флаг выдаётся один раз, поэтому
+# он не выбрасывается, а ждёт подтверждения: прилёт засчитывается, когда по
+# телеметрии дрон в STALE_RADIUS от цели и почти стоит (скорость ниже PENDING_SPEED)
+STALE_RADIUS = 0.5
+PENDING_SPEED = 0.15
+# Таймаут отрезка: ожидаемое время по NOMINAL_SPEED * LEG_TIMEOUT_FACTOR, не меньше LEG_TIMEOUT_MIN
+LEG_TIMEOUT_FACTOR = 4.0
+LEG_TIMEOUT_MIN = 15.0
+# Таймаут, если ни цели, ни телеметрии нет
+BLIND_TIMEOUT = 90.0
+LEG_HISTORY = 200
+
+LEG_SECONDS = metrics.histogram(
+    'wdr_drone_leg_seconds', 'Drone flight time per leg', ('kind',),
+    buckets=(0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0, 20.0, 30.0, 60.0, 90.0))
+ARRIVAL_LATENCY_SECONDS = metrics.histogram(
+    'wdr_drone_arrival_latency_seconds', 'Upper bound of arrival detection delay', ('kind',),
+    buckets=(0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5))
+
+
+def _read_position(pioneer):
+    """Последняя позиция [x, y, z] из телеметрии или None, если её нет."""
+    getter = getattr(pioneer, 'get_local_position_lps', None)
+    if getter is None:
+        return None
+    try:
+        try:
+            # pioneer_sdk: не ждать нового пакета, взять последний принятый
+            pos = getter(get_last_received=True)
+        except TypeError:
+            pos = getter()
+    except Exception:
+        return None
+    if pos is None or len(pos) < 3:
+        return None
+    try:
+        return tuple(float(v) for v in pos[:3])
+    except (TypeError, ValueError):
+        return None
+
+
+class ArrivalMonitor:
+    def __init__(self, pioneer):
+        self.pioneer = pioneer
+        self._cond = threading.Condition()
+        self._leg = None
+        self._seq = 0
+        self._cancelled = False
+        self._cancel_gen = 0
+        self._closed = False
+        self.legs = deque(maxlen=LEG_HISTORY)
+        self._thread = threading.Thread(target=self._run, name='arrival-monitor', daemon=True)
+        self._thread.start()
+
+    def generation(self):
+        """Номер отмены: меняется при каждом cancel() (см. begin)."""
+        with self._cond:
+            return self._cancel_gen
+
+    def begin(self, target=None, kind='waypoint', timeout=None, generation=None):
+        """
+        Начинает отрезок: вызывать сразу после команды дрону. target — (x, y, z)
+        цели, если известна; по ней считаются интервал опроса и таймаут (без цели
+        или телеметрии — BLIND_TIMEOUT, если timeout не задан явно). generation —
+        номер generation(), взятый при старте миссии: если с тех пор был cancel(),
+        отрезок сразу отменён. Без него прошлая отмена сбрасывается (ручные команды).
+        """
+        now = time.monotonic()
+        start = _read_position(self.pioneer)
+        if timeout is None:
+            timeout = BLIND_TIMEOUT
+            if target is not None and start is not None:
+                expected = math.dist(start, target) / NOMINAL_SPEED
+                timeout = max(LEG_TIMEOUT_MIN, expected * LEG_TIMEOUT_FACTOR)
+        with self._cond:
+            self._seq += 1
+            self._cancelled = generation is not None and generation != self._cancel_gen
+            self._leg = {
+                'seq': self._seq,
+                'kind': kind,
+                'target': tuple(target) if target is not None else None,
+                'start': start,
+                't0': now,
+                'deadline': now + timeout,
+                'last_poll': now,
+                'polls': 0,
+                'pos': start,
+                'pos_t': now,
+                'speed': None,
+                'pending': False,
+                'result': None,
+            }
+            self._cond.notify_all()
+
+    def wait(self):
+        """
+        Ждёт окончания текущего отрезка. Возвращает 'reached', 'timeout' или
+        'cancelled'; запись об отрезке — в self.legs.
+        """
+        with self._cond:
+            leg = self._leg
+            if leg is None:
+                return 'reached'
+            while leg['result'] is None and not self._cancelled:
+                now = time.monotonic()
+                if now > leg['deadline'] + 1.0:
+                    # Поток монитора не успел (завис в вызове SDK) — таймаут отсюда
+                    self._finish(leg, 'timeout', now)
+                    break
+                self._cond.wait(max(0.0, leg['deadline'] - now) + MAX_POLL)
+            if leg['result'] is None:
+                self._finish(leg, 'cancelled', time.monotonic())
+            if self._leg is leg:
+                self._leg = None
+            return leg['result']
+
+    def cancel(self):
+        """Будит ожидающий поток миссии (посадка, остановка)."""
+        with self._cond:
+            self._cancelled = True
+            self._cancel_gen += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cancelled = True
+            self._cancel_gen += 1
+            self._cond.notify_all()
+
+    def stats(self):
+        """Последние отрезки и сводка по ним."""
+        with self._cond:
+            legs = list(self.legs)
+        reached = [l for l in legs if l['result'] == 'reached']
+        summary = {'legs': len(legs), 'reached': len(reached),
+                   'timeouts': sum(1 for l in legs if l['result'] == 'timeout')}
+        if reached:
+            lat = sorted(l['detect_latency_sec'] for l in reached)
+            summary['flight_sec_total'] = round(sum(l['flight_sec'] for l in reached), 3)
+            summary['detect_latency_mean_sec'] = round(sum(lat) / len(lat), 4)
+            summary['detect_latency_max_sec'] = round(lat[-1], 4)
+        return {'summary': summary, 'legs': legs}
+
+    def _finish(self, leg, result, now):
+        leg['result'] = result
+        record = {
+            'kind': leg['kind'],
+            'target': leg['target'],
+            'result': result,
+            'flight_sec': round(now - leg['t0'], 4),
+            'detect_latency_sec': round(now - leg['last_poll'], 4),
+            'polls': leg['polls'],
+        }
+        self.legs.append(record)
+        if result == 'reached':
+            LEG_SECONDS.observe(now - leg['t0'], kind=leg['kind'])
+            ARRIVAL_LATENCY_SECONDS.observe(now - leg['last_poll'], kind=leg['kind'])
+        self._cond.notify_all()
+
+    def _next_interval(self, leg, pos, now):
+        target = leg['target']
+        if pos is None or target is None:
+            return BLIND_POLL
+        if leg['pos'] is not None and now > leg['pos_t']:
+            moved = math.dist(pos, leg['pos']) / (now - leg['pos_t'])
+            leg['speed'] = moved if leg['speed'] is None else 0.5 * leg['speed'] + 0.5 * moved
+        leg['pos'], leg['pos_t'] = pos, now
+        speed = max(leg['speed'] or 0.0, NOMINAL_SPEED)
+        eta = math.dist(pos, target) / speed
+        return min(MAX_POLL, max(MIN_POLL, eta * POLL_FRACTION))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and (self._leg is None or self._leg['result'] is not None):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                leg = self._leg
+            try:
+                reached = bool(self.pioneer.point_reached())
+            except Exception:
+                _log.exception('point_reached failed')
+                reached = False
+            pos = _read_position(self.pioneer)
+            now = time.monotonic()
+            near = pos is None or leg['target'] is None or math.dist(pos, leg['target']) <= STALE_RADIUS
+            with self._cond:
+                if leg is not self._leg or leg['result'] is not None:
+                    continue
+                leg['polls'] += 1
+                if self._cancelled:
+                    self._finish(leg, 'cancelled', now)
+                    continue
+                if reached and not near:
+                    _log.debug('point_reached %.2f m from target, waiting for telemetry',
+                               math.dist(pos, leg['target']))
+                    leg['pending'] = True
+                    reached = False
+                if reached:
+                    self._finish(leg, 'reached', now)
+                    continue
+                if now >= leg['deadline']:
+                    self._finish(leg, 'timeout', now)
+                    continue
+                interval = self._next_interval(leg, pos, now)
+                if leg['pending'] and near and (leg['speed'] or 0.0) < PENDING_SPEED:
+                    self._finish(leg, 'reached', now)
+                    continue
+                leg['last_poll'] = now
+                # Ждём на том же Condition: новый begin/cancel прерывает паузу
+                self._cond.wait(min(interval, max(0.0, leg['deadline'] - now)))
@@ -0,0 +1,196 @@
+"""
+Бенчмарк миссии облёта на симуляторе дрона (sim/drone_sim.py), без pioneer_sdk.
+
+Гоняет _run_mission_impl по змейке через сетку узлов, на каждом узле камера видит
+синтетический QR-код «NODE-<id>». Отчёт: узлов в минуту, доля распознанных кодов
+время по этапам (взлёт/паузы, полёт до точки, чтение кадра, распознавание, запись)
+и сводка монитора прилёта (arrival.py): задержка обнаружения прилёта по отрезкам.
+first_cell_scanned — первая клетка маршрута снимается при любом return_start_index
+(включая 0) и в маске осмотра, и в скомпилированных точках полёта.
+
+    python bench/bench_drone_mission.py --sizes 3x3,5x5 --speed 1.5
+    python bench/bench_drone_mission.py --time-scale 0.25   # быстрее: полёт и паузы в 4 раза короче
+    python bench/bench_drone_mission.py --return-home       # с обратным путём к старту (транзит)
+    python bench/bench_drone_mission.py --leg-overhead 1.0  # +1 с на разгон/торможение каждого перелёта
+    python bench/bench_drone_mission.py --record /tmp/sim.wdrf  # кадры узлов в запись для replay_frames.py
+
+С --record рядом с записью пишется <запись>.expected.json (узел -> код) для
+replay_frames.py --expected.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dronecontroller  # noqa: E402
+import qr_store  # noqa: E402
+import waypoints  # noqa: E402
+from sim.drone_sim import SimCamera, SimPioneer  # noqa: E402
+
+
+def snake_route(cols, rows):
+    route = []
+    for i in range(cols):
+        js = range(rows) if i % 2 == 0 else range(rows - 1, -1, -1)
+        for j in js:
+            route.append({'id': f'{i}_{j}', 'i': i, 'j': j})
+    return route
+
+
+def return_path(route):
+    """Обратный путь от последней клетки к первой: сначала по j, потом по i."""
+    i, j = route[-1]['i'], route[-1]['j']
+    i0, j0 = route[0]['i'], route[0]['j']
+    path = []
+    while j != j0:
+        j += 1 if j0 > j else -1
+        path.append({'id': f'{i}_{j}', 'i': i, 'j': j})
+    while i != i0:
+        i += 1 if i0 > i else -1
+        path.append({'id': f'{i}_{j}', 'i': i, 'j': j})
+    return path
+
+
+def first_cell_scanned(route):
+    points = dronecontroller._cells_to_meters(route, 1.0, 1.0)
+    for return_start_index in (None, 0, 1, len(route)):
+        if not waypoints.scan_mask(route, return_start_index)[0]:
+            return False
+        if not waypoints.compile_waypoints(route, points, return_start_index)[0]['scan']:
+            return False
+    return True
+
+
+class _Stages:
+    """Складывает время по этапам, оборачивая функции dronecontroller и камеры."""
+
+    def __init__(self):
+        self.seconds = {}
+        self._depth = 0
+
+    def add(self, name, dt):
+        self.seconds[name] = self.seconds.get(name, 0.0) + dt
+
+    def wrap(self, name, fn):
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            self._depth += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._depth -= 1
+                self.add(name, time.perf_counter() - t0)
+        return wrapper
+
+
+class _TimeProxy:
+    """Модуль time для dronecontroller: sleep вне других этапов считается паузой (взлёт, зависание)."""
+
+    def __init__(self, stages):
+        self._stages = stages
+
+    def sleep(self, sec):
+        t0 = time.perf_counter()
+        time.sleep(sec)
+        if self._stages._depth == 0:
+            self._stages.add('pauses', time.perf_counter() - t0)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def run_mission(cols, rows, cell, height, speed, time_scale, noise, return_home=False, leg_overhead=0.0,
+                expected=None):
+    route = snake_route(cols, rows)
+    return_start_index = None
+    if return_home:
+        return_start_index = len(route)
+        route += return_path(route)
+    meta = {'scaleX': cell, 'scaleY': cell}
+    points = dronecontroller._cells_to_meters(route, cell, cell)
+    targets = [(x, y, f"NODE-{item['id']}") for (x, y), item in zip(points, route[:return_start_index])]
+    if expected is not None:
+        expected.update((item['id'], f"NODE-{item['id']}") for item in route[:return_start_index])
+    pioneer = SimPioneer(speed=speed, time_scale=time_scale, leg_overhead=leg_overhead)
+    camera = SimCamera(pioneer, targets, noise=noise, seed=cols * 100 + rows)
+
+    stages = _Stages()
+    camera.get_cv_frame = stages.wrap('frame', camera.get_cv_frame)
+    saved = {name: getattr(dronecontroller, name)
+             for name in ('_wait_point_reached', '_decode_qr', '_record_qr', 'time', 'HOVER_SEC', 'TAKEOFF_PAUSE')}
+    dronecontroller._wait_point_reached = stages.wrap('flight', saved['_wait_point_reached'])
+    dronecontroller._decode_qr = stages.wrap('decode', saved['_decode_qr'])
+    dronecontroller._record_qr = stages.wrap('store', saved['_record_qr'])
+    dronecontroller.time = _TimeProxy(stages)
+    dronecontroller.HOVER_SEC = saved['HOVER_SEC'] * time_scale
+    dronecontroller.TAKEOFF_PAUSE = saved['TAKEOFF_PAUSE'] * time_scale
+    dronecontroller.set_drone_backend(lambda: pioneer, lambda: camera)
+    qr_store.store.load(None)
+    try:
+        t0 = time.perf_counter()
+        dronecontroller._run_mission_impl(points, height=height, route=route,
+                                          return_start_index=return_start_index)
+        wall = time.perf_counter() - t0
+        legs = dronecontroller.get_leg_stats()['summary']
+    finally:
+        for name, value in saved.items():
+            setattr(dronecontroller, name, value)
+        dronecontroller.set_drone_backend(None)
+    _, codes = qr_store.store.snapshot()
+    scanned = route[:return_start_index]
+    correct = sum(1 for item in scanned if codes.get(item['id']) == f"NODE-{item['id']}")
+    accounted = sum(stages.seconds.values())
+    stage_sec = {k: round(v, 3) for k, v in sorted(stages.seconds.items())}
+    stage_sec['other'] = round(wall - accounted, 3)
+    return {
+        'grid': f'{cols}x{rows}',
+        'nodes': len(scanned),
+        'route_cells': len(route),
+        'wall_sec': round(wall, 2),
+        'nodes_per_min': round(len(scanned) / wall * 60, 1),
+        'decoded': correct,
+        'decode_success': round(correct / len(scanned), 3),
+        'frames': camera.frames,
+        'stages_sec': stage_sec,
+        'legs': legs,
+        'first_cell_scanned': first_cell_scanned(route),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--sizes', default='3x3,5x5')
+    p.add_argument('--cell', type=float, default=1.0)
+    p.add_argument('--height', type=float, default=1.5)
+    p.add_argument('--speed', type=float, default=1.0)
+    p.add_argument('--time-scale', type=float, default=1.0)
+    p.add_argument('--noise', type=float, default=0.02)
+    p.add_argument('--return-home', action='store_true')
+    p.add_argument('--leg-overhead', type=float, default=0.0)
+    p.add_argument('--record', default=None, help='файл записи кадров (framelog.py)')
+    p.add_argument('--record-mb', type=float, default=64)
+    args = p.parse_args()
+    expected = None
+    if args.record:
+        dronecontroller.set_frame_recorder(args.record, size_mb=args.record_mb)
+        expected = {}
+    rows = []
+    try:
+        for size in args.sizes.split(','):
+            c, r = (int(v) for v in size.lower().split('x'))
+            rows.append(run_mission(c, r, args.cell, args.height, args.speed, args.time_scale, args.noise,
+                                    args.return_home, args.leg_overhead, expected=expected))
+    finally:
+        if args.record:
+            rows.append({'recorder': dronecontroller.get_frame_recorder_stats()})
+            dronecontroller.set_frame_recorder(None)
+            with open(args.record + '.expected.json', 'w', encoding='utf-8') as f:
+                json.dump(expected, f, ensure_ascii=False, indent=2)
+    print(json.dumps(rows, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
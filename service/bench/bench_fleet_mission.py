@@ -0,0 +1,151 @@
+"""
+Бенчмарк облёта склада флотом дронов на симуляторе (sim/drone_sim.py).
+
+Склад — сетка cols x rows узлов, на каждом QR-код «NODE-<id>». Для каждого числа
+дронов из --drones узлы делятся на области (mission_plan.plan_fleet), дроны
+взлетают с разных клеток нижнего края сетки и облетают свои области одновременно.
+Отчёт: wall_sec — время до посадки последнего дрона, nodes_per_min, доля
+распознанных кодов в общем qr_store, узлы/высоты по каждому дрону и разнос дронов
+в воздухе: min_clearance_m — наименьшее расстояние между двумя летящими дронами,
+close_calls — сколько раз (по выборкам положения) два дрона оказывались ближе
+клетки по горизонтали и ближе --min-vertical по высоте. --transit-step 0 —
+без эшелонов транзита (флот тогда не взлетает при пересечении маршрутов).
+
+    python bench/bench_fleet_mission.py --grid 8x6 --drones 1,2,4 --time-scale 0.05
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import dronecontroller  # noqa: E402
+import fleet  # noqa: E402
+import qr_store  # noqa: E402
+from routing import RoutingGraph  # noqa: E402
+from sim.drone_sim import SimCamera, SimPioneer  # noqa: E402
+
+
+def grid_graph(cols, rows, cell):
+    nodes = [{'id': f'{i}_{j}', 'i': i, 'j': j} for i in range(cols) for j in range(rows)]
+    edges = []
+    for i in range(cols):
+        for j in range(rows):
+            if i + 1 < cols:
+                edges.append({'from': f'{i}_{j}', 'to': f'{i + 1}_{j}', 'length': cell})
+            if j + 1 < rows:
+                edges.append({'from': f'{i}_{j}', 'to': f'{i}_{j + 1}', 'length': cell})
+    return {'nodes': nodes, 'edges': edges, 'meta': {'scaleX': cell, 'scaleY': cell}}
+
+
+class _ScaledTime:
+    """Модуль time для dronecontroller: паузы (взлёт, зависание) короче в time_scale раз."""
+
+    def __init__(self, scale):
+        self._scale = scale
+
+    def sleep(self, sec):
+        time.sleep(sec * self._scale)
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+def _watch_separation(pioneers, origins, cell, min_vertical, stop, out, period=0.002):
+    """Выборки положения всех дронов в общей системе координат склада."""
+    clearance = math.inf
+    close = 0
+    while not stop.is_set():
+        pos = [tuple(o + v for o, v in zip(origin, p.get_local_position_lps()[:2])) +
+               (p.get_local_position_lps()[2],) for p, origin in zip(pioneers, origins)]
+        for a in range(len(pos)):
+            for b in range(a + 1, len(pos)):
+                if pos[a][2] < 0.2 or pos[b][2] < 0.2:
+                    continue
+                clearance = min(clearance, math.dist(pos[a], pos[b]))
+                if math.dist(pos[a][:2], pos[b][:2]) < cell and abs(pos[a][2] - pos[b][2]) < min_vertical:
+                    close += 1
+        time.sleep(period)
+    out['min_clearance_m'] = round(clearance, 2) if clearance < math.inf else None
+    out['close_calls'] = close
+
+
+def run_fleet(graph, cols, k, cell, height, speed, time_scale, noise, transit_step, min_vertical):
+    nodes = [graph.node(nid) for nid in graph.node_ids()]
+    # Дома дронов — клетки нижнего края, разнесённые по ширине склада
+    homes = [f'{round(d * (cols - 1) / max(1, k - 1))}_0' for d in range(k)]
+    fleet.clear()
+    pioneers, origins = [], []
+    for d, home in enumerate(homes):
+        # Координаты кодов — в локальной системе этого дрона (от его дома)
+        points = dronecontroller._cells_to_meters([graph.node(home)] + nodes, cell, cell)[1:]
+        targets = [(x, y, f"NODE-{n['id']}") for (x, y), n in zip(points, nodes)]
+        pioneer = SimPioneer(speed=speed, time_scale=time_scale)
+        camera = SimCamera(pioneer, targets, noise=noise, seed=d)
+        fleet.add_drone(f'd{d + 1}', lambda p=pioneer: p, lambda c=camera: c, home=home)
+        pioneers.append(pioneer)
+        origins.append(dronecontroller._cells_to_meters([graph.node(home)], cell, cell)[0])
+    qr_store.store.load(None)
+    separation = {}
+    stop = threading.Event()
+    watcher = threading.Thread(target=_watch_separation,
+                               args=(pioneers, origins, cell, min_vertical, stop, separation), daemon=True)
+    t0 = time.perf_counter()
+    ok, msg, plan = fleet.start(graph, graph.meta, [n['id'] for n in nodes], height=height,
+                                transit_step=transit_step)
+    if not ok:
+        return {'drones': k, 'error': msg}
+    watcher.start()
+    fleet.wait()
+    wall = time.perf_counter() - t0
+    stop.set()
+    watcher.join()
+    _, codes = qr_store.store.snapshot()
+    correct = sum(1 for n in nodes if codes.get(n['id']) == f"NODE-{n['id']}")
+    return {
+        'drones': k,
+        'nodes': len(nodes),
+        'wall_sec': round(wall, 2),
+        'nodes_per_min': round(len(nodes) / wall * 60, 1),
+        'decode_success': round(correct / len(nodes), 3),
+        **separation,
+        'per_drone': [{'drone': p['drone'], 'home': p['home'], 'height': p['height'],
+                       'transit_height': p['transit_height'],
+                       'nodes': len(p['targets']), 'route_cells': len(p['route'])} for p in plan],
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--grid', default='8x6')
+    p.add_argument('--drones', default='1,2,4')
+    p.add_argument('--cell', type=float, default=1.0)
+    p.add_argument('--height', type=float, default=1.5)
+    p.add_argument('--speed', type=float, default=1.0)
+    p.add_argument('--time-scale', type=float, default=0.05)
+    p.add_argument('--noise', type=float, default=0.02)
+    p.add_argument('--transit-step', type=float, default=fleet.TRANSIT_STEP)
+    p.add_argument('--min-vertical', type=float, default=0.3)
+    args = p.parse_args()
+    cols, rows = (int(v) for v in args.grid.lower().split('x'))
+    graph = RoutingGraph(grid_graph(cols, rows, args.cell))
+    saved = {name: getattr(dronecontroller, name) for name in ('time', 'HOVER_SEC', 'TAKEOFF_PAUSE')}
+    dronecontroller.time = _ScaledTime(args.time_scale)
+    out = []
+    try:
+        for k in args.drones.split(','):
+            out.append(run_fleet(graph, cols, int(k), args.cell, args.height, args.speed,
+                                 args.time_scale, args.noise, args.transit_step, args.min_vertical))
+    finally:
+        for name, value in saved.items():
+            setattr(dronecontroller, name, value)
+        fleet.clear()
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Время холодного импорта сервиса (python -X importtime -c "import app").
+
+Запускает импорт app.py в отдельных процессах --runs раз и берёт лучший результат:
+  import_ms   — суммарное время импорта app со всеми зависимостями;
+  top         — самые дорогие модули верхнего уровня (cumulative, мс);
+  heavy       — какие из тяжёлых модулей (OpenCV, NumPy, pioneer_sdk, pyzbar)
+                загрузились при старте — их должен грузить только первый запрос
+                (см. lazy.py).
+
+Завершается с кодом 1, если import_ms больше --budget-ms или при старте
+загрузился тяжёлый модуль — так проверяется, что старт не стал медленнее.
+
+    python bench/bench_import_time.py --runs 5 --budget-ms 400
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SERVICE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+HEAVY_MODULES = ('cv2', 'numpy', 'pioneer_sdk', 'pyzbar', 'cv_topology', 'waypoints')
+
+
+def parse_importtime(stderr):
+    """[(модуль, self_us, cumulative_us, уровень вложенности)] из вывода -X importtime."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(parts[0]), int(parts[1]), depth))
+    return rows
+
+
+def measure_once(module):
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=SERVICE_DIR, capture_output=True, text=True, check=False)
+    if proc.returncode != 0:
+        raise RuntimeError(f'import {module} failed:\n{proc.stderr[-2000:]}')
+    rows = parse_importtime(proc.stderr)
+    total = next((cum for name, _, cum, depth in rows if name == module and depth == 0), None)
+    if total is None:
+        raise RuntimeError(f'no importtime line for {module}')
+    top = sorted(((name, cum) for name, _, cum, depth in rows if depth == 1), key=lambda r: -r[1])
+    loaded = {name.split('.')[0] for name, _, _, _ in rows}
+    return {
+        'import_ms': round(total / 1000, 1),
+        'top': [[name, round(cum / 1000, 1)] for name, cum in top[:8]],
+        'heavy': sorted(m for m in HEAVY_MODULES if m in loaded),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--module', default='app')
+    p.add_argument('--runs', type=int, default=5)
+    p.add_argument('--budget-ms', type=float, default=400.0)
+    args = p.parse_args()
+    # Первый запуск прогревает байткод и файловый кэш, в результат не идёт
+    measure_once(args.module)
+    runs = [measure_once(args.module) for _ in range(max(1, args.runs))]
+    best = min(runs, key=lambda r: r['import_ms'])
+    best['runs_ms'] = [r['import_ms'] for r in runs]
+    best['budget_ms'] = args.budget_ms
+    errors = []
+    if best['import_ms'] > args.budget_ms:
+        errors.append(f"import {args.module}: {best['import_ms']} ms > budget {args.budget_ms} ms")
+    if best['heavy']:
+        errors.append(f"loaded at startup: {', '.join(best['heavy'])}")
+    best['ok'] = not errors
+    print(json.dumps(best, ensure_ascii=False, indent=2))
+    if errors:
+        for err in errors:
+            print(f'FAIL: {err}', file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
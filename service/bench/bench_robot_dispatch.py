@@ -0,0 +1,209 @@
+"""
+Бенчмарк отправки робота на эмуляторе прошивки (sim/robot_emulator.py).
+
+Для складов-сеток разного размера измеряет:
+  plan_ms          — построение маршрута и команд (dict-граф и RoutingGraph);
+  dispatch_ms      — от вызова send_robot_to_node до первой команды на роботе;
+                     dispatch_no_odometry_ms — то же у прошивки без /get_position
+                     (вторая отправка: первая узнаёт, что телеметрии нет);
+  cmds_per_sec     — пропускная способность _execute_commands без времени движения;
+  trip_wall_sec    — полная поездка туда и обратно с движением (time_scale ускоряет его),
+                     motion_sec — чистое время движения по модели, overhead_sec — остальное;
+  return_ms        — return_robot_to_start по графу из узла, где робот на самом деле;
+  loss_success     — доля успешных поездок при потере запросов;
+  binary_parity    — маршруты RoutingGraph из словаря и из graph.bin совпадают
+                     (часть узлов и рёбер заблокирована флагом disabled);
+  patch_guard      — правка графа отклоняется и не меняет маршруты: set_length
+                     между несмежными узлами (POST /api/graph/patch отвечает 400)
+                     и правка, которую не удалось записать в журнал.
+
+    python bench/bench_robot_dispatch.py --sizes 10,30,60 --latency 0.01 --loss 0.02
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import robotcontroller  # noqa: E402
+from graph_store import load_graph_binary, save_graph_binary  # noqa: E402
+import routing  # noqa: E402
+from routing import RoutingGraph  # noqa: E402
+from sim.robot_emulator import RobotEmulator  # noqa: E402
+
+
+def warehouse_graph(n, cell=0.5):
+    """Сетка n x n со стеллажами: столбцы i % 3 == 1 заняты, кроме крайних рядов."""
+    nodes = []
+    ids = set()
+    for i in range(n):
+        for j in range(n):
+            if i % 3 == 1 and 0 < j < n - 1 and i < n - 1:
+                continue
+            nid = f'{i}_{j}'
+            ids.add(nid)
+            nodes.append({'id': nid, 'i': i, 'j': j})
+    edges = []
+    for i in range(n):
+        for j in range(n):
+            a = f'{i}_{j}'
+            if a not in ids:
+                continue
+            for b in (f'{i + 1}_{j}', f'{i}_{j + 1}'):
+                if b in ids:
+                    edges.append({'from': a, 'to': b, 'length': cell})
+    return {'nodes': nodes, 'edges': edges, 'meta': {'scaleX': cell, 'scaleY': cell}}
+
+
+def _motion_seconds(commands, speed, turn_rate):
+    total = 0.0
+    for cmd_type, kwargs in commands:
+        if cmd_type == 'drive':
+            total += abs(kwargs['d']) / speed
+        elif cmd_type == 'turn':
+            total += abs(kwargs['angle']) / turn_rate
+    return total
+
+
+def binary_parity(graph, samples=50):
+    """Блокирует каждый 7-й узел и 5-е ребро; сравнивает маршруты из словаря и из .bin."""
+    graph = {
+        'nodes': [dict(n, disabled=True) if k % 7 == 3 else n for k, n in enumerate(graph['nodes'])],
+        'edges': [dict(e, disabled=True) if k % 5 == 2 else e for k, e in enumerate(graph['edges'])],
+        'meta': graph['meta'],
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'graph.bin')
+        save_graph_binary(graph, path)
+        rg_bin = RoutingGraph(load_graph_binary(path, mmap=False))
+    rg_dict = RoutingGraph(graph)
+    ids = [n['id'] for n in graph['nodes']]
+    step = max(1, len(ids) // samples)
+    start = ids[0]
+    return all(rg_dict.shortest_path(start, t) == rg_bin.shortest_path(start, t) for t in ids[::step])
+
+
+def patch_guard(graph, samples=50):
+    """
+    Правки, которые должны быть отклонены, не меняют маршруты в памяти: длина между
+    несмежными узлами (ValueError — 400 в API) и правка при сбое записи журнала.
+    """
+    ids = [n['id'] for n in graph['nodes']]
+    start, far = ids[0], ids[-1]
+    targets = ids[::max(1, len(ids) // samples)]
+    edge = graph['edges'][0]
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'graph.json')
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(graph, f)
+        patch_path = os.path.join(tmp, 'graph_patches.jsonl')
+        routing.set_graph_paths(json_path, os.path.join(tmp, 'graph.bin'), patch_path)
+        try:
+            rg = routing.get_routing_graph()
+            before = [rg.shortest_path(start, t) for t in targets]
+            try:
+                routing.apply_graph_patch([{'op': 'set_length', 'from': start, 'to': far, 'length': 0.1}])
+                return False
+            except ValueError:
+                pass
+            # Журнал недоступен для записи (каталог вместо файла) — граф в памяти прежний
+            os.mkdir(patch_path)
+            try:
+                routing.apply_graph_patch([{'op': 'set_length', 'from': edge['from'], 'to': edge['to'],
+                                            'length': 1000.0}])
+                return False
+            except OSError:
+                pass
+            return [rg.shortest_path(start, t) for t in targets] == before
+        finally:
+            routing.set_graph_paths(None)
+
+
+def bench_size(n, latency, loss, time_scale, trips):
+    graph = warehouse_graph(n)
+    start, target = graph['nodes'][0]['id'], graph['nodes'][-1]['id']
+    row = {'size': f'{n}x{n}', 'nodes': len(graph['nodes']), 'edges': len(graph['edges'])}
+
+    t0 = time.perf_counter()
+    adj = robotcontroller._build_adj(graph)
+    path = robotcontroller._dijkstra(adj, start, target)
+    commands = robotcontroller._path_to_commands(path, graph['nodes'], adj)
+    row['plan_dict_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+    rg = RoutingGraph(graph)
+    t0 = time.perf_counter()
+    rg.shortest_path(start, target)
+    row['plan_routing_cold_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+    t0 = time.perf_counter()
+    rg.shortest_path(start, target)
+    row['plan_routing_warm_ms'] = round((time.perf_counter() - t0) * 1000, 3)
+    row['path_len'] = len(path)
+    row['commands'] = len(commands)
+    row['binary_parity'] = binary_parity(graph)
+    row['patch_guard'] = patch_guard(graph)
+
+    # Пропускная способность канала команд: без времени движения
+    with RobotEmulator(latency=latency, wait_motion=False) as emu:
+        t0 = time.perf_counter()
+        ok, _ = robotcontroller.send_robot_to_node(rg, target, start_node_id=start, base_url=emu.base_url)
+        elapsed = time.perf_counter() - t0
+        row['dispatch_ms'] = round((emu.log[0][0] - t0) * 1000, 2) if emu.log else None
+        row['cmds_per_sec'] = round(len(emu.log) / elapsed, 1) if ok else None
+
+    # Прошивка без одометрии: отправка не должна ждать телеметрию
+    with RobotEmulator(latency=latency, wait_motion=False, odometry=False) as emu:
+        robotcontroller.send_robot_to_node(rg, target, start_node_id=start, base_url=emu.base_url)
+        emu.reset_stats()
+        t0 = time.perf_counter()
+        robotcontroller.send_robot_to_node(rg, start, start_node_id=target, base_url=emu.base_url)
+        row['dispatch_no_odometry_ms'] = round((emu.log[0][0] - t0) * 1000, 2) if emu.log else None
+
+    # Полная поездка туда и обратно с движением
+    with RobotEmulator(latency=latency, time_scale=time_scale) as emu:
+        t0 = time.perf_counter()
+        ok, _ = robotcontroller.send_robot_to_node(rg, target, start_node_id=start, base_url=emu.base_url,
+                                                   return_to_start=True)
+        wall = time.perf_counter() - t0
+        # Обратно робот едет по графу, развернувшись из курса, с которым приехал
+        trace = []
+        robotcontroller._path_to_commands(path, graph['nodes'], adj, trace=trace)
+        back = robotcontroller._path_to_commands(path[::-1], graph['nodes'], adj, heading=trace[-1][1])
+        motion = _motion_seconds(commands + back, emu.speed, emu.turn_rate)
+        row['trip_ok'] = ok
+        row['trip_wall_sec'] = round(wall, 3)
+        row['motion_sec'] = round(motion, 2)
+        row['overhead_sec'] = round(wall - motion * time_scale, 3)
+        # Возврат из целевой точки
+        robotcontroller.send_robot_to_node(rg, target, start_node_id=start, base_url=emu.base_url)
+        t0 = time.perf_counter()
+        robotcontroller.return_robot_to_start(emu.base_url, graph=rg)
+        row['return_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+
+    if loss > 0:
+        success = 0
+        with RobotEmulator(latency=latency, loss=loss, wait_motion=False, seed=n) as emu:
+            for _ in range(trips):
+                ok, _ = robotcontroller.send_robot_to_node(rg, target, start_node_id=start, base_url=emu.base_url)
+                success += 1 if ok else 0
+            row['loss_success'] = round(success / trips, 3)
+            row['loss_dropped'] = emu.dropped
+    return row
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--sizes', default='10,30,60')
+    p.add_argument('--latency', type=float, default=0.005)
+    p.add_argument('--loss', type=float, default=0.0)
+    p.add_argument('--time-scale', type=float, default=0.01)
+    p.add_argument('--trips', type=int, default=20)
+    args = p.parse_args()
+    rows = [bench_size(int(n), args.latency, args.loss, args.time_scale, args.trips)
+            for n in args.sizes.split(',')]
+    print(json.dumps(rows, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+Бенчмарк маршрутов робота по выученному времени поездок (trip_costs.py) на эмуляторе
+прошивки (sim/robot_emulator.py) с медленной зоной — загруженным участком нижнего
+поперечного прохода склада (warehouse_graph из bench_robot_dispatch.py). Эмулятор
+отвечает на команду сразу, как настоящая прошивка (ack_early), а время движения
+измеряется по телеметрии /get_position (robotcontroller._motion_finished).
+
+Одна и та же последовательность поездок выполняется трижды:
+  distance — маршрут по длине рёбер (по умолчанию, WDR_ROUTE_BY_TIME=0);
+  cold     — по времени, оценки ещё не выучены (только повороты и длина);
+  learned  — по времени после --train обучающих поездок.
+Отчёт: суммарное фактическое время поездок, число поворотов, доля измеренных команд
+(measured) и ошибка предсказания времени поездки (mean_abs_pct_error, bias_sec). Времена — в секундах модели
+(без ускорения --time-scale); model — состояние trip_costs в ускоренном времени.
+
+    python bench/bench_trip_costs.py --size 12 --trips 12 --train 24 --slow-factor 5 --time-scale 0.2
+"""
+import argparse
+import json
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import robotcontroller  # noqa: E402
+import telemetry  # noqa: E402
+import trip_costs  # noqa: E402
+from sim import robot_emulator  # noqa: E402
+from bench_robot_dispatch import warehouse_graph  # noqa: E402
+from routing import RoutingGraph  # noqa: E402
+from sim.robot_emulator import RobotEmulator  # noqa: E402
+
+_SCALED = ('DEFAULT_SEC_PER_M', 'DEFAULT_SEC_PER_DEG', 'DEFAULT_COMMAND_SEC')
+_RATES = ('MAX_SPEED', 'MAX_TURN_RATE')
+# Опрос телеметрии, шаг одометрии эмулятора и ожидание остановки — в ускоренном времени
+_TICKS = ((telemetry, 'MIN_REQUEST_INTERVAL', 0.001), (robot_emulator, 'MOTION_TICK', 0.0002),
+          (robotcontroller, 'SETTLE_SEC', 0.01))
+
+
+def run_trips(rg, targets, emu_kwargs, by_time, time_scale):
+    robotcontroller.ROUTE_BY_TIME = by_time
+    with RobotEmulator(**emu_kwargs) as emu:
+        robotcontroller.set_robot_node(emu.base_url, '0_0', heading=90, home=True)
+        _, _, err = robotcontroller._telemetry(emu.base_url).fresh(1.0, timeout=2.0)
+        if err:
+            raise RuntimeError(err)
+        before = len(trip_costs.costs.report(limit=0)['trips'])
+        for target in targets:
+            ok, msg = robotcontroller.send_robot_to_node(rg, target, base_url=emu.base_url)
+            if not ok:
+                raise RuntimeError(msg)
+    trips = trip_costs.costs.report(limit=0)['trips'][before:]
+    done = [t for t in trips if t['ok'] and (t['actual_sec'] or 0) > 0]
+    errors = [(t['predicted_sec'] - t['actual_sec']) / time_scale for t in done]
+    return {
+        'trips': len(trips),
+        'actual_sec': round(sum(t['actual_sec'] for t in done) / time_scale, 1),
+        'predicted_sec': round(sum(t['predicted_sec'] for t in done) / time_scale, 1),
+        'turns': sum(t['turns'] for t in trips),
+        'measured': round(sum(t['measured'] for t in trips) / max(1, sum(t['commands'] for t in trips)), 3),
+        'mean_abs_pct_error': round(100 * sum(abs(e) / (t['actual_sec'] / time_scale)
+                                              for e, t in zip(errors, done)) / max(1, len(done)), 1),
+        'bias_sec': round(sum(errors) / max(1, len(done)), 2),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--size', type=int, default=12)
+    p.add_argument('--cell', type=float, default=0.5)
+    p.add_argument('--trips', type=int, default=12)
+    p.add_argument('--train', type=int, default=24)
+    p.add_argument('--speed', type=float, default=0.5)
+    p.add_argument('--turn-rate', type=float, default=90.0)
+    p.add_argument('--slow-factor', type=float, default=5.0)
+    p.add_argument('--time-scale', type=float, default=0.2)
+    p.add_argument('--seed', type=int, default=1)
+    args = p.parse_args()
+
+    graph = warehouse_graph(args.size, args.cell)
+    rg = RoutingGraph(graph)
+    # Узлы в проходах (не в нижнем поперечном): поездки между ними идут через верх или низ
+    aisle = [n['id'] for n in graph['nodes'] if 0 < n['j'] < args.size - 1]
+    rng = random.Random(args.seed)
+    eval_targets = [rng.choice(aisle) for _ in range(args.trips)]
+    train_targets = [rng.choice(aisle) for _ in range(args.train)]
+    # Одометрия эмулятора: узел 0_0 в начале координат, X — вдоль i, Y — вдоль j
+    half = args.cell / 2
+    slow = [(args.cell * 2 - half, -half, args.cell * (args.size - 3) + half, half, args.slow_factor)]
+    emu_kwargs = {'speed': args.speed, 'turn_rate': args.turn_rate, 'time_scale': args.time_scale,
+                  'slow_zones': slow, 'ack_early': True}
+
+    saved = {name: getattr(trip_costs, name) for name in _SCALED + _RATES}
+    saved_ticks = [(mod, name, getattr(mod, name)) for mod, name, _ in _TICKS]
+    saved_by_time = robotcontroller.ROUTE_BY_TIME, robotcontroller.TRIP_TIMING
+    robotcontroller.TRIP_TIMING = True
+    # Замеры идут в ускоренном времени эмулятора — начальные оценки и пороги тоже
+    for name in _SCALED:
+        setattr(trip_costs, name, saved[name] * args.time_scale)
+    for name in _RATES:
+        setattr(trip_costs, name, saved[name] / args.time_scale)
+    for mod, name, floor in _TICKS:
+        setattr(mod, name, max(floor, getattr(mod, name) * args.time_scale))
+    trip_costs.costs.load(None)
+    out = {}
+    try:
+        trip_costs.costs.reset()
+        out['distance'] = run_trips(rg, eval_targets, emu_kwargs, False, args.time_scale)
+        trip_costs.costs.reset()
+        out['cold'] = run_trips(rg, eval_targets, emu_kwargs, True, args.time_scale)
+        run_trips(rg, train_targets, emu_kwargs, True, args.time_scale)
+        out['learned'] = run_trips(rg, eval_targets, emu_kwargs, True, args.time_scale)
+        out['model'] = trip_costs.costs.report(limit=0)['summary']
+    finally:
+        for name, value in saved.items():
+            setattr(trip_costs, name, value)
+        for mod, name, value in saved_ticks:
+            setattr(mod, name, value)
+        robotcontroller.ROUTE_BY_TIME, robotcontroller.TRIP_TIMING = saved_by_time
+    print(json.dumps(out, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Нагрузочный тест: параллельные /api/drone/frame-with-qr и /api/drone/status.
+
+    python bench/load_drone_endpoints.py --clients 16 --duration 10 --threads 8
+    python bench/load_drone_endpoints.py --url http://127.0.0.1:5002   # уже запущенный сервер
+
+Без --url поднимает приложение в waitress на свободном порту. --synthetic-camera
+подставляет камеру, отдающую кадр 640x480 с QR-кодом, чтобы измерять полный путь
+(resize + QR + JPEG) без дрона.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+ENDPOINTS = {
+    'frame-with-qr': '/api/drone/frame-with-qr?fast=0',
+    'frame-fast': '/api/drone/frame-with-qr?fast=1',
+    'status': '/api/drone/status',
+}
+
+
+class _SyntheticCamera:
+    def __init__(self, text='BENCH-QR-0001'):
+        import cv2
+        import numpy as np
+        frame = np.full((480, 640, 3), 255, dtype=np.uint8)
+        try:
+            qr = cv2.QRCodeEncoder.create().encode(text)
+            qr = cv2.resize(qr, (qr.shape[1] * 6, qr.shape[0] * 6), interpolation=cv2.INTER_NEAREST)
+            h, w = qr.shape[:2]
+            frame[100:100 + h, 200:200 + w] = cv2.cvtColor(qr, cv2.COLOR_GRAY2BGR)
+        except Exception:
+            pass
+        self._frame = frame
+
+    def get_cv_frame(self):
+        time.sleep(0.005)  # время чтения кадра из сокета камеры
+        return self._frame.copy()
+
+
+def _percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[k]
+
+
+def _client(base, paths, stop_at, out):
+    k = 0
+    while time.perf_counter() < stop_at:
+        name, path = paths[k % len(paths)]
+        k += 1
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(base + path, timeout=30) as resp:
+                resp.read()
+            ok = True
+        except Exception:
+            ok = False
+        out.append((name, time.perf_counter() - t0, ok))
+
+
+def _start_server(threads):
+    from waitress import create_server
+    from app import app
+    server = create_server(app, host='127.0.0.1', port=0, threads=threads)
+    port = server.effective_port
+    t = threading.Thread(target=server.run, daemon=True)
+    t.start()
+    return server, f'http://127.0.0.1:{port}'
+
+
+def run(clients, duration, threads, url=None, synthetic_camera=False, mix=('frame-with-qr', 'status')):
+    if synthetic_camera:
+        import dronecontroller
+        dronecontroller.get_drone()._camera = _SyntheticCamera()
+    server = None
+    if url is None:
+        server, url = _start_server(threads)
+    paths = [(name, ENDPOINTS[name]) for name in mix]
+    results = []
+    stop_at = time.perf_counter() + duration
+    workers = []
+    for c in range(clients):
+        # Клиенты стартуют с разных эндпоинтов, чтобы запросы шли вперемешку
+        rotated = paths[c % len(paths):] + paths[:c % len(paths)]
+        t = threading.Thread(target=_client, args=(url, rotated, stop_at, results), daemon=True)
+        workers.append(t)
+        t.start()
+    for t in workers:
+        t.join()
+    if server is not None:
+        server.close()
+    report = {'clients': clients, 'duration_sec': duration, 'server_threads': threads, 'endpoints': {}}
+    for name, _ in paths:
+        lat = [r[1] for r in results if r[0] == name and r[2]]
+        errors = sum(1 for r in results if r[0] == name and not r[2])
+        report['endpoints'][name] = {
+            'requests': len(lat),
+            'errors': errors,
+            'rps': round(len(lat) / duration, 1),
+            'p50_ms': round(_percentile(lat, 0.5) * 1000, 2),
+            'p95_ms': round(_percentile(lat, 0.95) * 1000, 2),
+        }
+    return report
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('--clients', type=int, default=16)
+    p.add_argument('--duration', type=float, default=10.0)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--url', default=None)
+    p.add_argument('--synthetic-camera', action='store_true')
+    p.add_argument('--mix', default='frame-with-qr,status')
+    args = p.parse_args()
+    report = run(args.clients, args.duration, args.threads, url=args.url,
+                 synthetic_camera=args.synthetic_camera, mix=tuple(args.mix.split(',')))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Прогон записи кадров (framelog.py, data/frames.wdrf) через распознавание QR офлайн.
+
+Каждый кадр записи проходит через каждый бэкенд:
+  multi   — dronecontroller._detect_qr_multi (видеопоток: pyzbar, затем OpenCV);
+  mission — dronecontroller._decode_qr (снимок узла в миссии);
+  pyzbar  — dronecontroller._detect_qr_pyzbar;
+  opencv  — dronecontroller._detect_qr_opencv (detectAndDecodeMulti, затем одиночный).
+Кадры делятся между процессами (--workers, по умолчанию все ядра); каждый процесс
+сам отображает файл записи в память, кадры между процессами не копируются.
+
+Для каждого бэкенда: decode_rate — доля кадров с непустым кодом, latency_ms —
+время на кадр (mean/p50/p95/max). С --expected nodes_qr.json ещё correct_rate —
+доля кадров узлов с известным кодом, где найден именно он, и первые промахи
+(misses) с номером кадра — их можно достать из записи и разобрать по одному.
+
+    python bench/replay_frames.py data/frames.wdrf --expected data/nodes_qr.json
+    python bench/replay_frames.py data/frames.wdrf --backends multi,opencv --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+BACKENDS = ('multi', 'mission', 'pyzbar', 'opencv')
+MAX_MISSES = 20
+
+_log = None
+_backends = None
+
+
+def _codes(result):
+    if isinstance(result, str):
+        return [result] if result else []
+    return [item['data'] for item in result if item.get('data')]
+
+
+def _init_worker(path, names):
+    global _log, _backends
+    import dronecontroller
+    from framelog import FrameLog
+    _log = FrameLog(path)
+    # Параллелим по кадрам: внутренние потоки OpenCV в каждом процессе только мешают
+    cv2 = dronecontroller._cv2()
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+    table = {
+        'multi': dronecontroller._detect_qr_multi,
+        'mission': dronecontroller._decode_qr,
+        'pyzbar': dronecontroller._detect_qr_pyzbar,
+        'opencv': dronecontroller._detect_qr_opencv,
+    }
+    _backends = [(name, table[name]) for name in names]
+
+
+def _replay_chunk(indices):
+    out = []
+    for k in indices:
+        meta = _log.meta(k)
+        frame = _log.frame(k)
+        row = {'seq': meta['seq'], 'node_id': meta['node_id'], 'source': meta['source'], 'results': {}}
+        for name, fn in _backends:
+            t0 = time.perf_counter()
+            codes = _codes(fn(frame))
+            row['results'][name] = (time.perf_counter() - t0, codes)
+        out.append(row)
+    return out
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[k]
+
+
+def summarize(rows, names, expected=None):
+    report = {}
+    for name in names:
+        lat = sorted(r['results'][name][0] * 1000 for r in rows)
+        decoded = sum(1 for r in rows if r['results'][name][1])
+        item = {
+            'frames': len(rows),
+            'decoded': decoded,
+            'decode_rate': round(decoded / len(rows), 3) if rows else None,
+            'latency_ms': {
+                'mean': round(sum(lat) / len(lat), 2) if lat else None,
+                'p50': round(_percentile(lat, 0.5), 2) if lat else None,
+                'p95': round(_percentile(lat, 0.95), 2) if lat else None,
+                'max': round(lat[-1], 2) if lat else None,
+            },
+        }
+        if expected is not None:
+            known = [r for r in rows if expected.get(r['node_id'])]
+            misses = [r for r in known if expected[r['node_id']] not in r['results'][name][1]]
+            item['known_frames'] = len(known)
+            item['correct_rate'] = round(1 - len(misses) / len(known), 3) if known else None
+            item['misses'] = [{'seq': r['seq'], 'node_id': r['node_id'], 'source': r['source'],
+                               'found': r['results'][name][1]} for r in misses[:MAX_MISSES]]
+        report[name] = item
+    return report
+
+
+def replay(path, names, workers=None, source=None, limit=None, expected=None):
+    from framelog import FrameLog
+    log = FrameLog(path)
+    indices = [k for k in range(len(log)) if source is None or log.meta(k)['source'] == source]
+    if limit:
+        indices = indices[:limit]
+    workers = max(1, workers or os.cpu_count() or 1)
+    chunk = max(1, len(indices) // (workers * 4))
+    chunks = [indices[i:i + chunk] for i in range(0, len(indices), chunk)]
+    t0 = time.perf_counter()
+    rows = []
+    with Pool(workers, initializer=_init_worker, initargs=(str(path), names)) as pool:
+        for part in pool.imap_unordered(_replay_chunk, chunks):
+            rows.extend(part)
+    wall = time.perf_counter() - t0
+    rows.sort(key=lambda r: r['seq'])
+    return {
+        'recording': str(path),
+        'frames': len(rows),
+        'workers': workers,
+        'wall_sec': round(wall, 3),
+        'frames_per_sec': round(len(rows) / wall, 1) if wall > 0 else None,
+        'backends': summarize(rows, names, expected),
+    }
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('recording')
+    p.add_argument('--backends', default=','.join(BACKENDS))
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--source', choices=('mission', 'stream', 'other'), default=None)
+    p.add_argument('--limit', type=int, default=None)
+    p.add_argument('--expected', default=None, help='nodes_qr.json: узел -> ожидаемый код')
+    args = p.parse_args()
+    names = [n.strip() for n in args.backends.split(',') if n.strip()]
+    unknown = [n for n in names if n not in BACKENDS]
+    if unknown:
+        p.error(f"unknown backends: {', '.join(unknown)}")
+    expected = None
+    if args.expected:
+        with open(args.expected, 'r', encoding='utf-8') as f:
+            expected = {k: str(v).strip() for k, v in json.load(f).items() if v}
+    report = replay(args.recording, names, workers=args.workers, source=args.source,
+                    limit=args.limit, expected=expected)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
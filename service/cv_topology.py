@@ -6,6 +6,8 @@ import cv2
 import numpy as np
 from typing import Optional
 
+import metrics
+
 
 def _is_inside(inner: tuple, outer: tuple) -> bool:
     """Проверяет, что прямоугольник inner целиком внутри outer. (x, y, w, h)."""
@@ -18,6 +20,7 @@ def _is_inside(inner: tuple, outer: tuple) -> bool:
     )
 
 
+@metrics.timed(metrics.STAGE_SECONDS, stage="detect_walls_and_shelves")
 def detect_walls_and_shelves(
     image_path: Optional[str] = None,
     image_array: Optional[np.ndarray] = None,
@@ -1,109 +1,514 @@
 import base64
+import copy
 import json
 import logging
-import math
+import os
+import tempfile
 import threading
 import time
 import traceback
 from pathlib import Path
 
+import events
+import lazy
+import metrics
+import qr_store
+from arrival import ArrivalMonitor
+from mission_plan import mission_slots
+
 _log = logging.getLogger(__name__)
 
-try:
-    from pioneer_sdk import Pioneer, Camera
-    PIONEER_AVAILABLE = True
-except ImportError:
-    PIONEER_AVAILABLE = False
-    Pioneer = None
-    Camera = None
-
-try:
-    import cv2
-    CV_AVAILABLE = True
-except ImportError:
-    CV_AVAILABLE = False
-    cv2 = None
-
-try:
-    from pyzbar import pyzbar
-    PYZBAR_AVAILABLE = True
-except ImportError:
-    PYZBAR_AVAILABLE = False
-    pyzbar = None
-
-_mission_active = False
-_mission_thread = None
-_pioneer = None
-_camera = None
-_current_waypoint_index = -1
-_current_node_index = -1
-_qr_results = {}
-_qr_save_path = None
+# pioneer_sdk, OpenCV, pyzbar и NumPy (через waypoints) импортируются при первом
+# использовании, а не при импорте модуля (см. lazy.py)
+_waypoints = lazy.module('waypoints')
+_framelog = lazy.module('framelog')
+
+
+def _cv2():
+    return lazy.optional('cv2')
+
+
+def _pyzbar():
+    return lazy.optional('pyzbar.pyzbar')
+
+
 FLIGHT_HEIGHT = 1.5
+FRAME_SHARE_SEC = 0.03
+
+# Контрольная точка миссии: маршрут, параметры, индекс последней достигнутой клетки
+# и статус каждого узла осмотра (pending — не долетели, scanned — код снят, empty —
+# осмотрен, кода нет). Пишется на диск не чаще CHECKPOINT_INTERVAL и в конце миссии;
+# по ней mission_plan.resume_route строит продолжение прерванного облёта.
+CHECKPOINT_INTERVAL = 1.0
+
+
+class Drone:
+    """
+    Один дрон: подключение, камера, монитор прилёта (arrival.py), состояние миссии и
+    её контрольная точка. Функции модуля ниже работают с дроном по умолчанию, как
+    раньше; дополнительные дроны для параллельного облёта заводит fleet.py.
+
+    Бэкенд — фабрики подключения и камеры. Без них — pioneer_sdk с настройками по
+    умолчанию (импортируется при первом подключении); для прогонов без железа —
+    симулятор (sim/drone_sim.py). Объект дрона должен уметь arm, takeoff, land,
+    go_to_local_point, point_reached; камера — get_cv_frame.
+
+    Сервер может обслуживать запросы в нескольких потоках (serve.py): подключения к
+    дрону и камере создаются один раз, кадр с камеры читается по одному, а общие
+    кадры переиспользуются запросами, пришедшими в пределах FRAME_SHARE_SEC.
+    Результаты QR всех дронов пишутся в общий qr_store (со своей блокировкой).
+    """
+
+    def __init__(self, drone_id='default', pioneer_factory=None, camera_factory=None):
+        self.id = drone_id
+        self._backend_override = None if pioneer_factory is None else (pioneer_factory, camera_factory)
+        self._init_lock = threading.Lock()
+        self._camera_lock = threading.Lock()
+        self._mission_lock = threading.Lock()
+        self._pioneer = None
+        self._camera = None
+        self._monitor = None
+        self._last_frame = None
+        self._last_frame_time = 0.0
+        self._stream_recorded_at = float('-inf')
+        self._mission_active = False
+        self._mission_thread = None
+        self._current_waypoint_index = -1
+        self._current_node_index = -1
+        self._last_published_status = None
+        self._land_last_time = 0
+        self._checkpoint_path = None
+        self._checkpoint = None
+        self._checkpoint_saved = 0.0
+        self._checkpoint_lock = threading.Lock()
+
+    # --- подключение ---
+
+    def _backend(self):
+        """(фабрика дрона, фабрика камеры); (None, None), если бэкенда нет."""
+        override = self._backend_override
+        if override is not None:
+            return override
+        sdk = lazy.optional('pioneer_sdk')
+        if sdk is None:
+            return None, None
+        return sdk.Pioneer, sdk.Camera
+
+    def set_backend(self, pioneer_factory, camera_factory=None):
+        """Подменяет бэкенд. set_backend(None) возвращает pioneer_sdk."""
+        with self._init_lock:
+            if self._monitor is not None:
+                self._monitor.close()
+                self._monitor = None
+            self._backend_override = None if pioneer_factory is None else (pioneer_factory, camera_factory)
+            self._pioneer = None
+            self._camera = None
+            self._last_frame = None
+
+    def is_available(self):
+        return self._backend()[0] is not None
+
+    def get_pioneer(self):
+        if self._pioneer is None:
+            pioneer_factory = self._backend()[0]
+            if pioneer_factory is None:
+                return None
+            with self._init_lock:
+                if self._pioneer is None:
+                    self._pioneer = pioneer_factory()
+        return self._pioneer
+
+    def get_monitor(self, pioneer):
+        """Монитор прилёта в точку — один на подключение к дрону."""
+        if self._monitor is None or self._monitor.pioneer is not pioneer:
+            with self._init_lock:
+                if self._monitor is None or self._monitor.pioneer is not pioneer:
+                    if self._monitor is not None:
+                        self._monitor.close()
+                    self._monitor = ArrivalMonitor(pioneer)
+        return self._monitor
+
+    def leg_stats(self):
+        """Время полёта и задержка обнаружения прилёта по последним отрезкам."""
+        monitor = self._monitor
+        if monitor is None:
+            return {'summary': {'legs': 0, 'reached': 0, 'timeouts': 0}, 'legs': []}
+        return monitor.stats()
+
+    def get_camera(self):
+        if self._camera is None:
+            camera_factory = self._backend()[1]
+            if camera_factory is None:
+                return None
+            with self._init_lock:
+                if self._camera is None:
+                    try:
+                        self._camera = camera_factory()
+                    except Exception:
+                        pass
+        return self._camera
+
+    def grab_frame(self, cam, max_age=FRAME_SHARE_SEC):
+        """Кадр с камеры; параллельные запросы получают один и тот же свежий кадр."""
+        with self._camera_lock:
+            now = time.monotonic()
+            if self._last_frame is not None and now - self._last_frame_time <= max_age:
+                return self._last_frame
+            with metrics.timer(metrics.STAGE_SECONDS, stage='camera_read'):
+                frame = cam.get_cv_frame()
+            self._last_frame = frame
+            self._last_frame_time = time.monotonic()
+            return frame
+
+    def pose(self):
+        """Последняя известная позиция дрона (x, y, z) или None — без нового подключения."""
+        getter = getattr(self._pioneer, 'get_local_position_lps', None)
+        if getter is None:
+            return None
+        try:
+            pos = getter(get_last_received=True)
+        except Exception:
+            return None
+        if pos is None or len(pos) < 3:
+            return None
+        return tuple(float(v) for v in pos[:3])
+
+    # --- статус ---
+
+    def get_status(self):
+        return {
+            'mission_active': self._mission_active,
+            'available': self.is_available(),
+            'current_waypoint_index': self._current_waypoint_index,
+            'current_node_index': self._current_node_index,
+        }
+
+    def _publish_status(self):
+        """Публикует статус миссии, если он изменился с прошлой публикации."""
+        status = self.get_status()
+        if status != self._last_published_status:
+            self._last_published_status = status
+            # Дрон по умолчанию — тема 'drone', как раньше; дроны флота — 'drone/<id>'
+            topic = 'drone' if self is _default else f'drone/{self.id}'
+            events.publish(topic, status if topic == 'drone' else {'drone': self.id, **status}, retain=True)
+
+    def _set_progress(self, idx):
+        self._current_waypoint_index = idx
+        self._current_node_index = idx
+        self._publish_status()
+
+    def is_mission_active(self):
+        return self._mission_active
+
+    def current_node_id(self):
+        """Узел маршрута, где сейчас дрон, по контрольной точке миссии ('' вне миссии)."""
+        idx = self._current_node_index
+        if not self._mission_active or idx < 0:
+            return ''
+        with self._checkpoint_lock:
+            route = (self._checkpoint or {}).get('route') or []
+            return route[idx].get('id', '') if idx < len(route) else ''
+
+    # --- контрольная точка ---
+
+    def set_checkpoint_path(self, path):
+        """Задаёт файл контрольной точки и загружает последнюю сохранённую."""
+        self._checkpoint_path = Path(path) if path else None
+        data = None
+        if self._checkpoint_path and self._checkpoint_path.exists():
+            try:
+                with open(self._checkpoint_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception:
+                _log.exception('failed to load %s', self._checkpoint_path)
+        if isinstance(data, dict) and data.get('status') == 'running':
+            # Сервер перезапустили посреди миссии
+            data['status'] = 'interrupted'
+        with self._checkpoint_lock:
+            self._checkpoint = data if isinstance(data, dict) else None
+
+    def get_checkpoint(self):
+        with self._checkpoint_lock:
+            return copy.deepcopy(self._checkpoint)
+
+    def _save_checkpoint(self, force=False):
+        with self._checkpoint_lock:
+            if self._checkpoint is None or self._checkpoint_path is None:
+                return
+            now = time.monotonic()
+            if not force and now - self._checkpoint_saved < CHECKPOINT_INTERVAL:
+                return
+            self._checkpoint_saved = now
+            self._checkpoint['updated'] = time.time()
+            text = json.dumps(self._checkpoint, ensure_ascii=False)
+            path = self._checkpoint_path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except Exception:
+            _log.exception('failed to save %s', path)
+
+    def _update_checkpoint(self, mission_id, force=False, progress=None, node=None, status=None):
+        """Обновляет контрольную точку миссии mission_id (чужую — не трогает)."""
+        with self._checkpoint_lock:
+            cp = self._checkpoint
+            if cp is None or cp.get('mission_id') != mission_id:
+                return
+            if progress is not None:
+                cp['progress_index'] = progress
+            if node is not None:
+                cp['nodes'][node[0]] = node[1]
+            if status is not None:
+                cp['status'] = status
+        self._save_checkpoint(force=force)
+
+    # --- миссия и ручное управление ---
+
+    def start_mission(self, route, meta, height=None, axis_y=None, return_start_index=None, resumed_from=None,
+                      transit_height=None):
+        """
+        Запускает облёт route в фоне. Элемент маршрута может нести 'scan': False —
+        клетка только транзитная (так строятся маршруты продолжения и облёта устаревших
+        узлов, см. mission_plan.py), и 'levels': [{level, z}] — уровни стеллажа, которые
+        снимаются в узле по очереди (mission_plan.plan_levels_route). height — высота
+        взлёта и транзита до первого уровня. transit_height — отдельный эшелон для
+        перелёта от дома до первого узла осмотра и возврата домой (флот разводит так
+        дронов по высоте, см. fleet.py); смена эшелона — только вертикально.
+        """
+        if not route or len(route) == 0:
+            return False, "Маршрут пуст"
+        if not self.is_available():
+            return False, "Дрон недоступен: нет pioneer_sdk и не задан другой бэкенд"
+        scale_x = float(meta.get('scaleX', 1))
+        scale_y = float(meta.get('scaleY', 1))
+        points = _cells_to_meters(route, scale_x, scale_y, axis_y=axis_y)
+        z = float(height) if height is not None else FLIGHT_HEIGHT
+        z = max(0.5, min(10.0, z))
+        if transit_height is not None:
+            transit_height = max(0.5, min(10.0, float(transit_height)))
+        with self._mission_lock:
+            # Проверка и запуск атомарны: два одновременных запроса не поднимут две миссии
+            if self._mission_active or (self._mission_thread is not None and self._mission_thread.is_alive()):
+                return False, "Миссия уже выполняется"
+            mission_id = int(time.time() * 1000)
+            with self._checkpoint_lock:
+                self._checkpoint = {
+                    'mission_id': mission_id,
+                    'drone': self.id,
+                    'status': 'running',
+                    'started': time.time(),
+                    'route': route,
+                    'meta': {'scaleX': scale_x, 'scaleY': scale_y},
+                    'height': z,
+                    'transit_height': transit_height,
+                    'axis_y': axis_y,
+                    'return_start_index': return_start_index,
+                    'resumed_from': resumed_from,
+                    'progress_index': -1,
+                    'nodes': {key: 'pending' for key in mission_slots(route, return_start_index)},
+                }
+            self._save_checkpoint(force=True)
+            self._mission_thread = threading.Thread(
+                target=_run_mission_impl,
+                args=(points, z),
+                kwargs={'return_start_index': return_start_index, 'route': route,
+                        'mission_id': mission_id, 'drone': self, 'transit_height': transit_height},
+                name=f'mission-{self.id}',
+                daemon=True
+            )
+            self._mission_thread.start()
+        return True, "Миссия запущена"
+
+    def join(self, timeout=None):
+        """Ждёт окончания миссии. True — миссия не выполняется."""
+        thread = self._mission_thread
+        if thread is not None:
+            thread.join(timeout)
+        return not (thread is not None and thread.is_alive())
+
+    def land_manual(self):
+        self._mission_active = False
+        self._publish_status()
+        if self._monitor is not None:
+            self._monitor.cancel()
+        with self._mission_lock:
+            now = time.time()
+            if now - self._land_last_time < LAND_COOLDOWN:
+                return
+            self._land_last_time = now
+        pioneer = self.get_pioneer()
+        if pioneer:
+            try:
+                pioneer.land()
+            except Exception:
+                pass
+
+    def takeoff(self):
+        pioneer = self.get_pioneer()
+        if pioneer:
+            monitor = self.get_monitor(pioneer)
+            pioneer.takeoff()
+            monitor.begin(kind='takeoff', timeout=POINT_WAIT_TIMEOUT)
+            monitor.wait()
+            time.sleep(2)
+
+    def land(self):
+        pioneer = self.get_pioneer()
+        if pioneer:
+            monitor = self.get_monitor(pioneer)
+            pioneer.land()
+            monitor.begin(kind='land', timeout=POINT_WAIT_TIMEOUT)
+            monitor.wait()
+
+    def go_to_local_point(self, x, y, z, yaw=0):
+        pioneer = self.get_pioneer()
+        if pioneer:
+            monitor = self.get_monitor(pioneer)
+            pioneer.go_to_local_point(x=x, y=y, z=z, yaw=yaw)
+            monitor.begin(target=(x, y, z))
+            monitor.wait()
+
+
+# Дрон по умолчанию: с ним работают UI, app.py и функции ниже
+_default = Drone()
+
+
+def get_drone():
+    return _default
+
+
+def set_drone_backend(pioneer_factory, camera_factory=None):
+    """Подменяет бэкенд дрона по умолчанию. set_drone_backend(None) возвращает pioneer_sdk."""
+    _default.set_backend(pioneer_factory, camera_factory)
 
 
 def _get_pioneer():
-    global _pioneer
-    if _pioneer is None and PIONEER_AVAILABLE:
-        _pioneer = Pioneer()
-    return _pioneer
+    return _default.get_pioneer()
 
 
 def _get_camera():
-    global _camera
-    if _camera is None and Camera is not None:
-        try:
-            _camera = Camera()
-        except Exception:
-            pass
-    return _camera
+    return _default.get_camera()
+
+
+def _grab_frame(cam, max_age=FRAME_SHARE_SEC):
+    return _default.grab_frame(cam, max_age=max_age)
+
+
+def get_leg_stats():
+    """Время полёта и задержка обнаружения прилёта по последним отрезкам."""
+    return _default.leg_stats()
+
+
+# Запись кадров (framelog.py) для офлайн-разбора пропусков QR; None — не пишем
+_recorder = None
+_recorder_lock = threading.Lock()
+# Кадры видеопотока пишутся в ту же запись, что и снимки узлов, и без ограничения
+# вытеснили бы их (слот — сырой кадр до 921 КБ; 256 МБ — около 280 слотов, 30 с
+# просмотра при 10 к/с). Поэтому кадр потока пишется только во время миссии этого
+# дрона и не чаще раза в STREAM_RECORD_SEC; 0 — кадры потока не пишутся.
+STREAM_RECORD_SEC = float(os.environ.get('WDR_FRAME_RECORD_STREAM_SEC', '2.0'))
+
+
+def set_frame_recorder(path, size_mb=None, max_frame_bytes=None):
+    """
+    Включает запись кадров миссии и видеопотока в кольцевой буфер path размером
+    size_mb МБ (кадры потока — только во время миссии, см. STREAM_RECORD_SEC);
+    path=None — выключает. Возвращает get_frame_recorder_stats().
+    """
+    global _recorder
+    with _recorder_lock:
+        if _recorder is not None:
+            _recorder.close()
+            _recorder = None
+        if path:
+            kwargs = {}
+            if size_mb is not None:
+                kwargs['size_mb'] = size_mb
+            if max_frame_bytes is not None:
+                kwargs['max_frame_bytes'] = max_frame_bytes
+            _recorder = _framelog.FrameRecorder(path, **kwargs)
+    return get_frame_recorder_stats()
+
+
+def get_frame_recorder_stats():
+    rec = _recorder
+    if rec is None:
+        return {'enabled': False}
+    return {'enabled': True, **rec.stats()}
+
+
+def _record_frame(frame, source, node_id=None, drone=None):
+    rec = _recorder
+    if rec is None or frame is None:
+        return
+    drone = drone or _default
+    if source == 'stream':
+        now = time.monotonic()
+        if (STREAM_RECORD_SEC <= 0 or not drone._mission_active
+                or now - drone._stream_recorded_at < STREAM_RECORD_SEC):
+            return
+        drone._stream_recorded_at = now
+    try:
+        with metrics.timer(metrics.STAGE_SECONDS, stage='frame_record'):
+            rec.append(frame, source=source, node_id=node_id, pose=drone.pose())
+    except Exception:
+        _log.exception('frame record failed')
 
 
 def set_qr_save_path(path):
-    global _qr_save_path, _qr_results
-    _qr_save_path = Path(path) if path else None
-    if _qr_save_path and _qr_save_path.exists():
-        try:
-            with open(_qr_save_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                _qr_results = {k: v for k, v in (data if isinstance(data, dict) else {}).items()
-                               if v and str(v).strip()}
-        except Exception:
-            _qr_results = {}
+    qr_store.store.load(path)
 
 
 def get_qr_results():
-    return dict(_qr_results)
+    return qr_store.store.snapshot()[1]
 
 
-def _save_qr_results():
-    if _qr_save_path:
-        try:
-            _qr_save_path.parent.mkdir(parents=True, exist_ok=True)
-            to_save = {k: v for k, v in _qr_results.items() if v and str(v).strip()}
-            with open(_qr_save_path, 'w', encoding='utf-8') as f:
-                json.dump(to_save, f, ensure_ascii=False, indent=2)
-        except Exception:
-            pass
+def _record_qr(node_id, decoded):
+    qr_store.store.record(node_id, decoded)
+
+
+def set_checkpoint_path(path):
+    """Задаёт файл контрольной точки и загружает последнюю сохранённую."""
+    _default.set_checkpoint_path(path)
+
+
+def get_checkpoint():
+    return _default.get_checkpoint()
+
+
+def _qr_call(backend, fn, *args):
+    """Вызов декодера QR; при включённых метриках — с замером времени и признаком находки."""
+    if not metrics.is_enabled():
+        return fn(*args)
+    t0 = time.perf_counter()
+    res = fn(*args)
+    found = bool(res[0]) if isinstance(res, tuple) else bool(res)
+    metrics.QR_DECODE_SECONDS.observe(time.perf_counter() - t0, backend=backend, found=int(found))
+    return res
 
 
 def _decode_qr(frame):
     if frame is None:
         return ''
-    if PYZBAR_AVAILABLE and pyzbar is not None:
+    pyzbar = _pyzbar()
+    if pyzbar is not None:
         try:
-            decoded = pyzbar.decode(frame)
+            decoded = _qr_call('pyzbar', pyzbar.decode, frame)
             for obj in decoded:
                 if obj.type == 'QRCODE' and obj.data:
                     return obj.data.decode('utf-8', errors='replace').strip()
         except Exception:
             pass
-    if CV_AVAILABLE and cv2 is not None:
+    cv2 = _cv2()
+    if cv2 is not None:
         try:
             gray = _frame_for_qr(frame)
             if gray is not None:
                 det = cv2.QRCodeDetector()
-                data, _, _ = det.detectAndDecode(gray)
+                data, _, _ = _qr_call('opencv_single', det.detectAndDecode, gray)
                 return (data or '').strip()
         except Exception:
             pass
@@ -115,7 +520,8 @@ STREAM_JPEG_QUALITY = 75
 
 
 def _frame_for_qr(frame):
-    if frame is None or not CV_AVAILABLE or cv2 is None:
+    cv2 = _cv2()
+    if frame is None or cv2 is None:
         return None
     if len(frame.shape) == 3:
         return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
@@ -123,12 +529,13 @@ def _frame_for_qr(frame):
 
 
 def _detect_qr_pyzbar(frame, debug_out=None):
-    if not PYZBAR_AVAILABLE or pyzbar is None or frame is None:
+    pyzbar = _pyzbar()
+    if pyzbar is None or frame is None:
         if debug_out is not None:
-            debug_out['pyzbar_available'] = PYZBAR_AVAILABLE
+            debug_out['pyzbar_available'] = pyzbar is not None
         return []
     try:
-        decoded = pyzbar.decode(frame)
+        decoded = _qr_call('pyzbar', pyzbar.decode, frame)
         if debug_out is not None:
             debug_out['pyzbar_count'] = len(decoded)
         out = []
@@ -159,7 +566,8 @@ def _detect_qr_pyzbar(frame, debug_out=None):
 
 
 def _detect_qr_opencv(frame, debug_out=None):
-    if not CV_AVAILABLE or cv2 is None or frame is None:
+    cv2 = _cv2()
+    if cv2 is None or frame is None:
         return []
     gray = _frame_for_qr(frame)
     if gray is None:
@@ -167,7 +575,7 @@ def _detect_qr_opencv(frame, debug_out=None):
     try:
         det = cv2.QRCodeDetector()
         try:
-            retval, decoded_info, points, _ = det.detectAndDecodeMulti(gray)
+            retval, decoded_info, points, _ = _qr_call('opencv_multi', det.detectAndDecodeMulti, gray)
             if debug_out is not None:
                 debug_out['opencv_detector'] = 'multi'
                 debug_out['opencv_retval'] = bool(retval)
@@ -188,7 +596,7 @@ def _detect_qr_opencv(frame, debug_out=None):
         except Exception as e1:
             if debug_out is not None:
                 debug_out['opencv_multi_error'] = str(e1)
-        data, bbox, _ = det.detectAndDecode(gray)
+        data, bbox, _ = _qr_call('opencv_single', det.detectAndDecode, gray)
         if debug_out is not None:
             debug_out['opencv_detector'] = 'single'
             debug_out['opencv_single_data'] = (data or '')[:80]
@@ -206,8 +614,8 @@ def _detect_qr_opencv(frame, debug_out=None):
 
 def _detect_qr_multi(frame, debug_out=None):
     if debug_out is not None:
-        debug_out['cv_available'] = CV_AVAILABLE
-        debug_out['pyzbar_available'] = PYZBAR_AVAILABLE
+        debug_out['cv_available'] = _cv2() is not None
+        debug_out['pyzbar_available'] = _pyzbar() is not None
         debug_out['frame_is_none'] = frame is None
         if frame is not None:
             try:
@@ -231,34 +639,49 @@ def _detect_qr_multi(frame, debug_out=None):
     return out
 
 
-def get_camera_frame_jpeg():
-    cam = _get_camera()
+def get_camera_frame_jpeg(drone=None):
+    drone = drone or _default
+    cam = drone.get_camera()
     if cam is None:
         return None
     try:
-        frame = cam.get_cv_frame()
+        frame = drone.grab_frame(cam)
         if frame is None:
             return None
-        if CV_AVAILABLE and cv2 is not None:
-            _, buf = cv2.imencode('.jpg', frame)
+        cv2 = _cv2()
+        if cv2 is not None:
+            with metrics.timer(metrics.STAGE_SECONDS, stage='jpeg_encode'):
+                _, buf = cv2.imencode('.jpg', frame)
             return buf.tobytes()
         return None
     except Exception:
         return None
 
 
-def get_camera_frame_with_qr(skip_qr=False):
+def get_camera_frame_with_qr(skip_qr=False, drone=None, max_width=None, quality=None):
+    """
+    Кадр для видеопотока страницы: JPEG в base64 шириной не больше max_width и с
+    качеством quality (по умолчанию STREAM_MAX_WIDTH / STREAM_JPEG_QUALITY; их
+    подбирает под клиента streaming.StreamController) и найденные QR-коды.
+    QR ищутся по кадру в исходном разрешении, их точки пересчитываются в
+    координаты отданного кадра.
+    """
+    drone = drone or _default
+    max_width = int(max_width or STREAM_MAX_WIDTH)
+    quality = int(quality or STREAM_JPEG_QUALITY)
     debug = {}
-    cam = _get_camera()
+    cam = drone.get_camera()
     if cam is None:
         debug['camera'] = 'none'
         return {'image': None, 'width': 0, 'height': 0, 'qr': [], 'debug': debug}
     try:
-        frame = cam.get_cv_frame()
+        frame = drone.grab_frame(cam)
         if frame is None:
             debug['frame'] = 'none'
             return {'image': None, 'width': 0, 'height': 0, 'qr': [], 'debug': debug}
-        if not CV_AVAILABLE or cv2 is None:
+        _record_frame(frame, 'stream', drone.current_node_id(), drone=drone)
+        cv2 = _cv2()
+        if cv2 is None:
             debug['cv'] = 'unavailable'
             return {'image': None, 'width': 0, 'height': 0, 'qr': [], 'debug': debug}
         try:
@@ -267,22 +690,27 @@ def get_camera_frame_with_qr(skip_qr=False):
             pass
         h, w = frame.shape[:2]
         debug['original_size'] = [h, w]
-        if w > STREAM_MAX_WIDTH:
-            scale = STREAM_MAX_WIDTH / w
-            new_w = STREAM_MAX_WIDTH
+        qr_list = [] if skip_qr else _detect_qr_multi(frame, debug_out=debug)
+        if w > max_width:
+            scale = max_width / w
+            new_w = max_width
             new_h = int(h * scale)
-            frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+            with metrics.timer(metrics.STAGE_SECONDS, stage='frame_resize'):
+                frame = cv2.resize(frame, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
             h, w = new_h, new_w
+            for qr in qr_list:
+                qr['points'] = [[round(p[0] * scale, 1), round(p[1] * scale, 1)] for p in qr['points']]
         debug['resized'] = [h, w]
-        qr_list = [] if skip_qr else _detect_qr_multi(frame, debug_out=debug)
-        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), STREAM_JPEG_QUALITY]
-        _, buf = cv2.imencode('.jpg', frame, encode_params)
+        debug['jpeg_quality'] = quality
+        encode_params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        with metrics.timer(metrics.STAGE_SECONDS, stage='jpeg_encode'):
+            _, buf = cv2.imencode('.jpg', frame, encode_params)
         b64 = base64.b64encode(buf.tobytes()).decode('ascii')
         debug['jpeg_len'] = len(b64)
         if qr_list:
-            _log.info('frame_with_qr: size=%s qr_count=%s', [h, w], len(qr_list))
+            _log.info('frame_with_qr: size=%s qr_count=%s', debug['original_size'], len(qr_list))
         elif not skip_qr and (debug.get('no_codes') or debug.get('multi_error') or debug.get('single_error')):
-            _log.debug('frame_with_qr: size=%s debug=%s', [h, w], debug)
+            _log.debug('frame_with_qr: size=%s debug=%s', debug['original_size'], debug)
         return {'image': b64, 'width': w, 'height': h, 'qr': qr_list, 'debug': debug}
     except Exception as e:
         debug['exception'] = str(e)
@@ -292,19 +720,27 @@ def get_camera_frame_with_qr(skip_qr=False):
 
 
 def is_available():
-    return PIONEER_AVAILABLE
+    return _default.is_available()
+
+
+def get_status():
+    return _default.get_status()
+
+
+def _publish_status():
+    _default._publish_status()
 
 
 def is_mission_active():
-    return _mission_active
+    return _default.is_mission_active()
 
 
 def get_current_waypoint_index():
-    return _current_waypoint_index
+    return _default._current_waypoint_index
 
 
 def get_current_node_index():
-    return _current_node_index
+    return _default._current_node_index
 
 
 HOVER_SEC = 0.5
@@ -312,114 +748,116 @@ POINT_WAIT_TIMEOUT = 90
 TAKEOFF_PAUSE = 3.5
 
 
-def _wait_point_reached(pioneer):
-    start = time.time()
-    while not pioneer.point_reached():
-        if not _mission_active:
-            return False
-        if time.time() - start > POINT_WAIT_TIMEOUT:
-            _log.warning('point_reached timeout (%.0fs), proceeding', POINT_WAIT_TIMEOUT)
-            return True
-        time.sleep(0.1)
-    return True
+def _wait_point_reached(pioneer, target=None, kind='waypoint', timeout=None, drone=None, generation=None):
+    """
+    Ждёт прилёта после команды дрону (см. arrival.py). False — миссию прервали;
+    по таймауту, как и раньше, миссия продолжается со следующей точки. generation —
+    номер отмены монитора на старте миссии (ArrivalMonitor.generation).
+    """
+    drone = drone or _default
+    monitor = drone.get_monitor(pioneer)
+    monitor.begin(target=target, kind=kind, timeout=timeout, generation=generation)
+    result = monitor.wait()
+    if result == 'timeout':
+        _log.warning('point_reached timeout (%s, drone %s), proceeding', kind, drone.id)
+    return result != 'cancelled' and (drone._mission_active or kind == 'land')
 
 
 def _cells_to_meters(route, scale_x, scale_y, axis_y=None):
-    waypoints_grid = []
-    for item in route:
-        i = item.get('i', 0)
-        j = item.get('j', 0)
-        gx = (i + 0.5) * scale_x
-        gy = (j + 0.5) * scale_y
-        waypoints_grid.append((gx, gy))
-
-    if not waypoints_grid:
-        return []
+    return [tuple(p) for p in _waypoints.cells_to_meters(route, scale_x, scale_y, axis_y=axis_y).tolist()]
+
 
-    if axis_y is None or (axis_y.get('di') == 0 and axis_y.get('dj') == 0):
-        return [(gx, gy) for gx, gy in waypoints_grid]
-
-    di = int(axis_y.get('di', 0))
-    dj = int(axis_y.get('dj', 1))
-    gx0, gy0 = waypoints_grid[0]
-    x_vec = (-dj * scale_x, di * scale_y)
-    y_vec = (di * scale_x, dj * scale_y)
-    lx = math.hypot(x_vec[0], x_vec[1]) or 1.0
-    ly = math.hypot(y_vec[0], y_vec[1]) or 1.0
-    points = []
-    for gx, gy in waypoints_grid:
-        vx = gx - gx0
-        vy = gy - gy0
-        local_x = (vx * x_vec[0] + vy * x_vec[1]) / lx
-        local_y = (vx * y_vec[0] + vy * y_vec[1]) / ly
-        points.append((local_x, local_y))
-    return points
-
-
-def _run_mission_impl(points, height=None, return_start_index=None, route=None):
-    global _mission_active, _current_waypoint_index, _current_node_index, _qr_results
+def _run_mission_impl(points, height=None, return_start_index=None, route=None, mission_id=None, drone=None,
+                      transit_height=None):
+    drone = drone or _default
     z = height if height is not None else FLIGHT_HEIGHT
-    pioneer = _get_pioneer()
-    camera = _get_camera()
-    if not pioneer or not PIONEER_AVAILABLE:
+    try:
+        pioneer = drone.get_pioneer()
+    except Exception:
+        _log.exception('drone %s: connection failed', drone.id)
+        pioneer = None
+    camera = drone.get_camera()
+    if not pioneer:
+        drone._update_checkpoint(mission_id, force=True, status='failed')
         return
+    status = 'aborted'
     try:
-        _mission_active = True
-        _current_waypoint_index = -1
+        drone._mission_active = True
+        # Отмена (land_manual) после этой точки прерывает и ещё не начатые отрезки
+        generation = drone.get_monitor(pioneer).generation()
+        drone._set_progress(-1)
+
+        def fly(target):
+            # Посадку могли запросить после проверки в начале шага — проверяем перед командой
+            if not drone._mission_active:
+                return False
+            pioneer.go_to_local_point(x=target[0], y=target[1], z=target[2], yaw=0)
+            return _wait_point_reached(pioneer, target=target, drone=drone, generation=generation)
+
         pioneer.arm()
         time.sleep(1)
         pioneer.takeoff()
         time.sleep(TAKEOFF_PAUSE)
-        if points:
-            pioneer.go_to_local_point(x=points[0][0], y=points[0][1], z=z, yaw=0)
-            if not _wait_point_reached(pioneer):
-                pioneer.land()
-                return
-            _current_waypoint_index = 0
-            _current_node_index = 0
-            if route and len(route) > 0 and camera:
-                frame = camera.get_cv_frame()
-                node_id = route[0].get('id', '0_0')
-                decoded = _decode_qr(frame) if frame is not None else ''
-                if decoded and decoded.strip():
-                    _qr_results[node_id] = decoded.strip()
-                    _save_qr_results()
-            if not _mission_active:
-                pioneer.land()
-                return
-            if return_start_index is None or 0 < return_start_index:
-                x0, y0 = points[0]
-                pioneer.go_to_local_point(x=x0, y=y0, z=z, yaw=0)
-                time.sleep(HOVER_SEC)
-
-        for idx in range(1, len(points)):
-            if not _mission_active:
+        # Снимок и зависание — только на узлах осмотра; прямой транзит — одним отрезком
+        waypoints = _waypoints.compile_waypoints(route, points, return_start_index) if route else [
+            {'index': k, 'x': x, 'y': y, 'scan': False, 'hover': False} for k, (x, y) in enumerate(points)]
+        _log.info('mission (drone %s): %d cells -> %d legs, %d scans', drone.id, len(points), len(waypoints),
+                  sum(1 for wp in waypoints if wp['scan']))
+        first_scan = next((wp['index'] for wp in waypoints if wp['scan']), len(points))
+        here = None
+        for wp in waypoints:
+            if not drone._mission_active:
                 break
-            x, y = points[idx]
-            pioneer.go_to_local_point(x=x, y=y, z=z, yaw=0)
-            if not _wait_point_reached(pioneer):
-                pioneer.land()
-                return
-            _current_waypoint_index = idx
-            _current_node_index = idx
-            if route and idx < len(route) and camera:
-                frame = camera.get_cv_frame()
+            x, y, idx = wp['x'], wp['y'], wp['index']
+            transit = transit_height is not None and (
+                idx < first_scan or (return_start_index is not None and idx >= return_start_index))
+            wz = transit_height if transit else z
+            legs = [(x, y, wz)]
+            if here is not None and transit_height is not None and wz != here[2]:
+                # Смена эшелона — вертикально: подъём над текущей точкой, спуск над следующей
+                legs = [(here[0], here[1], wz), legs[0]] if wz > here[2] else [(x, y, here[2]), legs[0]]
+            for target in legs:
+                if not fly(target):
+                    pioneer.land()
+                    return
+            here = legs[-1]
+            drone._set_progress(idx)
+            if wp['scan'] and camera:
                 node_id = route[idx].get('id', '0_0')
-                decoded = _decode_qr(frame) if frame is not None else ''
-                if decoded and decoded.strip():
-                    _qr_results[node_id] = decoded.strip()
-                    _save_qr_results()
-            if not _mission_active:
+                levels = route[idx].get('levels')
+                for lv in levels or [None]:
+                    if lv is not None:
+                        # Следующий уровень стеллажа: только подъём или спуск над узлом
+                        z = float(lv['z'])
+                        if not fly((x, y, z)):
+                            pioneer.land()
+                            return
+                        here = (x, y, z)
+                    slot = qr_store.slot_key(node_id, lv['level'] if lv is not None else None)
+                    frame = drone.grab_frame(camera, max_age=0)
+                    _record_frame(frame, 'mission', slot, drone=drone)
+                    decoded = _decode_qr(frame) if frame is not None else ''
+                    if decoded and decoded.strip():
+                        _record_qr(slot, decoded.strip())
+                    else:
+                        qr_store.store.mark_seen(slot)
+                    drone._update_checkpoint(mission_id, progress=idx,
+                                             node=(slot, 'scanned' if decoded and decoded.strip() else 'empty'))
+            else:
+                drone._update_checkpoint(mission_id, progress=idx)
+            if not drone._mission_active:
                 break
-            on_return = return_start_index is not None and idx >= return_start_index
-            if not on_return:
-                pioneer.go_to_local_point(x=x, y=y, z=z, yaw=0)
+            if wp['hover']:
+                pioneer.go_to_local_point(x=x, y=y, z=here[2], yaw=0)
                 time.sleep(HOVER_SEC)
 
-        if _mission_active:
+        if drone._mission_active:
+            status = 'completed'
             pioneer.land()
-            _wait_point_reached(pioneer)
+            _wait_point_reached(pioneer, kind='land', timeout=POINT_WAIT_TIMEOUT, drone=drone,
+                                generation=generation)
     except Exception as e:
+        status = 'failed'
         if pioneer:
             try:
                 pioneer.land()
@@ -427,71 +865,33 @@ def _run_mission_impl(points, height=None, return_start_index=None, route=None):
                 pass
         raise e
     finally:
-        _mission_active = False
-        _current_waypoint_index = -1
-        _current_node_index = -1
-
-
-def start_mission(route, meta, height=None, axis_y=None, return_start_index=None):
-    global _mission_thread, _mission_active
-    if _mission_active:
-        return False, "Миссия уже выполняется"
-    if not route or len(route) == 0:
-        return False, "Маршрут пуст"
-    scale_x = float(meta.get('scaleX', 1))
-    scale_y = float(meta.get('scaleY', 1))
-    points = _cells_to_meters(route, scale_x, scale_y, axis_y=axis_y)
-    z = float(height) if height is not None else FLIGHT_HEIGHT
-    z = max(0.5, min(10.0, z))
-    _mission_thread = threading.Thread(
-        target=_run_mission_impl,
-        args=(points, z),
-        kwargs={'return_start_index': return_start_index, 'route': route},
-        daemon=True
-    )
-    _mission_thread.start()
-    return True, "Миссия запущена"
-
-
-_land_last_time = 0
+        drone._mission_active = False
+        drone._set_progress(-1)
+        drone._update_checkpoint(mission_id, force=True, status=status)
+
+
+def start_mission(route, meta, height=None, axis_y=None, return_start_index=None, resumed_from=None,
+                  transit_height=None):
+    """Облёт route дроном по умолчанию (см. Drone.start_mission)."""
+    return _default.start_mission(route, meta, height=height, axis_y=axis_y,
+                                  return_start_index=return_start_index, resumed_from=resumed_from,
+                                  transit_height=transit_height)
+
+
 LAND_COOLDOWN = 2.0
 
 
 def land_manual():
-    global _mission_active, _land_last_time
-    _mission_active = False
-    now = time.time()
-    if now - _land_last_time < LAND_COOLDOWN:
-        return
-    _land_last_time = now
-    pioneer = _get_pioneer()
-    if pioneer and PIONEER_AVAILABLE:
-        try:
-            pioneer.land()
-        except Exception:
-            pass
+    _default.land_manual()
 
 
 def takeoff():
-    pioneer = _get_pioneer()
-    if pioneer and PIONEER_AVAILABLE:
-        pioneer.takeoff()
-        while not pioneer.point_reached():
-            time.sleep(0.1)
-        time.sleep(2)
+    _default.takeoff()
 
 
 def land():
-    pioneer = _get_pioneer()
-    if pioneer and PIONEER_AVAILABLE:
-        pioneer.land()
-        while not pioneer.point_reached():
-            time.sleep(0.1)
+    _default.land()
 
 
 def go_to_local_point(x, y, z, yaw=0):
-    pioneer = _get_pioneer()
-    if pioneer and PIONEER_AVAILABLE:
-        pioneer.go_to_local_point(x=x, y=y, z=z, yaw=yaw)
-        while not pioneer.point_reached():
-            time.sleep(0.1)
+    _default.go_to_local_point(x, y, z, yaw=yaw)
@@ -0,0 +1,158 @@
+"""
+Шина событий для push-канала (Server-Sent Events).
+
+dronecontroller и robotcontroller публикуют сюда изменения состояния (прогресс
+миссии, новые QR-коды, ход поездки робота) — только когда состояние реально
+поменялось. app.py отдаёт их клиентам через /api/events, вместо того чтобы UI
+опрашивал статус в цикле.
+
+Каждый подписчик получает свою ограниченную очередь: медленный клиент теряет
+старые события, но не тормозит публикующие потоки. События с retain=True
+запоминаются по теме и сразу отдаются новому подписчику как текущий снимок.
+
+Каждый открытый поток /api/events всё время жизни занимает поток WSGI-сервера,
+поэтому одновременных потоков не больше MAX_STREAMS (serve.py ставит половину
+пула): сверх лимита /api/events отвечает 503, и клиент переходит на опрос.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SEC = 15.0
+MAX_STREAMS = int(os.environ.get('WDR_SSE_MAX_STREAMS', '4'))
+
+
+class Subscription:
+    def __init__(self, bus, topics):
+        self._bus = bus
+        self.topics = set(topics) if topics else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def wants(self, topic):
+        return self.topics is None or topic in self.topics
+
+    def put(self, event):
+        while True:
+            try:
+                self.queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+
+class EventBus:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = []
+        self._retained = {}
+        self._seq = 0
+
+    def publish(self, topic, data, retain=False):
+        with self._lock:
+            self._seq += 1
+            event = {'seq': self._seq, 'topic': topic, 'ts': time.time(), 'data': data}
+            if retain:
+                self._retained[topic] = event
+            subs = [s for s in self._subs if s.wants(topic)]
+        for s in subs:
+            s.put(event)
+        return event['seq']
+
+    def subscribe(self, topics=None):
+        sub = Subscription(self, topics)
+        with self._lock:
+            self._subs.append(sub)
+            snapshot = sorted((e for t, e in self._retained.items() if sub.wants(t)),
+                              key=lambda e: e['seq'])
+        for e in snapshot:
+            sub.put(e)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            if sub in self._subs:
+                self._subs.remove(sub)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs)
+
+
+bus = EventBus()
+
+
+class StreamSlot:
+    """Место в лимите MAX_STREAMS; release() можно звать сколько угодно раз."""
+
+    def __init__(self):
+        self._released = False
+
+    def release(self):
+        global _streams
+        with _streams_lock:
+            if not self._released:
+                self._released = True
+                _streams -= 1
+
+
+_streams = 0
+_streams_lock = threading.Lock()
+
+
+def acquire_stream():
+    """StreamSlot или None, если открыто уже MAX_STREAMS потоков."""
+    global _streams
+    with _streams_lock:
+        if _streams >= MAX_STREAMS:
+            return None
+        _streams += 1
+    return StreamSlot()
+
+
+def stream_count():
+    with _streams_lock:
+        return _streams
+
+
+def publish(topic, data, retain=False):
+    return bus.publish(topic, data, retain=retain)
+
+
+def format_sse(event):
+    data = json.dumps(event['data'], ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event['seq']}\nevent: {event['topic']}\ndata: {data}\n\n"
+
+
+def sse_stream(topics=None, heartbeat=HEARTBEAT_SEC, slot=None):
+    """
+    Генератор текста text/event-stream; отписывается, когда клиент отключился,
+    и освобождает slot (acquire_stream).
+    """
+    sub = bus.subscribe(topics)
+    try:
+        yield 'retry: 2000\n\n'
+        while True:
+            event = sub.get(timeout=heartbeat)
+            if event is None:
+                yield ': keepalive\n\n'
+                continue
+            yield format_sse(event)
+    finally:
+        sub.close()
+        if slot is not None:
+            slot.release()
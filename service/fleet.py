@@ -0,0 +1,333 @@
+"""
+Флот дронов для параллельного облёта склада.
+
+Каждый дрон флота — отдельный dronecontroller.Drone со своим подключением, камерой
+и состоянием миссии. Узлы делятся между дронами на компактные области почти
+равного размера (mission_plan.plan_fleet), области облетаются одновременно, коды
+всех дронов сливаются в общий qr_store.
+
+Дроны описываются в data/drones.json:
+    [{"id": "d1", "home": "0_0", "pioneer": {"ip": "192.168.4.1", "mavlink_port": 8001},
+      "camera": {"ip": "192.168.4.1", "port": 18001}, "axisY": {"di": 0, "dj": 1}}, ...]
+pioneer и camera — аргументы pioneer_sdk.Pioneer и Camera, home — узел графа, где
+дрон стоит перед взлётом (от него считаются его локальные координаты). Без
+drones.json флот — один дрон по умолчанию.
+
+Контрольная точка миссии каждого дрона флота — data/mission_checkpoint.<id>.json
+(set_checkpoint_dir): после сбоя или перезапуска сервиса resume() продолжает
+прерванные миссии всех дронов одновременно, каждого — только по неосмотренным узлам.
+
+Дроны летят одновременно, и перелёт от дома до своей области и возврат домой
+проходят над чужими областями. Поэтому транзит каждый дрон летит на своём эшелоне
+(transit_step, по умолчанию TRANSIT_STEP): дрон n — на (n + 1) * step выше самой
+высокой точки съёмки флота; в свою область дрон спускается и из неё поднимается
+вертикально. Съёмка при этом идёт на общей высоте. transit_step = 0 отключает
+эшелоны — тогда маршруты проверяются заранее (transit_conflicts), и флот не
+взлетает, если транзит одного дрона проходит через клетку маршрута другого или
+рядом с ней.
+
+altitude_step разносит по высоте и съёмку (дрон n снимает на height + n * step).
+По умолчанию 0: выше в кадр попадают коды соседних узлов, и снимок узла
+распознаётся хуже (на симуляторе с клеткой 1 м уже при +0.3 м).
+"""
+import json
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import dronecontroller
+import lazy
+from mission_plan import plan_fleet, resume_route
+
+_log = logging.getLogger(__name__)
+
+ALTITUDE_STEP = 0.0
+TRANSIT_STEP = 0.5
+
+_lock = threading.Lock()
+# id -> {'drone': Drone, 'home': id узла или None, 'axis_y': dict или None}
+_members = OrderedDict()
+_last_plan = None
+_checkpoint_dir = None
+
+
+def set_checkpoint_dir(path):
+    """Каталог контрольных точек дронов флота (задаётся до load_config)."""
+    global _checkpoint_dir
+    _checkpoint_dir = Path(path) if path else None
+
+
+def checkpoint_path(drone_id):
+    if _checkpoint_dir is None:
+        return None
+    safe = re.sub(r'[^\w.-]', '_', str(drone_id))
+    return _checkpoint_dir / f'mission_checkpoint.{safe}.json'
+
+
+def _sdk_factories(spec):
+    pioneer_kwargs = dict(spec.get('pioneer') or {})
+    camera_kwargs = dict(spec.get('camera') or {})
+
+    def pioneer_factory():
+        sdk = lazy.optional('pioneer_sdk')
+        if sdk is None:
+            raise RuntimeError('pioneer_sdk не установлен')
+        return sdk.Pioneer(**pioneer_kwargs)
+
+    def camera_factory():
+        sdk = lazy.optional('pioneer_sdk')
+        if sdk is None:
+            raise RuntimeError('pioneer_sdk не установлен')
+        return sdk.Camera(**camera_kwargs)
+
+    return pioneer_factory, camera_factory
+
+
+def add_drone(drone_id, pioneer_factory, camera_factory=None, home=None, axis_y=None):
+    """Добавляет (или заменяет) дрона флота с заданным бэкендом."""
+    drone_id = str(drone_id)
+    drone = dronecontroller.Drone(drone_id, pioneer_factory, camera_factory)
+    drone.set_checkpoint_path(checkpoint_path(drone_id))
+    with _lock:
+        old = _members.get(drone_id)
+        if old is not None and old['drone'].is_mission_active():
+            raise RuntimeError(f'Дрон {drone_id} выполняет миссию')
+        _members[drone_id] = {'drone': drone, 'home': home, 'axis_y': axis_y}
+    return drone
+
+
+def clear():
+    with _lock:
+        if any(m['drone'].is_mission_active() for m in _members.values()):
+            raise RuntimeError('Флот выполняет миссию')
+        _members.clear()
+
+
+def load_config(path):
+    """Загружает флот из drones.json (см. описание модуля). Нет файла — флота нет."""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            specs = json.load(f)
+    except Exception:
+        _log.exception('failed to load %s', path)
+        return 0
+    if not isinstance(specs, list):
+        _log.error('%s: ожидается список дронов', path)
+        return 0
+    clear()
+    for spec in specs:
+        if not isinstance(spec, dict) or not spec.get('id'):
+            continue
+        pioneer_factory, camera_factory = _sdk_factories(spec)
+        add_drone(spec['id'], pioneer_factory, camera_factory,
+                  home=spec.get('home'), axis_y=spec.get('axisY'))
+    return len(_members)
+
+
+def _members_snapshot():
+    with _lock:
+        if _members:
+            return [(drone_id, dict(m)) for drone_id, m in _members.items()]
+    # Флот не задан — летит дрон по умолчанию
+    return [('default', {'drone': dronecontroller.get_drone(), 'home': None, 'axis_y': None})]
+
+
+def get_drone(drone_id=None):
+    """Дрон флота по id; None или 'default' — дрон по умолчанию."""
+    if drone_id in (None, '', 'default'):
+        return dronecontroller.get_drone()
+    with _lock:
+        m = _members.get(str(drone_id))
+    return m['drone'] if m is not None else None
+
+
+def is_active():
+    return any(m['drone'].is_mission_active() for _, m in _members_snapshot())
+
+
+def _flies(route):
+    return any(item.get('scan') for item in route)
+
+
+def _transit_cells(route, return_start_index):
+    """Клетки перелёта от дома до первого узла осмотра и возврата домой."""
+    first = next((k for k, item in enumerate(route) if item.get('scan')), len(route))
+    back = len(route) if return_start_index is None else return_start_index
+    return [item for k, item in enumerate(route) if k < first or k >= back]
+
+
+def transit_conflicts(routes):
+    """
+    routes — [(route, return_start_index)] дронов флота. Возвращает пары индексов
+    (a, b): транзитная клетка дрона a совпадает с клеткой маршрута дрона b или
+    соседствует с ней (по восьми направлениям). На одной высоте такие дроны могут
+    встретиться в воздухе. Дроны без узлов осмотра не взлетают и не учитываются.
+    """
+    cells = [{(item.get('i', 0), item.get('j', 0)) for item in route} if _flies(route) else set()
+             for route, _ in routes]
+    out = []
+    for a, (route, return_start_index) in enumerate(routes):
+        if not cells[a]:
+            continue
+        near = {(item.get('i', 0) + di, item.get('j', 0) + dj)
+                for item in _transit_cells(route, return_start_index)
+                for di in (-1, 0, 1) for dj in (-1, 0, 1)}
+        out.extend((a, b) for b in range(len(routes)) if b != a and near & cells[b])
+    return out
+
+
+def _transit_heights(routes, heights, transit_step):
+    """
+    Эшелоны транзита: дрон n — на (n + 1) * transit_step выше самой высокой точки
+    съёмки флота (высоты дронов и уровни стеллажей). None — эшелоны отключены.
+    """
+    if transit_step <= 0:
+        return [None] * len(routes)
+    top = max([float(z) for z in heights] +
+              [float(lv['z']) for route, _ in routes for item in route for lv in item.get('levels') or ()])
+    return [top + (n + 1) * transit_step for n in range(len(routes))]
+
+
+def _check_separation(ids, routes, heights, transit_heights):
+    """Без эшелонов и с общей высотой съёмки — сообщение о пересечении маршрутов или None."""
+    if any(z is not None for z in transit_heights) or len({round(float(z), 2) for z in heights}) > 1:
+        return None
+    pairs = sorted({tuple(sorted((ids[a], ids[b]))) for a, b in transit_conflicts(routes)})
+    if not pairs:
+        return None
+    return ('Транзит дронов проходит через чужие маршруты на той же высоте: ' +
+            ', '.join(f'{a} и {b}' for a, b in pairs) + '. Задайте transit_step или altitude_step')
+
+
+def start(graph, meta, targets, height=None, axis_y=None, home=None, altitude_step=ALTITUDE_STEP,
+          transit_step=TRANSIT_STEP):
+    """
+    Делит targets между дронами флота и запускает их облёт одновременно.
+    home — дом для дронов без своего home в drones.json. Возвращает (ok, сообщение,
+    план: [{drone, home, height, transit_height, targets, route, return_start_index,
+    unreachable, ok, message}]).
+    """
+    global _last_plan
+    members = _members_snapshot()
+    if any(m['drone'].is_mission_active() for _, m in members):
+        return False, 'Миссия флота уже выполняется', None
+    homes = [m['home'] or home for _, m in members]
+    missing = [drone_id for (drone_id, _), h in zip(members, homes) if not h or not graph.has_node(h)]
+    if missing:
+        return False, f"Не задан или не найден домашний узел дронов: {', '.join(missing)}", None
+    base = float(height) if height is not None else dronecontroller.FLIGHT_HEIGHT
+    plans = plan_fleet(graph, targets, homes)
+    routes = [(plan['route'], plan['return_start_index']) for plan in plans]
+    heights = [base + n * altitude_step for n in range(len(plans))]
+    transits = _transit_heights(routes, heights, transit_step)
+    conflict = _check_separation([drone_id for drone_id, _ in members], routes, heights, transits)
+    if conflict:
+        return False, conflict, None
+    started = 0
+    out = []
+    for (drone_id, m), plan, z, zt in zip(members, plans, heights, transits):
+        item = {'drone': drone_id, 'height': round(z, 2), 'transit_height': None if zt is None else round(zt, 2),
+                **plan, 'ok': False, 'message': 'Нет узлов'}
+        if _flies(plan['route']):
+            ok, msg = m['drone'].start_mission(plan['route'], meta, height=z, axis_y=m['axis_y'] or axis_y,
+                                               return_start_index=plan['return_start_index'], transit_height=zt)
+            item['ok'], item['message'] = ok, msg
+            started += 1 if ok else 0
+        out.append(item)
+    _last_plan = {'started': time.time(),
+                  'drones': [{k: v for k, v in item.items() if k != 'route'} for item in out]}
+    if started == 0:
+        return False, 'Ни один дрон не взлетел', out
+    return True, f'Миссия флота запущена: дронов {started} из {len(members)}', out
+
+
+def resume(graph=None, transit_step=TRANSIT_STEP):
+    """
+    Продолжает прерванные миссии дронов флота одновременно: каждый дрон облетает
+    неосмотренные узлы своей контрольной точки (mission_plan.resume_route). Эшелоны
+    транзита и проверка пересечений — как в start. Возвращает (ok, сообщение, план:
+    [{drone, height, transit_height, route, return_start_index, unreachable, ok, message}]).
+    """
+    global _last_plan
+    members = _members_snapshot()
+    if any(m['drone'].is_mission_active() for _, m in members):
+        return False, 'Миссия флота уже выполняется', None
+    out = []
+    pending = []
+    for drone_id, m in members:
+        cp = m['drone'].get_checkpoint()
+        item = {'drone': drone_id, 'ok': False}
+        out.append(item)
+        if cp is None or cp.get('status') in ('completed', 'running'):
+            item['message'] = 'Нет прерванной миссии'
+            continue
+        route, return_start_index, unreachable = resume_route(cp, graph)
+        item.update({'height': cp.get('height'), 'route': route, 'return_start_index': return_start_index,
+                     'unreachable': unreachable})
+        if not _flies(route):
+            item['message'] = 'Все узлы прерванной миссии уже осмотрены'
+            continue
+        pending.append((item, m['drone'], cp))
+    if not pending:
+        return False, 'Нет прерванных миссий для продолжения', out
+    routes = [(item['route'], item['return_start_index']) for item, _, _ in pending]
+    heights = [cp.get('height') or dronecontroller.FLIGHT_HEIGHT for _, _, cp in pending]
+    transits = _transit_heights(routes, heights, transit_step)
+    conflict = _check_separation([item['drone'] for item, _, _ in pending], routes, heights, transits)
+    if conflict:
+        return False, conflict, out
+    started = 0
+    for (item, drone, cp), zt in zip(pending, transits):
+        item['transit_height'] = None if zt is None else round(zt, 2)
+        ok, msg = drone.start_mission(item['route'], cp.get('meta') or {}, height=cp.get('height'),
+                                      axis_y=cp.get('axis_y'), return_start_index=item['return_start_index'],
+                                      resumed_from=cp.get('mission_id'), transit_height=zt)
+        item['ok'], item['message'] = ok, msg
+        started += 1 if ok else 0
+    if started == 0:
+        return False, 'Нет прерванных миссий для продолжения', out
+    _last_plan = {'started': time.time(), 'resumed': True,
+                  'drones': [{k: v for k, v in item.items() if k != 'route'} for item in out]}
+    return True, f'Миссии флота продолжены: дронов {started} из {len(members)}', out
+
+
+def wait(timeout=None):
+    """Ждёт окончания миссий всех дронов. True — все закончили."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for _, m in _members_snapshot():
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not m['drone'].join(remaining):
+            return False
+    return True
+
+
+def land_all():
+    for _, m in _members_snapshot():
+        try:
+            m['drone'].land_manual()
+        except Exception:
+            _log.exception('land failed')
+
+
+def status():
+    """Статус каждого дрона флота и прогресс по его области из контрольной точки."""
+    drones = []
+    for drone_id, m in _members_snapshot():
+        drone = m['drone']
+        cp = drone.get_checkpoint() or {}
+        nodes = cp.get('nodes') or {}
+        drones.append({
+            'id': drone_id,
+            'home': m['home'],
+            **drone.get_status(),
+            'mission_status': cp.get('status'),
+            'nodes_total': len(nodes),
+            'nodes_done': sum(1 for v in nodes.values() if v != 'pending'),
+        })
+    return {'drones': drones, 'plan': _last_plan}
@@ -0,0 +1,214 @@
+"""
+Запись кадров камеры дрона в кольцевой буфер на диске для офлайн-разбора пропусков QR.
+
+Файл (.wdrf) — заголовок и capacity слотов фиксированного размера, так что файл
+целиком отображается в память (numpy.memmap), а его размер ограничен заранее:
+когда слоты кончаются, новый кадр пишется поверх самого старого. Слот — запись
+SLOT_DTYPE (номер кадра, время, источник, узел, поза дрона, форма кадра) и сырые
+пиксели кадра без сжатия: JPEG изменил бы то, что видит детектор QR.
+
+Заголовок файла (FILE_HEADER_SIZE байт): magic, версия, stride слота, capacity,
+максимальный размер кадра, номер следующего кадра. Номер кадра в слоте пишется
+последним, seq == 0 — пустой слот.
+
+    rec = FrameRecorder('frames.wdrf', size_mb=256)
+    rec.append(frame, source='mission', node_id='3_4', pose=(1.5, 2.0, 1.5))
+    for meta, frame in FrameLog('frames.wdrf'):
+        ...
+
+Разбор записи — bench/replay_frames.py.
+"""
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+FRAME_LOG_MAGIC = b"WDRFRM\x01\x00"
+FRAME_LOG_VERSION = 1
+FILE_HEADER_SIZE = 64
+# magic, version, slot_stride, capacity, max_frame_bytes, next_seq
+_FILE_HEADER = struct.Struct("<8sIIIIQ")
+_NEXT_SEQ_OFFSET = _FILE_HEADER.size - 8
+SLOT_ALIGN = 64
+NODE_ID_BYTES = 32
+
+SOURCES = ('mission', 'stream', 'other')
+
+SLOT_DTYPE = np.dtype([
+    ('seq', '<u8'),
+    ('ts', '<f8'),
+    ('source', 'u1'),
+    ('channels', 'u1'),
+    ('height', '<u2'),
+    ('width', '<u2'),
+    ('_pad', 'u1', (2,)),
+    ('nbytes', '<u4'),
+    ('pose', '<f4', (3,)),
+    ('node_id', f'S{NODE_ID_BYTES}'),
+])
+
+DEFAULT_SIZE_MB = 256
+DEFAULT_MAX_FRAME_BYTES = 640 * 480 * 3
+
+
+def _slot_stride(max_frame_bytes):
+    stride = SLOT_DTYPE.itemsize + max_frame_bytes
+    return (stride + SLOT_ALIGN - 1) // SLOT_ALIGN * SLOT_ALIGN
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        raw = f.read(_FILE_HEADER.size)
+    if len(raw) < _FILE_HEADER.size:
+        raise ValueError(f'{path}: не запись кадров (файл слишком короткий)')
+    magic, version, stride, capacity, max_frame_bytes, next_seq = _FILE_HEADER.unpack(raw)
+    if magic != FRAME_LOG_MAGIC or version != FRAME_LOG_VERSION:
+        raise ValueError(f'{path}: не запись кадров или неподдерживаемая версия')
+    return stride, capacity, max_frame_bytes, next_seq
+
+
+class FrameRecorder:
+    """
+    Кольцевой буфер кадров в файле path не больше size_mb МБ. Кадры крупнее
+    max_frame_bytes не пишутся (считаются в dropped). Существующая запись с той же
+    геометрией продолжается, с другой — перезаписывается.
+    """
+
+    def __init__(self, path, size_mb=DEFAULT_SIZE_MB, max_frame_bytes=DEFAULT_MAX_FRAME_BYTES):
+        self.path = Path(path)
+        self.max_frame_bytes = int(max_frame_bytes)
+        self.stride = _slot_stride(self.max_frame_bytes)
+        self.capacity = max(1, (int(size_mb * 1024 * 1024) - FILE_HEADER_SIZE) // self.stride)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self._last_frame = None
+        self._open()
+
+    def _open(self):
+        size = FILE_HEADER_SIZE + self.capacity * self.stride
+        next_seq = 1
+        if self.path.exists():
+            try:
+                stride, capacity, max_frame_bytes, seq = _read_header(self.path)
+                if (stride, capacity, max_frame_bytes) == (self.stride, self.capacity, self.max_frame_bytes):
+                    next_seq = seq
+            except (OSError, ValueError):
+                pass
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if next_seq == 1:
+            # Новая запись: файл нужного размера (разреженный), пустые слоты — нули
+            with open(self.path, 'wb') as f:
+                f.write(_FILE_HEADER.pack(FRAME_LOG_MAGIC, FRAME_LOG_VERSION, self.stride,
+                                          self.capacity, self.max_frame_bytes, next_seq))
+                f.truncate(size)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(size,))
+        self._next_seq = next_seq
+
+    def append(self, frame, source='other', node_id=None, pose=None, ts=None):
+        """Дописывает кадр (ndarray uint8, HxW или HxWxC). True, если кадр записан."""
+        if frame is None:
+            return False
+        with self._lock:
+            if self._mm is None:
+                return False
+            # Один и тот же общий кадр (см. dronecontroller.Drone.grab_frame) пишется один раз
+            if frame is self._last_frame:
+                return False
+            arr = np.ascontiguousarray(frame, dtype=np.uint8)
+            if arr.ndim not in (2, 3) or arr.nbytes > self.max_frame_bytes:
+                self.dropped += 1
+                return False
+            seq = self._next_seq
+            base = FILE_HEADER_SIZE + ((seq - 1) % self.capacity) * self.stride
+            head = self._mm[base:base + SLOT_DTYPE.itemsize].view(SLOT_DTYPE)
+            # Слот помечается пустым, пока кадр не дописан целиком
+            head['seq'] = 0
+            data_start = base + SLOT_DTYPE.itemsize
+            self._mm[data_start:data_start + arr.nbytes] = arr.reshape(-1)
+            head['ts'] = time.time() if ts is None else ts
+            head['source'] = SOURCES.index(source) if source in SOURCES else SOURCES.index('other')
+            head['height'] = arr.shape[0]
+            head['width'] = arr.shape[1]
+            head['channels'] = arr.shape[2] if arr.ndim == 3 else 1
+            head['nbytes'] = arr.nbytes
+            head['pose'] = pose if pose is not None else (np.nan, np.nan, np.nan)
+            head['node_id'] = str(node_id or '').encode('utf-8')[:NODE_ID_BYTES]
+            head['seq'] = seq
+            self._next_seq = seq + 1
+            self._mm[_NEXT_SEQ_OFFSET:_NEXT_SEQ_OFFSET + 8] = np.frombuffer(
+                struct.pack('<Q', self._next_seq), dtype=np.uint8)
+            self._last_frame = frame
+            self.written += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'path': str(self.path),
+                'capacity': self.capacity,
+                'frames': min(self._next_seq - 1, self.capacity),
+                'written': self.written,
+                'dropped': self.dropped,
+                'size_bytes': FILE_HEADER_SIZE + self.capacity * self.stride,
+                'max_frame_bytes': self.max_frame_bytes,
+            }
+
+    def flush(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm = None
+
+
+class FrameLog:
+    """Чтение записи: кадры по возрастанию seq, без копирования (view на memmap)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.stride, self.capacity, self.max_frame_bytes, self.next_seq = _read_header(self.path)
+        size = FILE_HEADER_SIZE + self.capacity * self.stride
+        if os.path.getsize(self.path) < size:
+            raise ValueError(f'{self.path}: запись обрезана')
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r', shape=(size,))
+        heads = np.ndarray((self.capacity,), dtype=SLOT_DTYPE, buffer=self._mm,
+                           offset=FILE_HEADER_SIZE, strides=(self.stride,))
+        seqs = heads['seq']
+        # Номера слотов по порядку записи; пустые (seq == 0) пропускаются
+        filled = np.flatnonzero(seqs)
+        self._slots = filled[np.argsort(seqs[filled], kind='stable')]
+        self._heads = heads
+
+    def __len__(self):
+        return len(self._slots)
+
+    def meta(self, k):
+        """Метаданные k-го по порядку кадра."""
+        h = self._heads[self._slots[k]]
+        pose = [float(v) for v in h['pose']]
+        return {
+            'seq': int(h['seq']),
+            'ts': float(h['ts']),
+            'source': SOURCES[h['source']] if h['source'] < len(SOURCES) else 'other',
+            'node_id': h['node_id'].decode('utf-8', errors='replace'),
+            'pose': None if any(np.isnan(pose)) else pose,
+            'shape': [int(h['height']), int(h['width']), int(h['channels'])],
+        }
+
+    def frame(self, k):
+        h = self._heads[self._slots[k]]
+        start = FILE_HEADER_SIZE + int(self._slots[k]) * self.stride + SLOT_DTYPE.itemsize
+        shape = (int(h['height']), int(h['width'])) + ((int(h['channels']),) if h['channels'] > 1 else ())
+        return self._mm[start:start + int(h['nbytes'])].reshape(shape)
+
+    def __iter__(self):
+        for k in range(len(self)):
+            yield self.meta(k), self.frame(k)
@@ -0,0 +1,380 @@
+"""
+Компактный бинарный формат графа склада.
+
+graph.json хранит каждый узел объектом с id вида "3_7" и отдельный список рёбер;
+на больших сетках разбор такого файла занимает заметное время. Бинарный формат
+хранит те же данные массивами фиксированного типа и загружается через mmap:
+
+    magic (8 байт) | длина заголовка (uint32 LE) | заголовок JSON | секции, выровненные по 8 байт
+
+Секции: node_i, node_j (int32), indptr, indices (int32, CSR смежность в обе стороны),
+weights (float32), edge_from, edge_to (int32), edge_len (float32), ids (utf-8, только
+если id узлов не совпадают с "i_j").
+
+Конвертер: python graph_store.py to-bin graph.json graph.bin | to-json graph.bin graph.json
+"""
+import heapq
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+import lazy
+import metrics
+
+# NumPy нужен только для бинарного формата — импортируется при первом обращении
+np = lazy.module("numpy")
+
+GRAPH_BIN_MAGIC = b"WDRGRPH\x01"
+_ALIGN = 8
+_ID_SEP = "\x00"
+
+
+def _node_id_default(i, j):
+    return f"{i}_{j}"
+
+
+def _align(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+class BinaryGraph:
+    """Граф, загруженный из бинарного файла. Массивы — представления над mmap (без копирования)."""
+
+    def __init__(self, meta, node_i, node_j, indptr, indices, weights,
+                 edge_from, edge_to, edge_len, ids=None, extras=None):
+        self.meta = meta
+        self.node_i = node_i
+        self.node_j = node_j
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.edge_from = edge_from
+        self.edge_to = edge_to
+        self.edge_len = edge_len
+        self._ids = ids
+        self._extras = extras or {}
+        self._index = None
+        self._csr_lists = None
+
+    @property
+    def num_nodes(self):
+        return int(self.node_i.shape[0])
+
+    @property
+    def num_edges(self):
+        return int(self.edge_from.shape[0])
+
+    def node_ids(self):
+        """Список id узлов (строится один раз при первом обращении)."""
+        if self._ids is None:
+            self._ids = [_node_id_default(i, j) for i, j in zip(self.node_i.tolist(), self.node_j.tolist())]
+        return self._ids
+
+    def index_of(self, node_id):
+        """Индекс узла по id или None."""
+        if self._index is None:
+            self._index = {nid: k for k, nid in enumerate(self.node_ids())}
+        return self._index.get(node_id)
+
+    def has_node(self, node_id):
+        return self.index_of(node_id) is not None
+
+    def node(self, node_id):
+        """Узел в формате graph.json ({id, i, j}) или None."""
+        k = self.index_of(node_id)
+        if k is None:
+            return None
+        return {"id": node_id, "i": int(self.node_i[k]), "j": int(self.node_j[k])}
+
+    def neighbors(self, k):
+        """Соседи узла с индексом k: (индексы, длины)."""
+        a, b = int(self.indptr[k]), int(self.indptr[k + 1])
+        return self.indices[a:b], self.weights[a:b]
+
+    def adjacency(self):
+        """Список смежности в формате robotcontroller: { id: [(to_id, length), ...] }."""
+        ids = self.node_ids()
+        indptr = self.indptr.tolist()
+        indices = self.indices.tolist()
+        weights = self.weights.tolist()
+        adj = {}
+        for k, nid in enumerate(ids):
+            a, b = indptr[k], indptr[k + 1]
+            adj[nid] = [(ids[t], w) for t, w in zip(indices[a:b], weights[a:b])]
+        return adj
+
+    def _lists(self):
+        if self._csr_lists is None:
+            self._csr_lists = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        return self._csr_lists
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="shortest_path_csr")
+    def shortest_path(self, start_id, target_id):
+        """Дейкстра с кучей прямо по CSR. Возвращает путь [id, ...] или []."""
+        s = self.index_of(start_id)
+        t = self.index_of(target_id)
+        if s is None or t is None:
+            return []
+        indptr, indices, weights = self._lists()
+        dist = {s: 0.0}
+        prev = {s: -1}
+        heap = [(0.0, s)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u == t:
+                break
+            if d > dist.get(u, math.inf):
+                continue
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                alt = d + weights[k]
+                if alt < dist.get(v, math.inf):
+                    dist[v] = alt
+                    prev[v] = u
+                    heapq.heappush(heap, (alt, v))
+        if t not in prev:
+            return []
+        ids = self.node_ids()
+        path = []
+        cur = t
+        while cur != -1:
+            path.append(ids[cur])
+            cur = prev[cur]
+        path.reverse()
+        return path
+
+    def path_context(self, path):
+        """Узлы и смежность только для узлов пути — достаточно для _path_to_commands."""
+        ids = self.node_ids()
+        indptr, indices, weights = self._lists()
+        nodes = []
+        adj = {}
+        for nid in path:
+            k = self.index_of(nid)
+            nodes.append({"id": nid, "i": int(self.node_i[k]), "j": int(self.node_j[k])})
+            a, b = indptr[k], indptr[k + 1]
+            adj[nid] = [(ids[t], w) for t, w in zip(indices[a:b], weights[a:b])]
+        return nodes, adj
+
+    def to_graph(self):
+        """Преобразует в JSON-совместимый словарь { nodes, edges, meta }."""
+        ids = self.node_ids()
+        node_extras = self._extras.get("nodes", {})
+        edge_extras = self._extras.get("edges", {})
+        nodes = []
+        for k, (i, j) in enumerate(zip(self.node_i.tolist(), self.node_j.tolist())):
+            n = {"id": ids[k], "i": i, "j": j}
+            extra = node_extras.get(str(k))
+            if extra:
+                n.update(extra)
+            nodes.append(n)
+        edges = []
+        for k, (fr, to, ln) in enumerate(zip(self.edge_from.tolist(), self.edge_to.tolist(),
+                                             self.edge_len.tolist())):
+            e = {"from": ids[fr], "to": ids[to], "length": round(ln, 6)}
+            extra = edge_extras.get(str(k))
+            if extra:
+                e.update(extra)
+            edges.append(e)
+        return {"nodes": nodes, "edges": edges, "meta": self.meta}
+
+
+def graph_to_arrays(graph):
+    """Раскладывает словарь графа в массивы. Рёбра с неизвестными концами отбрасываются."""
+    nodes = graph.get("nodes", []) or []
+    edges = graph.get("edges", []) or []
+    index = {}
+    node_i = np.empty(len(nodes), dtype=np.int32)
+    node_j = np.empty(len(nodes), dtype=np.int32)
+    ids = []
+    node_extras = {}
+    for k, n in enumerate(nodes):
+        nid = n["id"]
+        index[nid] = k
+        ids.append(nid)
+        node_i[k] = int(n.get("i", 0))
+        node_j[k] = int(n.get("j", 0))
+        extra = {key: v for key, v in n.items() if key not in ("id", "i", "j")}
+        if extra:
+            node_extras[str(k)] = extra
+    e_from, e_to, e_len = [], [], []
+    edge_extras = {}
+    for e in edges:
+        fr = index.get(e.get("from"))
+        to = index.get(e.get("to"))
+        if fr is None or to is None:
+            continue
+        extra = {key: v for key, v in e.items() if key not in ("from", "to", "length")}
+        if extra:
+            edge_extras[str(len(e_from))] = extra
+        e_from.append(fr)
+        e_to.append(to)
+        e_len.append(float(e.get("length", 1)))
+    edge_from = np.asarray(e_from, dtype=np.int32)
+    edge_to = np.asarray(e_to, dtype=np.int32)
+    edge_len = np.asarray(e_len, dtype=np.float32)
+
+    src = np.concatenate([edge_from, edge_to])
+    dst = np.concatenate([edge_to, edge_from])
+    w = np.concatenate([edge_len, edge_len])
+    order = np.argsort(src, kind="stable")
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=len(nodes)), out=indptr[1:])
+
+    ids_default = all(nid == _node_id_default(i, j)
+                      for nid, i, j in zip(ids, node_i.tolist(), node_j.tolist()))
+    extras = {}
+    if node_extras:
+        extras["nodes"] = node_extras
+    if edge_extras:
+        extras["edges"] = edge_extras
+    return {
+        "node_i": node_i,
+        "node_j": node_j,
+        "indptr": indptr,
+        "indices": dst[order].astype(np.int32),
+        "weights": w[order].astype(np.float32),
+        "edge_from": edge_from,
+        "edge_to": edge_to,
+        "edge_len": edge_len,
+    }, (None if ids_default else ids), extras
+
+
+def save_graph_binary(graph, path):
+    """Сохраняет граф в бинарном формате. Запись атомарная (через временный файл)."""
+    path = Path(path)
+    arrays, ids, extras = graph_to_arrays(graph)
+    sections = list(arrays.items())
+    if ids is not None:
+        sections.append(("ids", np.frombuffer(_ID_SEP.join(ids).encode("utf-8"), dtype=np.uint8)))
+
+    # Смещения секций отсчитываются от начала данных (первая граница 8 байт после заголовка).
+    layout = {}
+    offset = 0
+    for name, arr in sections:
+        layout[name] = [offset, arr.dtype.str, int(arr.shape[0])]
+        offset = _align(offset + arr.nbytes)
+    header = {"meta": graph.get("meta"), "sections": layout, "extras": extras}
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = _align(len(GRAPH_BIN_MAGIC) + 4 + len(header_bytes))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(GRAPH_BIN_MAGIC)
+            f.write(struct.pack("<I", len(header_bytes)))
+            f.write(header_bytes)
+            for name, arr in sections:
+                off = data_start + layout[name][0]
+                f.write(b"\x00" * (off - f.tell()))
+                f.write(np.ascontiguousarray(arr).tobytes())
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+
+def load_graph_binary(path, mmap=True):
+    """Загружает граф из бинарного файла. При mmap=True массивы не копируются в память."""
+    path = Path(path)
+    if mmap:
+        buf = np.memmap(path, dtype=np.uint8, mode="r")
+    else:
+        buf = np.fromfile(path, dtype=np.uint8)
+    if buf.shape[0] < len(GRAPH_BIN_MAGIC) + 4 or bytes(buf[:len(GRAPH_BIN_MAGIC)]) != GRAPH_BIN_MAGIC:
+        raise ValueError(f"{path}: не бинарный граф")
+    pos = len(GRAPH_BIN_MAGIC)
+    (header_len,) = struct.unpack("<I", bytes(buf[pos:pos + 4]))
+    pos += 4
+    header = json.loads(bytes(buf[pos:pos + header_len]).decode("utf-8"))
+    data_start = _align(pos + header_len)
+    arrays = {}
+    for name, (offset, dtype, count) in header["sections"].items():
+        arrays[name] = np.frombuffer(buf, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+    ids = None
+    if "ids" in arrays:
+        raw = arrays.pop("ids").tobytes().decode("utf-8")
+        ids = raw.split(_ID_SEP) if raw else []
+    return BinaryGraph(meta=header.get("meta"), ids=ids, extras=header.get("extras"), **arrays)
+
+
+def json_to_binary(json_path, bin_path):
+    with open(json_path, "r", encoding="utf-8") as f:
+        graph = json.load(f)
+    save_graph_binary(graph, bin_path)
+
+
+def binary_to_json(bin_path, json_path):
+    graph = load_graph_binary(bin_path, mmap=False).to_graph()
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(graph, f, ensure_ascii=False, indent=2)
+
+
+def load_graph(json_path, bin_path=None):
+    """
+    Загружает граф как словарь для отдачи браузеру: из JSON, а если его нет —
+    из бинарной копии. Возвращает None, если графа нет.
+    """
+    json_path = Path(json_path)
+    if json_path.exists():
+        with open(json_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    if bin_path is not None and Path(bin_path).exists():
+        return load_graph_binary(bin_path, mmap=False).to_graph()
+    return None
+
+
+_open_cache = {}
+_open_lock = threading.Lock()
+
+
+def open_graph(json_path, bin_path):
+    """
+    Открывает граф для маршрутизации: BinaryGraph, если бинарная копия актуальна, иначе
+    словарь из JSON. Результат кэшируется до изменения файла. None — графа нет.
+    """
+    json_path = Path(json_path)
+    bin_path = Path(bin_path)
+    try:
+        use_bin = bin_path.exists() and (not json_path.exists()
+                                         or bin_path.stat().st_mtime >= json_path.stat().st_mtime)
+        path = bin_path if use_bin else json_path
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    key = (str(path), st.st_mtime_ns, st.st_size)
+    with _open_lock:
+        cached = _open_cache.get(str(json_path))
+        if cached and cached[0] == key:
+            return cached[1]
+    if use_bin:
+        graph = load_graph_binary(path)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            graph = json.load(f)
+    with _open_lock:
+        _open_cache[str(json_path)] = (key, graph)
+    return graph
+
+
+def _main(argv):
+    if len(argv) != 3 or argv[0] not in ("to-bin", "to-json"):
+        print("usage: graph_store.py to-bin graph.json graph.bin | to-json graph.bin graph.json")
+        return 2
+    cmd, src, dst = argv
+    if cmd == "to-bin":
+        json_to_binary(src, dst)
+    else:
+        binary_to_json(src, dst)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
@@ -0,0 +1,69 @@
+"""
+Обратный индекс инвентаря: содержимое QR-кода -> узлы, где он снят.
+
+Поиск без учёта регистра: точный (словарь) и по префиксу (бинарный поиск по
+отсортированному списку ключей), так что стоимость запроса — O(log n + найдено)
+и не зависит от размера склада. Индекс ведёт qr_store.QrStore под своей
+блокировкой, отдельно его обновлять не нужно.
+"""
+from bisect import bisect_left, insort
+
+
+def _key(code):
+    return code.strip().casefold()
+
+
+class InventoryIndex:
+    def __init__(self):
+        self._codes = {}
+        self._exact = {}
+        # Отсортированные пары (ключ, узел) для поиска по префиксу
+        self._sorted = []
+
+    def __len__(self):
+        return len(self._codes)
+
+    def rebuild(self, codes):
+        """Индекс заново из {узел: код}."""
+        self._codes = dict(codes)
+        self._exact = {}
+        for node_id, code in self._codes.items():
+            self._exact.setdefault(_key(code), set()).add(node_id)
+        self._sorted = sorted((_key(code), node_id) for node_id, code in self._codes.items())
+
+    def set(self, node_id, code):
+        """У узла node_id теперь код code (старый код узла из индекса убирается)."""
+        old = self._codes.get(node_id)
+        if old == code:
+            return
+        if old is not None:
+            key = _key(old)
+            nodes = self._exact.get(key)
+            if nodes is not None:
+                nodes.discard(node_id)
+                if not nodes:
+                    del self._exact[key]
+            pos = bisect_left(self._sorted, (key, node_id))
+            if pos < len(self._sorted) and self._sorted[pos] == (key, node_id):
+                del self._sorted[pos]
+        self._codes[node_id] = code
+        key = _key(code)
+        self._exact.setdefault(key, set()).add(node_id)
+        insort(self._sorted, (key, node_id))
+
+    def lookup(self, code):
+        """Узлы с точно таким кодом (без учёта регистра), по возрастанию id."""
+        return sorted(self._exact.get(_key(code), ()))
+
+    def search(self, prefix, limit=50):
+        """[(код, узел), ...] для кодов, начинающихся с prefix, по порядку кодов."""
+        key = _key(prefix)
+        out = []
+        pos = bisect_left(self._sorted, (key,))
+        while pos < len(self._sorted) and len(out) < limit:
+            k, node_id = self._sorted[pos]
+            if not k.startswith(key):
+                break
+            out.append((self._codes[node_id], node_id))
+            pos += 1
+        return out
@@ -0,0 +1,63 @@
+"""
+Отложенный импорт тяжёлых зависимостей: OpenCV, NumPy, pioneer_sdk, pyzbar.
+
+Процессу, который только отправляет роботов, не нужны ни OpenCV, ни SDK дрона, а
+их импорт занимает большую часть холодного старта сервиса. Поэтому app.py и
+dronecontroller.py держат такие модули за фасадом: module(name) — заместитель,
+который импортирует модуль при первом обращении к его атрибуту, optional(name) —
+сам модуль или None, если он не установлен (проверка тоже при первом вызове).
+
+Время старта проверяет bench/bench_import_time.py.
+"""
+import importlib
+import sys
+import threading
+
+_lock = threading.Lock()
+_optional = {}
+
+
+class LazyModule:
+    """Заместитель модуля name: импорт при первом обращении к атрибуту."""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        mod = self.__dict__['_module']
+        if mod is None:
+            mod = importlib.import_module(self._name)
+            self.__dict__['_module'] = mod
+        return mod
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return f'<lazy module {self._name!r} ({state})>'
+
+
+def module(name):
+    return LazyModule(name)
+
+
+def optional(name):
+    """Модуль name или None, если он не установлен. Результат запоминается."""
+    try:
+        return _optional[name]
+    except KeyError:
+        pass
+    with _lock:
+        if name not in _optional:
+            try:
+                _optional[name] = importlib.import_module(name)
+            except ImportError:
+                _optional[name] = None
+        return _optional[name]
+
+
+def loaded(name):
+    """Импортирован ли уже модуль name (в том числе не через этот фасад)."""
+    return name in sys.modules
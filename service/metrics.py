@@ -0,0 +1,221 @@
+"""
+Лёгкие метрики для горячих путей: счётчики и гистограммы задержек в формате
+Prometheus (отдаются на /metrics).
+
+Включаются переменной окружения WDR_METRICS=1 или set_enabled(True). В
+выключенном состоянии timer() возвращает общий пустой контекст, а timed() —
+сразу вызывает функцию: ни замеров времени, ни блокировок.
+
+    STAGE_SECONDS = histogram('wdr_stage_seconds', 'Время этапа', ('stage',))
+
+    @timed(STAGE_SECONDS, stage='dijkstra')
+    def _dijkstra(...): ...
+
+    with timer(STAGE_SECONDS, stage='jpeg_encode'):
+        ...
+"""
+import functools
+import math
+import os
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_enabled = os.environ.get('WDR_METRICS', '').lower() in ('1', 'true', 'yes')
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+
+
+def is_enabled():
+    return _enabled
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(labelnames, key)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not _enabled:
+            return
+        key = _label_key(self.labelnames, labels)
+        # Индекс корзины считаем до блокировки; кумулятивные суммы — при выводе
+        idx = len(self.buckets)
+        for k, bound in enumerate(self.buckets):
+            if value <= bound:
+                idx = k
+                break
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][idx] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._values.items())
+        for key, (counts, total, count) in items:
+            acc = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                acc += c
+                le = 'le="+Inf"' if bound == math.inf else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {acc}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+def _register(metric):
+    with _registry_lock:
+        for m in _registry:
+            if m.name == metric.name:
+                return m
+        _registry.append(metric)
+    return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, help_text, labelnames, buckets))
+
+
+class _Timer:
+    __slots__ = ('_hist', '_labels', '_t0')
+
+    def __init__(self, hist, labels):
+        self._hist = hist
+        self._labels = labels
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._t0, **self._labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timer(hist, **labels):
+    """Контекст, замеряющий время блока в hist. Без метрик — общий пустой объект."""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(hist, labels)
+
+
+def timed(hist, **labels):
+    """Декоратор: время каждого вызова функции в hist с метками labels."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0, **labels)
+        return wrapper
+    return decorator
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        lines.extend(m.render())
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _registry_lock:
+        metrics = list(_registry)
+    for m in metrics:
+        m.reset()
+
+
+# Общие метрики сервиса
+STAGE_SECONDS = histogram('wdr_stage_seconds', 'Duration of service hot-path stages', ('stage',))
+ROBOT_REQUEST_SECONDS = histogram('wdr_robot_request_seconds', 'HTTP requests to the robot', ('endpoint', 'result'))
+QR_DECODE_SECONDS = histogram('wdr_qr_decode_seconds', 'QR decode attempts per backend', ('backend', 'found'))
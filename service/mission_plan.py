@@ -0,0 +1,335 @@
+"""
+Планирование облёта по части узлов: продолжение прерванной миссии, облёт только
+узлов без свежих QR-данных и раздел склада между несколькими дронами.
+
+Маршрут всегда начинается в домашней клетке (первой клетке исходного маршрута):
+от неё считаются локальные координаты дрона, и после посадки/замены батареи дрон
+стартует оттуда же. Узлы осмотра соединяются кратчайшими путями по графу,
+промежуточные клетки помечаются 'scan': False (транзит, см. waypoints.py), после
+последнего узла маршрут возвращается домой.
+
+На стеллажах с несколькими уровнями узел осмотра несёт 'levels' — высоты, на
+которых снимается QR (plan_levels_route); между узлами дрон летит на высоте
+последнего снятого уровня.
+"""
+import math
+
+import lazy
+from qr_store import slot_key, split_slot
+
+_waypoints = lazy.module('waypoints')
+
+# Оценочные скорости дрона для выбора порядка облёта уровней, м/с
+H_SPEED = 1.0
+V_SPEED = 0.5
+
+
+def plan_scan_route(graph, home_id, targets, ordered=False):
+    """
+    Маршрут облёта узлов targets из home_id по graph (routing.RoutingGraph).
+    ordered=False — ближайший следующий узел (как при построении маршрута в UI),
+    ordered=True — в заданном порядке. Возвращает (route, return_start_index,
+    unreachable): route — [{id, i, j, scan}], unreachable — недостижимые узлы.
+    """
+    remaining = {t for t in targets if graph.has_node(t)}
+    unreachable = [t for t in targets if t not in remaining]
+    order = [t for t in dict.fromkeys(targets) if t in remaining]
+    ids = [home_id]
+    scan = [home_id in remaining]
+    remaining.discard(home_id)
+    cur = home_id
+    while remaining:
+        if ordered:
+            while order and order[0] not in remaining:
+                order.pop(0)
+            best = order.pop(0)
+            path = graph.shortest_path(cur, best)
+        else:
+            dist = graph.distances_from(cur)
+            reachable = [t for t in remaining if t in dist]
+            best = min(reachable, key=lambda t: (dist[t], t)) if reachable else None
+            path = graph.shortest_path(cur, best) if best is not None else []
+        if not path:
+            # Из текущей точки не добраться ни до одного (или до этого) узла
+            if best is None:
+                unreachable.extend(sorted(remaining))
+                break
+            unreachable.append(best)
+            remaining.discard(best)
+            continue
+        for nid in path[1:]:
+            ids.append(nid)
+            scan.append(nid in remaining)
+            remaining.discard(nid)
+        cur = best
+    return_start_index = None
+    if cur != home_id:
+        return_start_index = len(ids)
+        for nid in graph.shortest_path(cur, home_id)[1:]:
+            ids.append(nid)
+            scan.append(False)
+    route = []
+    for nid, s in zip(ids, scan):
+        node = graph.node(nid)
+        route.append({'id': nid, 'i': node['i'], 'j': node['j'], 'scan': s})
+    return route, return_start_index, unreachable
+
+
+def pending_nodes(checkpoint):
+    """
+    Узлы (ячейки «узел@уровень») прерванной миссии, до которых дрон не долетел, в
+    порядке исходного маршрута.
+    """
+    nodes = checkpoint.get('nodes') or {}
+    out = []
+    for item in checkpoint.get('route') or []:
+        nid = item.get('id')
+        levels = item.get('levels')
+        for key in [slot_key(nid, lv['level']) for lv in levels] if levels else [nid]:
+            if nodes.get(key) == 'pending' and key not in out:
+                out.append(key)
+    return out
+
+
+def resume_route(checkpoint, graph=None):
+    """
+    Маршрут продолжения прерванной миссии: (route, return_start_index, unreachable).
+    С графом — только недоосмотренные узлы в исходном порядке; без графа — исходный
+    маршрут, где уже пройденная часть летится транзитом. В многоуровневой миссии
+    недоосмотренные ячейки (узел, уровень) планируются заново (plan_levels_route).
+    """
+    route = checkpoint.get('route') or []
+    if not route:
+        return [], None, []
+    pending = pending_nodes(checkpoint)
+    home_id = route[0].get('id')
+    heights = {lv['level']: lv['z'] for item in route for lv in item.get('levels') or ()}
+    if heights:
+        targets = [split_slot(key) for key in pending]
+        if graph is not None and graph.has_node(home_id):
+            return plan_levels_route(graph, home_id, targets, heights, start_height=checkpoint.get('height'))
+        pending = set(pending)
+        out = []
+        for item in route:
+            levels = [lv for lv in item.get('levels') or () if slot_key(item.get('id'), lv['level']) in pending]
+            pending.difference_update(slot_key(item.get('id'), lv['level']) for lv in levels)
+            out.append({**item, 'scan': bool(levels), 'levels': levels})
+        return out, checkpoint.get('return_start_index'), []
+    if graph is not None and graph.has_node(home_id):
+        return plan_scan_route(graph, home_id, pending, ordered=True)
+    pending = set(pending)
+    out = []
+    for item in route:
+        nid = item.get('id')
+        out.append({**item, 'scan': nid in pending})
+        pending.discard(nid)
+    return out, checkpoint.get('return_start_index'), []
+
+
+def mission_slots(route, return_start_index=None):
+    """
+    Ячейки осмотра маршрута в порядке облёта: id узла или «узел@уровень» для узлов с
+    'levels'. Ключи те же, что в qr_store и в контрольной точке миссии.
+    """
+    out = []
+    for item, scan in zip(route, _waypoints.scan_mask(route, return_start_index)):
+        if not scan:
+            continue
+        nid = item.get('id', '0_0')
+        levels = item.get('levels')
+        out.extend([slot_key(nid, lv['level']) for lv in levels] if levels else [nid])
+    return out
+
+
+def estimate_route_time(route, meta, height, h_speed=H_SPEED, v_speed=V_SPEED):
+    """
+    Оценка времени полёта по маршруту (с): горизонтальные отрезки между клетками со
+    скоростью h_speed и подъёмы/спуски между уровнями со скоростью v_speed. Зависания
+    и снимки не считаются — их число не зависит от порядка облёта.
+    """
+    sx = float((meta or {}).get('scaleX', 1))
+    sy = float((meta or {}).get('scaleY', 1))
+    z = float(height)
+    horizontal = vertical = 0.0
+    prev = None
+    for item in route:
+        if prev is not None:
+            horizontal += math.hypot((item['i'] - prev['i']) * sx, (item['j'] - prev['j']) * sy)
+        for lv in item.get('levels') or ():
+            vertical += abs(lv['z'] - z)
+            z = lv['z']
+        prev = item
+    return horizontal / h_speed + vertical / v_speed
+
+
+def _level_heights(level_heights):
+    if isinstance(level_heights, dict):
+        return {int(k): float(v) for k, v in level_heights.items()}
+    return {k + 1: float(z) for k, z in enumerate(level_heights)}
+
+
+def _levels_by_node(targets, heights):
+    """targets — id узлов (все уровни) или пары (узел, уровень) -> {узел: [уровни]}."""
+    out = {}
+    for t in targets:
+        nid, level = (t, None) if isinstance(t, str) else t
+        levels = out.setdefault(nid, [])
+        for lv in (sorted(heights) if level is None else [int(level)]):
+            if lv in heights and lv not in levels:
+                levels.append(lv)
+    return {nid: lv for nid, lv in out.items() if lv}
+
+
+def _node_major(graph, home_id, need, heights, z):
+    """Каждый узел — один раз, все его уровни подряд: змейкой, с ближнего к текущей высоте конца."""
+    route, return_start_index, unreachable = plan_scan_route(graph, home_id, list(need))
+    for item in route:
+        if not item['scan']:
+            continue
+        levels = sorted(need[item['id']], key=lambda lv: heights[lv])
+        if abs(heights[levels[-1]] - z) < abs(heights[levels[0]] - z):
+            levels.reverse()
+        item['levels'] = [{'level': lv, 'z': heights[lv]} for lv in levels]
+        z = heights[levels[-1]]
+    return route, return_start_index, unreachable
+
+
+def _level_major(graph, home_id, need, heights, z):
+    """
+    Уровень за уровнем по одному обходу узлов (tour): каждый уровень пролетается
+    отрезком обхода от ближнего конца до дальнего, следующий — в обратную сторону.
+    """
+    route, return_start_index, unreachable = plan_scan_route(graph, home_id, list(need))
+    tour = route[:return_start_index] if return_start_index is not None else route
+    first = {}
+    for k, item in enumerate(tour):
+        first.setdefault(item['id'], k)
+    levels = sorted({lv for lvs in need.values() for lv in lvs}, key=lambda lv: heights[lv])
+    if levels and abs(heights[levels[-1]] - z) < abs(heights[levels[0]] - z):
+        levels.reverse()
+    # [(индекс клетки обхода, [уровни])] — путь дрона по клеткам обхода
+    walk = [(0, [])]
+    for lv in levels:
+        idx = sorted(first[nid] for nid, lvs in need.items() if lv in lvs and nid in first)
+        if not idx:
+            continue
+        pos = walk[-1][0]
+        near, far = (idx[0], idx[-1]) if abs(idx[0] - pos) <= abs(idx[-1] - pos) else (idx[-1], idx[0])
+        scan_at = set(idx)
+        step = 1 if far >= near else -1
+        for k in _index_path(pos, near) + list(range(near, far + step, step)):
+            if k == walk[-1][0]:
+                if k in scan_at and lv not in walk[-1][1]:
+                    walk[-1][1].append(lv)
+                    scan_at.discard(k)
+                continue
+            walk.append((k, [lv] if k in scan_at else []))
+            scan_at.discard(k)
+    out = []
+    for k, lvs in walk:
+        item = {key: tour[k][key] for key in ('id', 'i', 'j')}
+        item['scan'] = bool(lvs)
+        if lvs:
+            item['levels'] = [{'level': lv, 'z': heights[lv]} for lv in lvs]
+        out.append(item)
+    return_start_index = None
+    last = out[-1]['id']
+    if last != home_id:
+        return_start_index = len(out)
+        for nid in graph.shortest_path(last, home_id)[1:]:
+            node = graph.node(nid)
+            out.append({'id': nid, 'i': node['i'], 'j': node['j'], 'scan': False})
+    return out, return_start_index, unreachable
+
+
+def _index_path(a, b):
+    """Индексы клеток обхода от a до b, без самого b."""
+    step = 1 if b >= a else -1
+    return list(range(a, b, step))
+
+
+def plan_levels_route(graph, home_id, targets, level_heights, start_height=None, meta=None,
+                      h_speed=H_SPEED, v_speed=V_SPEED):
+    """
+    Облёт многоуровневых стеллажей одной миссией. targets — id узлов (снять все
+    уровни) или пары (узел, уровень); level_heights — высоты уровней, м: список
+    (уровни 1..n) или {уровень: высота}. Строятся два порядка — по узлам (все
+    уровни узла подряд, змейкой по высоте) и по уровням (каждый уровень — проходом
+    по общему обходу узлов, проходы чередуют направление) — и выбирается тот, что
+    быстрее по estimate_route_time. Узлы осмотра в route несут 'levels':
+    [{level, z}] в порядке съёмки. Возвращает (route, return_start_index, unreachable).
+    """
+    heights = _level_heights(level_heights)
+    need = _levels_by_node(targets, heights)
+    if not need:
+        return [], None, []
+    meta = meta if meta is not None else (getattr(graph, 'meta', None) or {})
+    z = float(start_height) if start_height is not None else min(heights.values())
+    best = None
+    for plan in (_node_major, _level_major):
+        route, return_start_index, unreachable = plan(graph, home_id, need, heights, z)
+        cost = estimate_route_time(route, meta, z, h_speed, v_speed)
+        if best is None or cost < best[0]:
+            best = (cost, route, return_start_index, unreachable)
+    return best[1], best[2], best[3]
+
+
+def partition_nodes(nodes, k):
+    """
+    Делит узлы [{id, i, j}] на k частей почти равного размера, компактных на сетке:
+    рекурсивная бисекция — каждая часть режется поперёк более длинной стороны
+    охватывающего её прямоугольника, пропорционально числу дронов в половинах.
+    Возвращает k списков id (если узлов меньше k — часть списков пустая).
+    """
+    items = [(n.get('i', 0), n.get('j', 0), n['id']) for n in nodes]
+    parts = []
+
+    def split(items, k):
+        if k <= 1 or len(items) <= 1:
+            parts.append([nid for _, _, nid in items])
+            parts.extend([] for _ in range(k - 1))
+            return
+        span_i = max(it[0] for it in items) - min(it[0] for it in items)
+        span_j = max(it[1] for it in items) - min(it[1] for it in items)
+        if span_i >= span_j:
+            items = sorted(items)
+        else:
+            items = sorted(items, key=lambda it: (it[1], it[0], it[2]))
+        k_left = k // 2
+        cut = round(len(items) * k_left / k)
+        split(items[:cut], k_left)
+        split(items[cut:], k - k_left)
+
+    split(items, max(1, int(k)))
+    return parts
+
+
+def plan_fleet(graph, targets, homes):
+    """
+    Облёт узлов targets несколькими дронами: узлы делятся на len(homes) частей
+    (partition_nodes), каждая часть достаётся дрону, чей дом к ней ближе по графу
+    (жадно, от самой близкой пары), и облетается из его дома (plan_scan_route).
+    Возвращает [{'home', 'targets', 'route', 'return_start_index', 'unreachable'}]
+    в порядке homes; узлы, которых нет в графе, пропускаются.
+    """
+    nodes = [graph.node(t) for t in dict.fromkeys(targets) if graph.has_node(t)]
+    regions = partition_nodes(nodes, len(homes))
+    dist = {h: graph.distances_from(h) for h in dict.fromkeys(homes)}
+    pairs = []
+    for d, home in enumerate(homes):
+        for r, region in enumerate(regions):
+            cost = min((dist[home].get(nid, float('inf')) for nid in region), default=float('inf'))
+            pairs.append((cost, d, r))
+    assigned = {}
+    used = set()
+    for _, d, r in sorted(pairs):
+        if d not in assigned and r not in used:
+            assigned[d] = r
+            used.add(r)
+    plans = []
+    for d, home in enumerate(homes):
+        region = regions[assigned[d]] if d in assigned else []
+        route, return_start_index, unreachable = plan_scan_route(graph, home, region) if region else ([], None, [])
+        plans.append({'home': home, 'targets': region, 'route': route,
+                      'return_start_index': return_start_index, 'unreachable': unreachable})
+    return plans
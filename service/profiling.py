@@ -0,0 +1,225 @@
+"""
+Профилирование отдельного запроса по требованию, без перезапуска сервиса.
+
+Запрос профилируется, если у него есть заголовок X-Profile или параметр
+?_profile= и адрес клиента входит в список WDR_PROFILE_ALLOW (через запятую,
+адреса или подсети; по умолчанию только localhost). Значение выбирает режим:
+
+    cprofile (или 1) — cProfile, файл <id>.prof (snakeviz, flameprof, gprof2dot);
+    sample           — сэмплирование стека потока запроса раз в SAMPLE_INTERVAL,
+                       файл <id>.folded (flamegraph.pl, speedscope, inferno).
+
+Рядом пишется <id>.json с описанием запроса. Идентификатор профиля возвращается
+в заголовке ответа X-Profile-Id. Одновременно профилируется один запрос; хранятся
+последние MAX_PROFILES профилей.
+"""
+import cProfile
+import ipaddress
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from flask import g, request
+
+_log = logging.getLogger(__name__)
+
+MAX_PROFILES = 50
+SAMPLE_INTERVAL = 0.002
+_DEFAULT_ALLOW = '127.0.0.1,::1'
+
+_profile_dir = None
+_allow = []
+_busy = threading.Lock()
+
+
+def _parse_allow(text):
+    nets = []
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            nets.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            _log.warning('bad WDR_PROFILE_ALLOW entry: %r', item)
+    return nets
+
+
+def is_allowed(addr):
+    try:
+        ip = ipaddress.ip_address(addr or '')
+    except ValueError:
+        return False
+    return any(ip in net for net in _allow)
+
+
+class _StackSampler:
+    """Сэмплирует стек одного потока; результат — свёрнутые стеки для flame graph."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self.stacks = Counter()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            parts = []
+            while frame is not None:
+                code = frame.f_code
+                parts.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(parts))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {n}\n' for stack, n in self.stacks.most_common())
+
+
+def _mode_from_request():
+    value = request.headers.get('X-Profile') or request.args.get('_profile')
+    if not value:
+        return None
+    value = value.strip().lower()
+    if value in ('sample', 'sampling'):
+        return 'sample'
+    if value in ('1', 'true', 'yes', 'cprofile'):
+        return 'cprofile'
+    return None
+
+
+def _before_request():
+    mode = _mode_from_request()
+    if mode is None or _profile_dir is None:
+        return
+    if not is_allowed(request.remote_addr):
+        return
+    if not _busy.acquire(blocking=False):
+        g._profile_skipped = True
+        return
+    g._profile_mode = mode
+    g._profile_t0 = time.perf_counter()
+    if mode == 'sample':
+        g._profiler = _StackSampler(threading.get_ident())
+        g._profiler.start()
+    else:
+        g._profiler = cProfile.Profile()
+        g._profiler.enable()
+
+
+def _stop_profiler():
+    profiler = g.pop('_profiler', None)
+    if profiler is None:
+        return None
+    try:
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+        else:
+            profiler.stop()
+    finally:
+        _busy.release()
+    return profiler
+
+
+def _after_request(response):
+    if g.pop('_profile_skipped', False):
+        response.headers['X-Profile-Skipped'] = 'busy'
+        return response
+    profiler = _stop_profiler()
+    if profiler is None:
+        return response
+    duration = time.perf_counter() - g.pop('_profile_t0')
+    mode = g.pop('_profile_mode')
+    try:
+        profile_id = _save(profiler, mode, duration, response.status_code)
+        response.headers['X-Profile-Id'] = profile_id
+    except Exception:
+        _log.exception('failed to save profile')
+    return response
+
+
+def _teardown_request(exc):
+    # Если обработчик упал до after_request, профилировщик всё равно нужно остановить
+    _stop_profiler()
+
+
+def _save(profiler, mode, duration, status):
+    _profile_dir.mkdir(parents=True, exist_ok=True)
+    slug = re.sub(r'[^a-zA-Z0-9]+', '-', request.path).strip('-') or 'root'
+    profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}_{slug}"
+    if mode == 'sample':
+        filename = profile_id + '.folded'
+        (_profile_dir / filename).write_text(profiler.folded(), encoding='utf-8')
+    else:
+        filename = profile_id + '.prof'
+        profiler.dump_stats(str(_profile_dir / filename))
+    info = {
+        'id': profile_id,
+        'file': filename,
+        'mode': mode,
+        'method': request.method,
+        'path': request.path,
+        'query': request.query_string.decode('utf-8', errors='replace'),
+        'status': status,
+        'duration_ms': round(duration * 1000, 2),
+        'created': time.time(),
+    }
+    with open(_profile_dir / (profile_id + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    _prune()
+    return profile_id
+
+
+def _prune():
+    metas = sorted(_profile_dir.glob('*.json'))
+    for meta in metas[:-MAX_PROFILES] if len(metas) > MAX_PROFILES else []:
+        for path in _profile_dir.glob(meta.stem + '.*'):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+def list_profiles(limit=MAX_PROFILES):
+    """Описания последних профилей, новые первыми."""
+    if _profile_dir is None or not _profile_dir.exists():
+        return []
+    out = []
+    for meta in sorted(_profile_dir.glob('*.json'), reverse=True)[:limit]:
+        try:
+            with open(meta, 'r', encoding='utf-8') as f:
+                out.append(json.load(f))
+        except Exception:
+            continue
+    return out
+
+
+def profile_dir():
+    return _profile_dir
+
+
+def install(app, directory):
+    """Подключает профилирование к Flask-приложению; профили пишутся в directory."""
+    global _profile_dir, _allow
+    _profile_dir = Path(directory)
+    _allow = _parse_allow(os.environ.get('WDR_PROFILE_ALLOW', _DEFAULT_ALLOW))
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
@@ -0,0 +1,258 @@
+"""
+Хранилище результатов QR по узлам (узел -> код) в памяти с ревизиями.
+
+Каждое изменение получает ревизию на 1 больше предыдущей; клиент, который уже
+видел ревизию R, запрашивает только изменения после неё (changes_since), и
+стоимость ответа зависит от числа изменений, а не от размера склада. Стартовая
+ревизия — время загрузки в мс, так что курсор клиента из прошлого запуска
+сервера меньше любой новой ревизии и не теряет изменения.
+
+Диск (nodes_qr.json) — только для сохранения между запусками: запись отложенная
+(не чаще раза в PERSIST_DELAY секунд) и атомарная. Рядом, в nodes_qr_seen.json,
+хранится время последнего осмотра каждого узла (в том числе осмотров, где кода
+не нашлось) — по нему планируется облёт только устаревших узлов.
+
+Вместе с кодами ведётся обратный индекс код -> узлы (inventory.py) для поиска товара.
+
+На стеллажах с несколькими уровнями код хранится по ячейке «узел@уровень»
+(slot_key): у узла 3_4 на втором уровне ключ 3_4@2. Без уровня ключ — id узла.
+Коды, замеченные камерой наземного робота, хранятся отдельно от снятых дроном —
+по ключу «узел#robot» (source_key), и никогда не перезаписывают записи дрона.
+
+load() только запоминает файл: он читается при первом обращении к хранилищу, так
+что разбор большого nodes_qr.json не входит во время старта сервиса.
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import events
+from inventory import InventoryIndex
+
+_log = logging.getLogger(__name__)
+
+PERSIST_DELAY = 0.5
+LEVEL_SEP = '@'
+SOURCE_SEP = '#'
+ROBOT_SOURCE = 'robot'
+
+
+def slot_key(node_id, level=None):
+    """Ключ ячейки хранилища: id узла или «узел@уровень»."""
+    return node_id if level is None else f'{node_id}{LEVEL_SEP}{level}'
+
+
+def source_key(node_id, source=ROBOT_SOURCE):
+    """Ключ записи из другого источника (камера робота): «узел#источник»."""
+    return f'{node_id}{SOURCE_SEP}{source}'
+
+
+def split_slot(key):
+    """«узел@уровень» -> (узел, уровень); ключ без уровня -> (узел, None); «узел#источник» -> (узел, None)."""
+    key = str(key).partition(SOURCE_SEP)[0]
+    node_id, sep, level = key.partition(LEVEL_SEP)
+    if not sep:
+        return node_id, None
+    try:
+        return node_id, int(level)
+    except ValueError:
+        return node_id, level
+
+
+class QrStore:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = {}
+        self._ts = {}
+        # узел -> ревизия, упорядочено по ревизии (последнее изменение в конце)
+        self._revs = OrderedDict()
+        self._index = InventoryIndex()
+        self._base_rev = int(time.time() * 1000)
+        self.revision = self._base_rev
+        self._path = None
+        self._pending = False
+        self._load_lock = threading.Lock()
+        self._dirty = False
+        self._timer = None
+
+    def _seen_path(self):
+        return self._path.with_name(self._path.stem + '_seen.json')
+
+    def load(self, path):
+        """Задаёт файл сохранения; коды из него загрузятся при первом обращении."""
+        with self._load_lock:
+            with self._lock:
+                self._path = Path(path) if path else None
+            self._pending = True
+
+    def _ensure_loaded(self):
+        if not self._pending:
+            return
+        with self._load_lock:
+            if self._pending:
+                self._load_now()
+                self._pending = False
+
+    def _load_now(self):
+        """Загружает коды из файла сохранения. Пустые коды отбрасываются."""
+        data = {}
+        seen = {}
+        if self._path and self._path.exists():
+            try:
+                with open(self._path, 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                if isinstance(raw, dict):
+                    data = {k: str(v).strip() for k, v in raw.items() if v and str(v).strip()}
+                # Без файла осмотров коды считаются снятыми в момент последней записи файла
+                mtime = self._path.stat().st_mtime
+                seen = {k: mtime for k in data}
+            except Exception:
+                _log.exception('failed to load %s', self._path)
+        if self._path and self._seen_path().exists():
+            try:
+                with open(self._seen_path(), 'r', encoding='utf-8') as f:
+                    raw = json.load(f)
+                if isinstance(raw, dict):
+                    seen.update((k, float(v)) for k, v in raw.items() if isinstance(v, (int, float)))
+            except Exception:
+                _log.exception('failed to load %s', self._seen_path())
+        with self._lock:
+            self._base_rev = max(int(time.time() * 1000), self.revision + 1)
+            self.revision = self._base_rev
+            self._codes = data
+            self._index.rebuild(data)
+            self._ts = seen
+            self._revs = OrderedDict((k, self._base_rev) for k in data)
+
+    def record(self, node_id, code):
+        """Запоминает код узла. Возвращает новую ревизию или None, если код не изменился."""
+        self._ensure_loaded()
+        code = str(code or '').strip()
+        if not node_id or not code:
+            return None
+        rev = None
+        with self._lock:
+            self._ts[node_id] = time.time()
+            if self._codes.get(node_id) != code:
+                self.revision += 1
+                rev = self.revision
+                self._codes[node_id] = code
+                self._index.set(node_id, code)
+                self._revs[node_id] = rev
+                self._revs.move_to_end(node_id)
+        if rev is not None:
+            events.publish('qr', {'node_id': node_id, 'code': code, 'rev': rev})
+        self._schedule_persist()
+        return rev
+
+    def mark_seen(self, node_id):
+        """Узел осмотрен, кода не нашлось: обновляет только время осмотра."""
+        self._ensure_loaded()
+        if not node_id:
+            return
+        with self._lock:
+            self._ts[node_id] = time.time()
+        self._schedule_persist()
+
+    def last_seen(self, node_id):
+        self._ensure_loaded()
+        with self._lock:
+            return self._ts.get(node_id)
+
+    def stale_nodes(self, node_ids, max_age=None):
+        """
+        Узлы из node_ids без осмотра или осмотренные раньше, чем max_age секунд назад
+        (max_age=None — только никогда не осмотренные). Порядок node_ids сохраняется.
+        """
+        self._ensure_loaded()
+        cutoff = None if max_age is None else time.time() - max_age
+        with self._lock:
+            ts = self._ts
+            return [nid for nid in node_ids
+                    if ts.get(nid) is None or (cutoff is not None and ts[nid] < cutoff)]
+
+    def get(self, node_id):
+        self._ensure_loaded()
+        with self._lock:
+            return self._codes.get(node_id)
+
+    def find(self, code):
+        """Узлы, где снят код code (без учёта регистра)."""
+        self._ensure_loaded()
+        with self._lock:
+            return self._index.lookup(code)
+
+    def search(self, prefix, limit=50):
+        """[(код, узел), ...] — коды, начинающиеся с prefix."""
+        self._ensure_loaded()
+        with self._lock:
+            return self._index.search(prefix, limit)
+
+    def snapshot(self):
+        """(ревизия, копия всех кодов)."""
+        self._ensure_loaded()
+        with self._lock:
+            return self.revision, dict(self._codes)
+
+    def changes_since(self, since):
+        """
+        (ревизия, {узел: код}, full). Если since старше начала журнала текущего запуска
+        или из будущего — возвращается полный снимок и full=True.
+        """
+        self._ensure_loaded()
+        with self._lock:
+            if since < self._base_rev or since > self.revision:
+                return self.revision, dict(self._codes), True
+            out = {}
+            for node_id in reversed(self._revs):
+                if self._revs[node_id] <= since:
+                    break
+                out[node_id] = self._codes[node_id]
+            return self.revision, out, False
+
+    def _schedule_persist(self):
+        if self._path is None:
+            return
+        with self._lock:
+            self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(PERSIST_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Сохраняет коды на диск, если были изменения."""
+        with self._lock:
+            self._timer = None
+            if not self._dirty or self._path is None:
+                return
+            self._dirty = False
+            to_save = dict(self._codes)
+            seen = {k: round(v, 3) for k, v in self._ts.items()}
+            path = self._path
+            seen_path = self._seen_path()
+        _write_json(path, to_save, indent=2)
+        _write_json(seen_path, seen)
+
+
+def _write_json(path, data, indent=None):
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Через временный файл: файл никогда не бывает недописанным
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+        os.replace(tmp, path)
+    except Exception:
+        _log.exception('failed to save %s', path)
+
+
+store = QrStore()
+atexit.register(store.flush)
@@ -0,0 +1,250 @@
+"""
+Сканер QR по видеопотоку камеры наземного робота (ESP32-CAM, MJPEG /stream).
+
+Два потока:
+  - чтение: непрерывно забирает кадры из потока и хранит только последний, так
+    что буфер MJPEG не копит задержку, пока идёт распознавание;
+  - распознавание: берёт самый свежий кадр (промежуточные отбрасываются),
+    ищет в нём QR (dronecontroller._detect_qr_multi) и отдаёт новые коды.
+
+Один и тот же код в одном и том же узле повторно не записывается, пока он
+виден чаще, чем раз в DEDUP_SEC секунд. Код привязывается к узлу робота
+(robotcontroller.get_robot_node), только если робот стоит в узле — не едет и не
+двигался последние SETTLE_SEC секунд — и в кадре ровно один код: камера видит и
+соседние стеллажи, и по нескольким кодам нельзя понять, какой из них — этого узла.
+Привязанный код попадает в qr_store по отдельному ключу «узел#robot»
+(qr_store.source_key) и не перезаписывает код, снятый в узле дроном. Остальные
+коды только считаются в статистике.
+
+Адрес потока — WDR_ROBOT_CAMERA_URL; WDR_ROBOT_CAMERA=1 запускает сканер вместе
+с сервисом (см. app.py). Отдельно, без сервиса: python cv.py из корня репозитория.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+import dronecontroller
+import lazy
+import robotcontroller
+from qr_store import source_key, store as qr_store
+
+_log = logging.getLogger(__name__)
+
+STREAM_URL = os.environ.get('WDR_ROBOT_CAMERA_URL', 'http://192.168.4.1/stream')
+DEDUP_SEC = 5.0
+# Сколько робот должен простоять в узле, прежде чем код кадра привязывается к нему
+SETTLE_SEC = 1.0
+RECONNECT_SEC = 2.0
+RECENT_CODES = 20
+
+
+def _cv2():
+    return lazy.optional('cv2')
+
+
+def _stopped_node(base_url):
+    """Узел, где робот стоит не меньше SETTLE_SEC секунд, или None."""
+    info = robotcontroller.get_robot_node(base_url)
+    if info.get('moving') or info.get('updated') is None or time.time() - info['updated'] < SETTLE_SEC:
+        return None
+    return info.get('node_id')
+
+
+def _open_capture(url):
+    cv2 = _cv2()
+    if cv2 is None:
+        raise RuntimeError('OpenCV не установлен')
+    cap = cv2.VideoCapture(url)
+    # Внутренний буфер — один кадр: старые кадры нам не нужны
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+class RobotCameraScanner:
+    """
+    capture_factory(url) -> объект с read() -> (ok, frame) и release()
+    (по умолчанию cv2.VideoCapture). locate() -> id узла, где стоит робот, или None.
+    store — куда писать коды (None — никуда, только on_code).
+    on_code(code, node_id) вызывается для каждого нового (не повторного) кода;
+    node_id — None, если код не привязан к узлу.
+    """
+
+    def __init__(self, url=STREAM_URL, base_url=None, capture_factory=None, locate=None,
+                 store=qr_store, on_code=None, dedup_sec=DEDUP_SEC):
+        self.url = url
+        self.base_url = base_url
+        self._capture_factory = capture_factory or _open_capture
+        self._locate = locate or (lambda: _stopped_node(self.base_url))
+        self._store = store
+        self._on_code = on_code
+        self.dedup_sec = dedup_sec
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._decoded_seq = 0
+        self._stop = threading.Event()
+        self._threads = []
+        # (код, узел) -> когда код последний раз был виден
+        self._seen = {}
+        self._recent = deque(maxlen=RECENT_CODES)
+        self.connected = False
+        self.error = None
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self.frames_skipped = 0
+        self.codes = 0
+        self.duplicates = 0
+        self.unassigned = 0
+        self.ambiguous = 0
+
+    def start(self):
+        if self.is_running():
+            return
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._read_loop, name='robot-camera-read', daemon=True),
+                         threading.Thread(target=self._decode_loop, name='robot-camera-decode', daemon=True)]
+        for t in self._threads:
+            t.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def is_running(self):
+        return any(t.is_alive() for t in self._threads)
+
+    def latest_frame(self):
+        with self._cond:
+            return self._frame
+
+    def _read_loop(self):
+        while not self._stop.is_set():
+            try:
+                cap = self._capture_factory(self.url)
+            except Exception as e:
+                self.error = str(e)
+                _log.warning('robot camera %s: %s', self.url, e)
+                self._stop.wait(RECONNECT_SEC)
+                continue
+            try:
+                while not self._stop.is_set():
+                    ok, frame = cap.read()
+                    if not ok or frame is None:
+                        self.error = 'Не удалось получить кадр'
+                        break
+                    self.connected, self.error = True, None
+                    with self._cond:
+                        if self._frame is not None and self._seq != self._decoded_seq:
+                            self.frames_skipped += 1
+                        self._frame = frame
+                        self._seq += 1
+                        self.frames_read += 1
+                        self._cond.notify()
+            finally:
+                self.connected = False
+                try:
+                    cap.release()
+                except Exception:
+                    pass
+            self._stop.wait(RECONNECT_SEC)
+
+    def _decode_loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while self._seq == self._decoded_seq and not self._stop.is_set():
+                    self._cond.wait(0.5)
+                if self._stop.is_set():
+                    return
+                frame, self._decoded_seq = self._frame, self._seq
+            try:
+                found = dronecontroller._detect_qr_multi(frame)
+            except Exception:
+                _log.exception('robot camera decode failed')
+                continue
+            self.frames_decoded += 1
+            codes = {qr['data'] for qr in found if qr.get('data')}
+            if codes:
+                self._handle(codes)
+
+    def _handle(self, codes):
+        now = time.monotonic()
+        node_id = None
+        if len(codes) > 1:
+            self.ambiguous += 1
+        else:
+            try:
+                node_id = self._locate()
+            except Exception:
+                _log.exception('robot node lookup failed')
+        for key, seen in list(self._seen.items()):
+            if now - seen > self.dedup_sec:
+                del self._seen[key]
+        for code in codes:
+            key = (code, node_id)
+            repeated = key in self._seen
+            self._seen[key] = now
+            if repeated:
+                self.duplicates += 1
+                continue
+            self.codes += 1
+            self._recent.append({'code': code, 'node_id': node_id, 'ts': time.time()})
+            if node_id is None:
+                self.unassigned += 1
+            elif self._store is not None:
+                self._store.record(source_key(node_id), code)
+            _log.info('robot camera: %s at node %s', code, node_id)
+            if self._on_code is not None:
+                self._on_code(code, node_id)
+
+    def stats(self):
+        return {
+            'url': self.url,
+            'running': self.is_running(),
+            'connected': self.connected,
+            'error': self.error,
+            'frames_read': self.frames_read,
+            'frames_decoded': self.frames_decoded,
+            'frames_skipped': self.frames_skipped,
+            'codes': self.codes,
+            'duplicates': self.duplicates,
+            'unassigned': self.unassigned,
+            'ambiguous': self.ambiguous,
+            'recent': list(self._recent),
+        }
+
+
+_scanner = None
+_scanner_lock = threading.Lock()
+
+
+def start(url=None, base_url=None):
+    """Запускает сканер сервиса (перезапускает, если поменялся адрес потока или робота)."""
+    global _scanner
+    with _scanner_lock:
+        if (_scanner is not None and _scanner.is_running() and url in (None, _scanner.url)
+                and base_url in (None, _scanner.base_url)):
+            return _scanner.stats()
+        if _scanner is not None:
+            _scanner.stop()
+        _scanner = RobotCameraScanner(url or STREAM_URL, base_url=base_url)
+        _scanner.start()
+        return _scanner.stats()
+
+
+def stop():
+    with _scanner_lock:
+        if _scanner is not None:
+            _scanner.stop()
+
+
+def stats():
+    with _scanner_lock:
+        if _scanner is None:
+            return {'url': STREAM_URL, 'running': False}
+        return _scanner.stats()
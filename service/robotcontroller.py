@@ -2,17 +2,48 @@
 Управление наземным роботом по HTTP (ESP8266).
 Робот доступен по IP 192.168.4.1 при подключении к его Wi‑Fi (RobotAP).
 Команды: DRIVE_DIST, TURN, LIFT_UP, LIFT_DOWN, STOP.
+
+Маршрут выбирается по длине пути; с WDR_ROUTE_BY_TIME=1 — по ожидаемому времени
+поездки с учётом поворотов (trip_costs.py, выучено по телеметрии прошлых поездок).
 """
+import heapq
+import itertools
 import logging
+import math
+import os
+import threading
 import time
+from collections import OrderedDict
 import urllib.error
 import urllib.parse
 import urllib.request
 
+import events
+import metrics
+import telemetry
+from trip_costs import costs as trip_costs
+
 _log = logging.getLogger(__name__)
 
 ROBOT_DEFAULT_IP = "192.168.4.1"
 ROBOT_TIMEOUT = 5
+# Возврат к старту считается по позиции не старше этого (после последней команды движения)
+RETURN_POSITION_MAX_AGE = 1.0
+# Маршрут по выученному времени (trip_costs) вместо длины. Выключен по умолчанию: время
+# команды учится только по телеметрии (_motion_finished), а прошивка esp8266_robot_ap
+# отвечает на команду сразу и /get_position не отдаёт.
+ROUTE_BY_TIME = os.environ.get("WDR_ROUTE_BY_TIME", "0").lower() in ("1", "true", "yes")
+# Замерять время движения команд (ждать конца движения по телеметрии); по умолчанию —
+# вместе с ROUTE_BY_TIME, WDR_TRIP_TIMING=1 — учить оценки, не меняя маршрутов
+TRIP_TIMING = os.environ.get("WDR_TRIP_TIMING", "1" if ROUTE_BY_TIME else "0").lower() in ("1", "true", "yes")
+# Конец движения — одометрия не меняется дольше SETTLE_SEC (позиция — с точностью до
+# сантиметра, и медленный проезд между двумя соседними замерами её не меняет)
+SETTLE_EPS_M = 0.005
+SETTLE_EPS_DEG = 0.5
+SETTLE_SEC = 0.3
+MOTION_SETTLE_TIMEOUT = 30.0
+
+_job_ids = itertools.count(1)
 
 
 def _node_by_id(nodes, node_id):
@@ -37,6 +68,7 @@ def _build_adj(graph):
     return adj
 
 
+@metrics.timed(metrics.STAGE_SECONDS, stage="dijkstra")
 def _dijkstra(adj, start_id, target_id):
     """Дейкстра, возвращает путь [id, id, ...] или []."""
     import math
@@ -85,16 +117,94 @@ def _normalize_angle(a):
     return a
 
 
-def _path_to_commands(path, nodes, adj):
+def _route_neighbors(graph):
+    """(соседи узла: id -> [(id, длина)], координаты узла: id -> (i, j)) или None, если граф их не даёт."""
+    if isinstance(graph, dict):
+        adj = _build_adj(graph)
+        coords = {n["id"]: (n.get("i", 0), n.get("j", 0)) for n in graph.get("nodes", [])}
+        return adj.get, coords.get
+    if isinstance(getattr(graph, "adj", None), dict):
+        def node_coords(nid):
+            n = graph.node(nid)
+            return (n["i"], n["j"]) if n is not None else None
+        return lambda nid: list(graph.adj.get(nid, {}).items()), node_coords
+    return None
+
+
+@metrics.timed(metrics.STAGE_SECONDS, stage="time_path")
+def _time_path(neighbors, coords, start_id, target_id, heading=90, costs=trip_costs):
+    """
+    Путь с наименьшим ожидаемым временем по графу состояний (узел, курс): переход в
+    соседа стоит поворота к нему (costs.turn_time) и проезда ребра (costs.edge_time),
+    так что лишние повороты учитываются, как в _path_to_commands. Возвращает [id, ...] или [].
+    """
+    if coords(start_id) is None or coords(target_id) is None:
+        return []
+    start = (start_id, heading % 360)
+    best = {start: 0.0}
+    prev = {start: None}
+    counter = itertools.count()
+    heap = [(0.0, next(counter), start)]
+    end = None
+    while heap:
+        d, _, state = heapq.heappop(heap)
+        if d > best.get(state, math.inf):
+            continue
+        u = state[0]
+        if u == target_id:
+            end = state
+            break
+        cu = coords(u)
+        for v, ln in neighbors(u) or ():
+            cv = coords(v)
+            if cv is None:
+                continue
+            direction = _direction_to_angle(cv[0] - cu[0], cv[1] - cu[1])
+            delta = _normalize_angle(direction - state[1])
+            cost = costs.turn_time(delta) if abs(delta) > 1 else 0.0
+            if ln > 0.01:
+                cost += costs.edge_time(u, v, ln)
+            nxt = (v, direction % 360)
+            alt = d + cost
+            if alt < best.get(nxt, math.inf):
+                best[nxt] = alt
+                prev[nxt] = state
+                heapq.heappush(heap, (alt, next(counter), nxt))
+    if end is None:
+        return []
+    path = []
+    while end is not None:
+        path.append(end[0])
+        end = prev[end]
+    path.reverse()
+    return path
+
+
+def _command_steps(start_id, commands, trace):
+    """Шаги поездки для trip_costs: [(тип, из узла, в узел, длина м | угол °)] по командам и trace."""
+    steps = []
+    node = start_id
+    for (cmd_type, kwargs), (after, _) in zip(commands, trace):
+        if cmd_type == "drive":
+            steps.append(("drive", node, after, float(kwargs["d"])))
+        else:
+            steps.append(("turn", node, node, float(kwargs["angle"])))
+        node = after
+    return steps
+
+
+@metrics.timed(metrics.STAGE_SECONDS, stage="path_to_commands")
+def _path_to_commands(path, nodes, adj, heading=90, trace=None):
     """
     Преобразует путь [node_id, ...] в список команд (type, kwargs).
-    type: 'turn' | 'drive'
+    type: 'turn' | 'drive'. heading — курс робота в начале пути (90° = +j).
+    Если передан список trace, в него для каждой команды добавляется
+    (узел, курс) робота после её выполнения.
     """
     if len(path) < 2:
         return []
     node_map = {n["id"]: n for n in nodes}
     commands = []
-    heading = 90  # начальная ориентация: 90° = +j (вперёд по вертикали)
     for k in range(len(path) - 1):
         a_id = path[k]
         b_id = path[k + 1]
@@ -114,13 +224,36 @@ def _path_to_commands(path, nodes, adj):
         if abs(delta) > 1:
             commands.append(("turn", {"angle": delta}))
             heading = target_angle
+            if trace is not None:
+                trace.append((a_id, heading))
         if length > 0.01:
             commands.append(("drive", {"d": round(length, 2)}))
+            if trace is not None:
+                trace.append((b_id, heading))
     return commands
 
 
+# Команды, после которых позиция в кэше телеметрии устаревает
+_MOTION_PATHS = frozenset(("/drive_dist", "/turn", "/lift_up", "/lift_down", "/stop", "/reset_position"))
+
+
+def _telemetry(base_url):
+    """Поток телеметрии робота: единственный, кто опрашивает /get_position."""
+    key = telemetry.normalize_base_url(base_url, ROBOT_DEFAULT_IP)
+    return telemetry.get_poller(key, lambda: _http_get(key, "/get_position"))
+
+
 def _robot_request(base_url, path, params=None):
     """GET к роботу. base_url без http, например 192.168.4.1."""
+    if path in _MOTION_PATHS:
+        poller = telemetry.find_poller(telemetry.normalize_base_url(base_url, ROBOT_DEFAULT_IP))
+        if poller is not None:
+            with poller.hold():
+                return _http_get(base_url, path, params)
+    return _http_get(base_url, path, params)
+
+
+def _http_get(base_url, path, params=None):
     if not base_url:
         base_url = ROBOT_DEFAULT_IP
     if "://" not in base_url:
@@ -130,18 +263,86 @@ def _robot_request(base_url, path, params=None):
         q = "&".join(f"{k}={urllib.parse.quote(str(v))}" for k, v in params.items())
         url = url + ("&" if "?" in url else "?") + q
     req = urllib.request.Request(url, method="GET")
+    t0 = time.perf_counter()
+    result = "error"
     try:
         with urllib.request.urlopen(req, timeout=ROBOT_TIMEOUT) as resp:
-            return resp.read().decode("utf-8", errors="replace").strip(), None
+            text = resp.read().decode("utf-8", errors="replace").strip()
+        result = "ok"
+        return text, None
     except urllib.error.URLError as e:
         return None, str(e)
     except Exception as e:
         return None, str(e)
+    finally:
+        metrics.ROBOT_REQUEST_SECONDS.observe(time.perf_counter() - t0, endpoint=path, result=result)
+
+
+def _same_pose(a, b):
+    return (abs(a.x - b.x) <= SETTLE_EPS_M and abs(a.y - b.y) <= SETTLE_EPS_M
+            and abs((a.angle - b.angle + 180.0) % 360.0 - 180.0) <= SETTLE_EPS_DEG)
+
+
+def _healthy_poller(base_url):
+    poller = telemetry.find_poller(telemetry.normalize_base_url(base_url, ROBOT_DEFAULT_IP))
+    return poller if poller is not None and poller.healthy else None
+
+
+def _pose_before_motion(base_url):
+    """Показание одометрии перед командой (None — телеметрии нет)."""
+    poller = _healthy_poller(base_url)
+    if poller is None:
+        return None
+    pos, _, err = poller.fresh(RETURN_POSITION_MAX_AGE, timeout=ODOMETRY_TIMEOUT)
+    return None if err else pos
 
 
-def _execute_commands(commands, base_url):
-    """Выполняет список команд (turn, drive) через HTTP."""
-    for cmd_type, kwargs in commands:
+def _motion_finished(base_url, since, before, timeout=MOTION_SETTLE_TIMEOUT):
+    """
+    Когда робот на деле закончил движение, начатое в since (time.time()) из положения
+    before: ждёт по телеметрии, пока одометрия не сдвинется от before и затем не
+    перестанет меняться на SETTLE_SEC. Конец движения — между последним замером в движении и первым
+    замером конечного положения; возвращается середина этого интервала.
+    None — телеметрии нет (прошивка без /get_position) или робот не доехал за timeout:
+    ответ на команду — лишь подтверждение приёма, и его время за время движения не
+    выдаётся.
+    """
+    poller = _healthy_poller(base_url)
+    if poller is None or before is None:
+        return None
+    deadline = time.monotonic() + timeout
+    last, first_ts, moving_ts, last_ts = None, None, since, since
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        pos, ts, err = poller.wait_newer(last_ts, remaining)
+        if err:
+            return None
+        last_ts = ts
+        if _same_pose(pos, before):
+            # Робот ещё не тронулся
+            continue
+        if last is not None and _same_pose(pos, last):
+            if ts - first_ts >= SETTLE_SEC:
+                return (moving_ts + first_ts) / 2
+            continue
+        if last is not None:
+            moving_ts = first_ts
+        last, first_ts = pos, ts
+
+
+def _execute_commands(commands, base_url, progress=None, durations=None):
+    """
+    Выполняет список команд (turn, drive) через HTTP. progress(k) вызывается после k-й
+    команды. В durations (если задан) дописывается время движения каждой команды, с, или
+    None — не измерено. Измеряет только с TRIP_TIMING: команда ждёт конца движения по
+    телеметрии (_motion_finished), а без замеров поездка не замедляется.
+    """
+    measure = durations is not None and TRIP_TIMING
+    for k, (cmd_type, kwargs) in enumerate(commands):
+        before = _pose_before_motion(base_url) if measure else None
+        t0 = time.time()
         if cmd_type == "turn":
             _, err = _robot_request(base_url, "/turn", {"angle": kwargs["angle"]})
         elif cmd_type == "drive":
@@ -150,9 +351,20 @@ def _execute_commands(commands, base_url):
             continue
         if err:
             return False, err
+        if durations is not None:
+            done = _motion_finished(base_url, t0, before) if measure else None
+            durations.append(None if done is None else max(0.0, done - t0))
+        if progress is not None:
+            progress(k + 1)
     return True, None
 
 
+def _publish_job(job, **changes):
+    """Обновляет состояние поездки и публикует его в канал 'robot'."""
+    job.update(changes)
+    events.publish("robot", dict(job), retain=True)
+
+
 def _invert_commands(commands):
     """Инвертирует команды для возврата обратно тем же путём.
 
@@ -174,13 +386,164 @@ def _invert_commands(commands):
     return inv
 
 
+# Положение робота на графе: узел и курс после каждой выполненной команды. Одометрия
+# (/get_position) привязывается к графу якорем — показанием, снятым в известном узле
+# с известным курсом; по нему положение пересчитывается в ближайший узел (snap).
+# Оси одометрии: Y — вперёд по курсу робота в момент сброса, X — вправо, Angle — против
+# часовой стрелки, так что курс в графе = курс при сбросе + Angle.
+SNAP_MAX_CELLS = 0.6
+# Сколько ждать показание одометрии для привязки; без него робот ведётся только по командам
+ODOMETRY_TIMEOUT = 1.0
+# После неудачного опроса /get_position (у прошивки esp8266_robot_ap его нет) привязка
+# не пробуется столько секунд, и отправка робота не ждёт телеметрию
+ODOMETRY_RETRY_SEC = 60.0
+
+
+class _RobotTrack:
+    def __init__(self):
+        self.node = None
+        self.heading = 90
+        self.home = None
+        # (Position, узел, курс в графе) — показание одометрии в известной точке
+        self.anchor = None
+        self.source = None
+        self.updated = None
+        # Идёт поездка: узел — промежуточный, робот в движении
+        self.moving = False
+
+    def move(self, node, heading, source="commands"):
+        self.node = node
+        self.heading = heading
+        self.source = source
+        self.updated = time.time()
+
+    def as_dict(self):
+        return {"node_id": self.node, "heading": self.heading, "home": self.home,
+                "source": self.source, "updated": self.updated, "anchored": self.anchor is not None,
+                "moving": self.moving}
+
+
+_tracks = {}
+_tracks_lock = threading.Lock()
+
+
+def _track(base_url):
+    key = telemetry.normalize_base_url(base_url, ROBOT_DEFAULT_IP)
+    with _tracks_lock:
+        track = _tracks.get(key)
+        if track is None:
+            track = _tracks[key] = _RobotTrack()
+        return track
+
+
+def get_robot_node(base_url=None):
+    """Где робот на графе: {node_id, heading, home, source, updated, anchored, moving}."""
+    return _track(base_url).as_dict()
+
+
+def set_robot_node(base_url, node_id, heading=90, home=False):
+    """Задаёт положение робота вручную (робот поставлен в узел node_id курсом heading)."""
+    track = _track(base_url)
+    track.move(node_id, heading, source="manual")
+    track.anchor = None
+    if home or track.home is None:
+        track.home = node_id
+    return track.as_dict()
+
+
+def _graph_node(graph, node_id):
+    if isinstance(graph, dict):
+        return _node_by_id(graph.get("nodes", []), node_id)
+    return graph.node(node_id)
+
+
+def _graph_scale(graph):
+    meta = (graph.get("meta") if isinstance(graph, dict) else getattr(graph, "meta", None)) or {}
+    return float(meta.get("scaleX") or 1), float(meta.get("scaleY") or 1)
+
+
+def _nearest_node(graph, fi, fj):
+    """Ближайший к точке (fi, fj) в клетках узел графа и расстояние до него в клетках."""
+    ri, rj = int(round(fi)), int(round(fj))
+    node = _graph_node(graph, f"{ri}_{rj}")
+    if node is not None and node.get("i") == ri and node.get("j") == rj:
+        return node["id"], math.hypot(fi - ri, fj - rj)
+    if isinstance(graph, dict):
+        candidates = graph.get("nodes", [])
+    else:
+        candidates = (graph.node(nid) for nid in graph.node_ids())
+    best, best_d = None, math.inf
+    for n in candidates:
+        d = math.hypot(fi - n.get("i", 0), fj - n.get("j", 0))
+        if d < best_d:
+            best, best_d = n["id"], d
+    return best, best_d
+
+
+def _anchor(track, base_url):
+    """
+    Запоминает показание одометрии в текущем узле робота. Если недавний опрос не
+    удался, не пробует вовсе; неудачный опрос возвращает ошибку сразу, не ждёт timeout.
+    """
+    poller = telemetry.find_poller(telemetry.normalize_base_url(base_url, ROBOT_DEFAULT_IP))
+    if poller is not None and poller.failed_within(ODOMETRY_RETRY_SEC):
+        return
+    pos, _, err = _telemetry(base_url).fresh(RETURN_POSITION_MAX_AGE, timeout=ODOMETRY_TIMEOUT)
+    if err is None and track.node is not None:
+        track.anchor = (pos, track.node, track.heading)
+
+
+def _relocalize(graph, base_url, track):
+    """
+    Пересчитывает одометрию в ближайший узел графа и курс, кратный 90°. Если оценка
+    дальше SNAP_MAX_CELLS от любого узла или позиции нет — положение не меняется.
+    """
+    if track.anchor is None:
+        return False
+    pos, _, err = _telemetry(base_url).fresh(RETURN_POSITION_MAX_AGE, timeout=ODOMETRY_TIMEOUT)
+    if err:
+        return False
+    a_pos, a_node_id, a_heading = track.anchor
+    a_node = _graph_node(graph, a_node_id)
+    if a_node is None:
+        return False
+    # Поворот осей одометрии относительно графа
+    c = math.radians(a_heading - a_pos.angle)
+    dx, dy = pos.x - a_pos.x, pos.y - a_pos.y
+    wi = dy * math.cos(c) + dx * math.sin(c)
+    wj = dy * math.sin(c) - dx * math.cos(c)
+    sx, sy = _graph_scale(graph)
+    node_id, off = _nearest_node(graph, a_node.get("i", 0) + wi / sx, a_node.get("j", 0) + wj / sy)
+    if node_id is None or off > SNAP_MAX_CELLS:
+        _log.warning("odometry %.2f cells from any node, keeping %s", off, track.node)
+        return False
+    heading = _normalize_angle(round((a_heading - a_pos.angle + pos.angle) / 90.0) * 90)
+    if node_id != track.node:
+        _log.warning("robot relocalized: %s -> %s by odometry", track.node, node_id)
+    track.move(node_id, heading, source="odometry")
+    return True
+
+
+def get_robot_telemetry(base_url=None):
+    """
+    Позиция робота из кэша телеметрии: {position: {x, y, angle}, raw, ts, age_sec,
+    stale, error}. Если замеров нет (или робот с тех пор ездил) — ждёт новый до ROBOT_TIMEOUT.
+    """
+    poller = _telemetry(base_url)
+    snap = poller.snapshot()
+    if snap["ts"] is None:
+        poller.fresh(poller.stale_after, timeout=ROBOT_TIMEOUT)
+        snap = poller.snapshot()
+    return snap
+
+
 def get_robot_position(base_url=None):
-    """Получает текущую позицию робота."""
-    base_url = base_url or ROBOT_DEFAULT_IP
-    response, err = _robot_request(base_url, "/get_position")
+    """Получает текущую позицию робота (строка ответа /get_position, из кэша телеметрии)."""
+    poller = _telemetry(base_url)
+    _, raw, err = poller.fresh(poller.stale_after, timeout=ROBOT_TIMEOUT)
     if err:
         return None, err
-    return response, None
+    return raw, None
 
 
 def reset_robot_position(base_url=None):
@@ -189,64 +552,67 @@ def reset_robot_position(base_url=None):
     response, err = _robot_request(base_url, "/reset_position")
     if err:
         return False, err
+    # Начало одометрии теперь здесь: это и есть «старт» для возврата
+    track = _track(base_url)
+    if track.node is not None:
+        track.anchor = (telemetry.Position(0.0, 0.0, 0.0), track.node, track.heading)
+        track.home = track.node
     return True, response
 
 
-def return_robot_to_start(base_url=None):
-    """Отправляет робота в исходную точку."""
+def return_robot_to_start(base_url=None, graph=None):
+    """
+    Отправляет робота в исходную точку. С графом и известным положением робота —
+    по кратчайшему пути через граф из фактического узла (в обход стеллажей);
+    иначе — по прямой к началу одометрии.
+    """
     base_url = base_url or ROBOT_DEFAULT_IP
-    # Получаем текущую позицию
-    position, err = _robot_request(base_url, "/get_position")
+    track = _track(base_url)
+    if graph is not None and track.node is not None and track.home is not None:
+        _relocalize(graph, base_url, track)
+        if track.node == track.home:
+            return True, "Already at start position"
+        ok, err = _drive_path(graph, base_url, track, track.home)
+        if not ok:
+            return False, err
+        return True, f"Returned to start node {track.home}"
+    # Свежая позиция после последней команды движения (кэш телеметрии)
+    pos, _, err = _telemetry(base_url).fresh(RETURN_POSITION_MAX_AGE, timeout=ROBOT_TIMEOUT)
     if err:
         return False, err
-    
-    # Парсим позицию для получения координат
-    try:
-        # Формат: "Position: X=1.23, Y=2.45, Angle=90.0°"
-        if "X=" in position and "Y=" in position:
-            x_str = position.split("X=")[1].split(",")[0].strip()
-            y_str = position.split("Y=")[1].split(",")[0].strip()
-            angle_str = position.split("Angle=")[1].replace("°", "").strip()
-            
-            x = float(x_str)
-            y = float(y_str)
-            current_angle = float(angle_str)
-            
-            # Расчет расстояния до исходной точки
-            distance = (x**2 + y**2)**0.5
-            
-            if distance < 0.05:  # если уже у исходной точки
-                return True, "Already at start position"
-            
-            # Расчет угла к исходной точке
-            target_angle = (-y / distance) * 90  # упрощенный расчет
-            if x < 0:
-                target_angle = -target_angle
-                
-            angle_diff = target_angle - current_angle
-            
-            # Нормализация разницы углов
-            while angle_diff > 180:
-                angle_diff -= 360
-            while angle_diff < -180:
-                angle_diff += 360
-            
-            # Сначала поворачиваем к исходной точке
-            if abs(angle_diff) > 1:
-                _, err = _robot_request(base_url, "/turn", {"angle": angle_diff})
-                if err:
-                    return False, f"Turn error: {err}"
-            
-            # Затем едем НАЗАД к исходной точке (отрицательное расстояние)
-            _, err = _robot_request(base_url, "/drive_dist", {"d": -distance})
-            if err:
-                return False, f"Drive error: {err}"
-                
-            return True, f"Returned to start: distance={distance:.2f}m back"
-        else:
-            return False, "Invalid position format"
-    except Exception as e:
-        return False, f"Position parsing error: {str(e)}"
+    x, y, current_angle = pos.x, pos.y, pos.angle
+
+    # Расчет расстояния до исходной точки
+    distance = (x**2 + y**2)**0.5
+
+    if distance < 0.05:  # если уже у исходной точки
+        return True, "Already at start position"
+
+    # Расчет угла к исходной точке
+    target_angle = (-y / distance) * 90  # упрощенный расчет
+    if x < 0:
+        target_angle = -target_angle
+
+    angle_diff = target_angle - current_angle
+
+    # Нормализация разницы углов
+    while angle_diff > 180:
+        angle_diff -= 360
+    while angle_diff < -180:
+        angle_diff += 360
+
+    # Сначала поворачиваем к исходной точке
+    if abs(angle_diff) > 1:
+        _, err = _robot_request(base_url, "/turn", {"angle": angle_diff})
+        if err:
+            return False, f"Turn error: {err}"
+
+    # Затем едем НАЗАД к исходной точке (отрицательное расстояние)
+    _, err = _robot_request(base_url, "/drive_dist", {"d": -distance})
+    if err:
+        return False, f"Drive error: {err}"
+
+    return True, f"Returned to start: distance={distance:.2f}m back"
 
 
 def send_robot_to_node(
@@ -259,39 +625,177 @@ def send_robot_to_node(
 ):
     """
     Отправляет робота из start_node_id в target_node_id по графу.
+    graph — словарь graph.json либо индексированный граф (BinaryGraph, RoutingGraph)
+    со своим shortest_path/path_context.
     Если return_to_start=True, после приезда ждёт wait_at_target_sec и возвращается в start.
     Возвращает (success: bool, message: str).
     """
-    nodes = graph.get("nodes", [])
-    if not nodes:
-        return False, "Граф пуст"
-    if not _node_by_id(nodes, target_node_id):
+    indexed = not isinstance(graph, dict)
+    if indexed:
+        if graph.num_nodes == 0:
+            return False, "Граф пуст"
+        has_node = graph.has_node
+        first_id = graph.node_ids()[0]
+    else:
+        nodes = graph.get("nodes", [])
+        if not nodes:
+            return False, "Граф пуст"
+        has_node = lambda nid: _node_by_id(nodes, nid) is not None
+        first_id = nodes[0]["id"]
+    if not has_node(target_node_id):
         return False, f"Узел {target_node_id} не найден"
-    start = start_node_id or (nodes[0]["id"] if nodes else None)
-    if not start or not _node_by_id(nodes, start):
+    base_url = base_url or ROBOT_DEFAULT_IP
+    track = _track(base_url)
+    # Без явного старта робот едет из узла, где он сейчас (по отслеживанию)
+    start = start_node_id or track.node or first_id
+    if not start or not has_node(start):
         return False, "Стартовый узел не найден"
+    if start != track.node:
+        track.move(start, track.heading if track.node is not None else 90, source="manual")
+        track.anchor = None
+    if track.home is None:
+        track.home = start
+    if track.anchor is None:
+        _anchor(track, base_url)
     if start == target_node_id and not return_to_start:
         return True, "Робот уже в целевой точке"
-    base_url = base_url or ROBOT_DEFAULT_IP
-    adj = _build_adj(graph)
 
-    path_to_target = _dijkstra(adj, start, target_node_id)
-    if not path_to_target:
-        return False, "Путь не найден"
-    commands = _path_to_commands(path_to_target, nodes, adj)
-    ok, err = _execute_commands(commands, base_url)
+    job = {
+        "job": next(_job_ids), "base_url": base_url, "start": start, "target": target_node_id,
+        "path": [], "state": "running", "leg": "forward",
+        "command_index": 0, "commands_total": 0,
+    }
+    ok, err = _drive_path(graph, base_url, track, target_node_id, job=job)
     if not ok:
+        if err == "Путь не найден":
+            return False, err
+        _publish_job(job, state="failed", error=err)
         return False, f"Ошибка связи с роботом: {err}"
+    _publish_job(job, state="at_target")
 
     if return_to_start and wait_at_target_sec > 0:
         time.sleep(wait_at_target_sec)
     if return_to_start and start != target_node_id:
-        # Возвращаемся обратно тем же набором команд, но в обратном порядке.
-        # Ключевое: движение назад делается через DRIVE_DIST с отрицательной дистанцией.
-        commands_back = _invert_commands(commands)
-        ok, err = _execute_commands(commands_back, base_url)
+        # Обратно — по графу из фактического узла (одометрия привязана к графу),
+        # а не повтором инвертированных команд
+        _relocalize(graph, base_url, track)
+        job.update(state="running", leg="return")
+        ok, err = _drive_path(graph, base_url, track, start, job=job)
         if not ok:
+            _publish_job(job, state="failed", error=err)
             return False, f"Ошибка при возврате: {err}"
+    _publish_job(job, state="done")
     return True, f"Робот доехал до {target_node_id}" + (
         " и вернулся в начало" if return_to_start else ""
     )
+
+
+# Кэш скомпилированных маршрутов: (версия графа, старт, цель, курс) -> путь, команды и
+# положение робота после каждой команды. Роботы весь день ездят между одними и теми же
+# узлами; версия графа меняется при правках и перезагрузке, так что устаревшие записи
+# просто перестают находиться и вытесняются. Кэшируются только графы с content_version
+# (RoutingGraph): у словаря graph.json версии нет.
+ROUTE_CACHE_SIZE = 256
+_route_cache = OrderedDict()
+_route_cache_lock = threading.Lock()
+_route_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+ROUTE_CACHE_TOTAL = metrics.counter("wdr_route_cache_total", "Compiled route cache lookups", ("result",))
+
+
+def _compile_path(graph, start, target, heading):
+    by_time = _route_neighbors(graph) if ROUTE_BY_TIME else None
+    if isinstance(graph, dict):
+        adj = _build_adj(graph)
+        nodes = graph.get("nodes", [])
+        path = _time_path(*by_time, start, target, heading) if by_time else _dijkstra(adj, start, target)
+    else:
+        path = _time_path(*by_time, start, target, heading) if by_time else graph.shortest_path(start, target)
+        if path:
+            nodes, adj = graph.path_context(path)
+    if not path:
+        return None
+    trace = []
+    commands = _path_to_commands(path, nodes, adj, heading=heading, trace=trace)
+    return path, commands, trace
+
+
+def _compile_route(graph, start, target, heading):
+    """(путь, команды, trace) от start до target при курсе heading или None, если пути нет."""
+    version = getattr(graph, "content_version", None)
+    if version is None:
+        return _compile_path(graph, start, target, heading)
+    # Выученные времена поменялись — маршруты по времени могут стать другими
+    key = (version, trip_costs.revision if ROUTE_BY_TIME else None, start, target, heading)
+    with _route_cache_lock:
+        route = _route_cache.get(key)
+        if route is not None:
+            _route_cache.move_to_end(key)
+            _route_cache_stats["hits"] += 1
+        else:
+            # Промах считается до компиляции: поиск недостижимой цели — тоже промах
+            _route_cache_stats["misses"] += 1
+    if route is not None:
+        ROUTE_CACHE_TOTAL.inc(result="hit")
+        return route
+    ROUTE_CACHE_TOTAL.inc(result="miss")
+    route = _compile_path(graph, start, target, heading)
+    if route is None:
+        return None
+    # Кортежи: запись общая для всех поездок и не должна меняться
+    route = (tuple(route[0]), tuple(route[1]), tuple(route[2]))
+    with _route_cache_lock:
+        _route_cache[key] = route
+        while len(_route_cache) > ROUTE_CACHE_SIZE:
+            _route_cache.popitem(last=False)
+            _route_cache_stats["evictions"] += 1
+    return route
+
+
+def route_cache_stats():
+    """Статистика кэша маршрутов: попадания, промахи, вытеснения, размер, доля попаданий."""
+    with _route_cache_lock:
+        stats = dict(_route_cache_stats, size=len(_route_cache), capacity=ROUTE_CACHE_SIZE)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats
+
+
+def clear_route_cache():
+    """Сбрасывает кэш маршрутов (новый граф)."""
+    with _route_cache_lock:
+        _route_cache.clear()
+
+
+def _drive_path(graph, base_url, track, target_node_id, job=None):
+    """
+    Ведёт робота из track.node в target_node_id по самому быстрому (или кратчайшему,
+    без ROUTE_BY_TIME) пути с учётом его курса; после каждой команды обновляет track.
+    Время каждой команды (по телеметрии, если она есть) уходит в trip_costs.
+    Возвращает (ok, ошибка).
+    """
+    start = track.node
+    if start == target_node_id:
+        return True, None
+    route = _compile_route(graph, start, target_node_id, track.heading)
+    if route is None:
+        return False, "Путь не найден"
+    path, commands, trace = route
+
+    def progress(k):
+        track.move(*trace[k - 1])
+        if job is not None:
+            _publish_job(job, command_index=k)
+
+    steps = _command_steps(start, commands, trace)
+    predicted = trip_costs.predict(steps)
+    if job is not None:
+        _publish_job(job, path=list(path), command_index=0, commands_total=len(commands),
+                     predicted_sec=round(predicted, 2))
+    durations = []
+    track.moving = True
+    try:
+        ok, err = _execute_commands(commands, base_url, progress=progress, durations=durations)
+    finally:
+        track.moving = False
+    trip_costs.record_trip(start, target_node_id, steps, durations, predicted, ok=ok)
+    return ok, err
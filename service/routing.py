@@ -0,0 +1,507 @@
+"""
+Граф маршрутизации в памяти с инкрементальными правками.
+
+Базовый граф (graph.json / graph.bin) загружается один раз; точечные изменения —
+заблокировать/разблокировать узел или ребро, поменять длину ребра — применяются
+к смежности в памяти и дописываются в журнал правок (graph_patches.jsonl), а не
+переписывают весь граф. Деревья кратчайших путей от уже встречавшихся стартов
+кэшируются и чинятся после правки локально (пересчитывается только затронутое
+поддерево), а не строятся заново.
+
+Формат правки: {"op": "disable_node" | "enable_node", "id": ...}
+               {"op": "disable_edge" | "enable_edge", "from": ..., "to": ...}
+               {"op": "set_length", "from": ..., "to": ..., "length": ...}
+"""
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import metrics
+from graph_store import BinaryGraph, open_graph
+
+_log = logging.getLogger(__name__)
+
+MAX_CACHED_TREES = 32
+
+_NODE_OPS = ("disable_node", "enable_node")
+_EDGE_OPS = ("disable_edge", "enable_edge", "set_length")
+
+
+def _edge_key(a, b):
+    return (a, b) if a <= b else (b, a)
+
+
+class _ShortestPathTree:
+    """Дерево кратчайших путей от одного источника с локальным ремонтом."""
+
+    def __init__(self, adj, source):
+        self.source = source
+        self.dist = {source: 0.0}
+        self.parent = {source: None}
+        self.children = {}
+        self._propagate(adj, [(0.0, source)])
+
+    def _set_parent(self, v, p):
+        old = self.parent.get(v)
+        if old is not None:
+            self.children.get(old, set()).discard(v)
+        self.parent[v] = p
+        if p is not None:
+            self.children.setdefault(p, set()).add(v)
+
+    def _propagate(self, adj, heap):
+        heapq.heapify(heap)
+        dist = self.dist
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist.get(u, math.inf):
+                continue
+            for v, w in adj.get(u, {}).items():
+                alt = d + w
+                if alt < dist.get(v, math.inf):
+                    dist[v] = alt
+                    self._set_parent(v, u)
+                    heapq.heappush(heap, (alt, v))
+
+    def edge_improved(self, adj, u, v, w):
+        """Ребро (u, v) появилось или стало короче."""
+        heap = []
+        for a, b in ((u, v), (v, u)):
+            da = self.dist.get(a)
+            if da is not None and da + w < self.dist.get(b, math.inf):
+                self.dist[b] = da + w
+                self._set_parent(b, a)
+                heap.append((da + w, b))
+        if heap:
+            self._propagate(adj, heap)
+
+    def edge_worsened(self, adj, u, v):
+        """Ребро (u, v) пропало или стало длиннее (adj уже обновлён)."""
+        if self.parent.get(v) == u:
+            self.detach(adj, [v])
+        elif self.parent.get(u) == v:
+            self.detach(adj, [u])
+
+    def detach(self, adj, roots):
+        """Сбрасывает поддеревья roots и заново подвешивает их узлы к остальному дереву."""
+        affected = set()
+        stack = [r for r in roots if r in self.dist]
+        for r in stack:
+            p = self.parent.get(r)
+            if p is not None:
+                self.children.get(p, set()).discard(r)
+        while stack:
+            x = stack.pop()
+            if x in affected:
+                continue
+            affected.add(x)
+            stack.extend(self.children.get(x, ()))
+        if not affected:
+            return
+        for x in affected:
+            self.dist.pop(x, None)
+            self.parent.pop(x, None)
+            self.children.pop(x, None)
+        heap = []
+        for x in affected:
+            best, best_p = math.inf, None
+            for y, w in adj.get(x, {}).items():
+                dy = self.dist.get(y)
+                if dy is not None and dy + w < best:
+                    best, best_p = dy + w, y
+            if best_p is not None:
+                self.dist[x] = best
+                self._set_parent(x, best_p)
+                heap.append((best, x))
+        self._propagate(adj, heap)
+
+    def path_to(self, target):
+        if target not in self.dist:
+            return []
+        path = []
+        cur = target
+        while cur is not None:
+            path.append(cur)
+            cur = self.parent.get(cur)
+        path.reverse()
+        return path
+
+
+_graph_uids = itertools.count(1)
+
+
+class RoutingGraph:
+    """
+    Смежность активной части графа + кэш деревьев кратчайших путей.
+    Поддерживает тот же интерфейс, что BinaryGraph, для send_robot_to_node.
+    """
+
+    def __init__(self, graph):
+        self.meta = None
+        self._ids = []
+        self._coords = {}
+        self._lengths = {}
+        self._incident = {}
+        self._disabled_nodes = set()
+        self._disabled_edges = set()
+        self.adj = {}
+        self.version = 0
+        # Уникален для каждого загруженного графа: (uid, version) — версия содержимого
+        self.uid = next(_graph_uids)
+        self._trees = OrderedDict()
+        self._lock = threading.RLock()
+        if isinstance(graph, BinaryGraph):
+            self._load_binary(graph)
+        else:
+            self._load_dict(graph or {})
+        for nid in self._ids:
+            self.adj[nid] = {}
+            self._incident[nid] = set()
+        for (a, b), ln in self._lengths.items():
+            self._incident[a].add((a, b))
+            self._incident[b].add((a, b))
+            self._link(a, b, ln)
+
+    def _load_dict(self, graph):
+        self.meta = graph.get("meta")
+        for n in graph.get("nodes", []) or []:
+            nid = n["id"]
+            self._ids.append(nid)
+            self._coords[nid] = (n.get("i", 0), n.get("j", 0))
+            if n.get("disabled"):
+                self._disabled_nodes.add(nid)
+        for e in graph.get("edges", []) or []:
+            fr, to = e.get("from"), e.get("to")
+            if not fr or not to or fr not in self._coords or to not in self._coords:
+                continue
+            key = _edge_key(fr, to)
+            ln = float(e.get("length", 1))
+            self._lengths[key] = min(ln, self._lengths.get(key, math.inf))
+            if e.get("disabled"):
+                self._disabled_edges.add(key)
+
+    def _load_binary(self, bg):
+        self.meta = bg.meta
+        ids = bg.node_ids()
+        self._ids = list(ids)
+        self._coords = dict(zip(ids, zip(bg.node_i.tolist(), bg.node_j.tolist())))
+        # Флаги disabled хранятся в дополнительных полях заголовка (ключ — индекс)
+        node_extras = bg._extras.get("nodes", {})
+        edge_extras = bg._extras.get("edges", {})
+        for k, extra in node_extras.items():
+            if extra.get("disabled"):
+                self._disabled_nodes.add(ids[int(k)])
+        edges = zip(bg.edge_from.tolist(), bg.edge_to.tolist(), bg.edge_len.tolist())
+        for k, (fr, to, ln) in enumerate(edges):
+            key = _edge_key(ids[fr], ids[to])
+            self._lengths[key] = min(ln, self._lengths.get(key, math.inf))
+            extra = edge_extras.get(str(k))
+            if extra and extra.get("disabled"):
+                self._disabled_edges.add(key)
+
+    def _active(self, key):
+        a, b = key
+        return (key not in self._disabled_edges
+                and a not in self._disabled_nodes and b not in self._disabled_nodes)
+
+    def _link(self, a, b, ln):
+        if self._active(_edge_key(a, b)):
+            self.adj[a][b] = ln
+            self.adj[b][a] = ln
+
+    @property
+    def content_version(self):
+        """Меняется при любой правке и при перезагрузке графа (ключ для кэшей маршрутов)."""
+        return (self.uid, self.version)
+
+    # --- интерфейс для send_robot_to_node ---
+
+    @property
+    def num_nodes(self):
+        return len(self._ids)
+
+    def node_ids(self):
+        return self._ids
+
+    def has_node(self, node_id):
+        return node_id in self._coords
+
+    def node(self, node_id):
+        c = self._coords.get(node_id)
+        if c is None:
+            return None
+        return {"id": node_id, "i": c[0], "j": c[1]}
+
+    def is_node_enabled(self, node_id):
+        return node_id in self._coords and node_id not in self._disabled_nodes
+
+    def _tree(self, start_id):
+        tree = self._trees.get(start_id)
+        if tree is None:
+            with metrics.timer(metrics.STAGE_SECONDS, stage="shortest_path_tree"):
+                tree = _ShortestPathTree(self.adj, start_id)
+            self._trees[start_id] = tree
+            while len(self._trees) > MAX_CACHED_TREES:
+                self._trees.popitem(last=False)
+        else:
+            self._trees.move_to_end(start_id)
+        return tree
+
+    def shortest_path(self, start_id, target_id):
+        """Путь [id, ...] по активным рёбрам или []. Дерево от start_id кэшируется."""
+        with self._lock:
+            if start_id not in self._coords or start_id in self._disabled_nodes:
+                return []
+            return self._tree(start_id).path_to(target_id)
+
+    def distances_from(self, start_id):
+        """{id: длина кратчайшего пути} до всех достижимых узлов (копия)."""
+        with self._lock:
+            if start_id not in self._coords or start_id in self._disabled_nodes:
+                return {}
+            return dict(self._tree(start_id).dist)
+
+    def path_context(self, path):
+        nodes = [self.node(nid) for nid in path]
+        adj = {nid: list(self.adj.get(nid, {}).items()) for nid in path}
+        return nodes, adj
+
+    # --- правки ---
+
+    def validate(self, ops):
+        """Проверяет список правок; ValueError с описанием первой ошибки."""
+        if not isinstance(ops, list) or not ops:
+            raise ValueError("Ожидается непустой список ops")
+        for op in ops:
+            kind = op.get("op") if isinstance(op, dict) else None
+            if kind in _NODE_OPS:
+                if op.get("id") not in self._coords:
+                    raise ValueError(f"Узел {op.get('id')} не найден")
+            elif kind in _EDGE_OPS:
+                fr, to = op.get("from"), op.get("to")
+                if fr not in self._coords or to not in self._coords:
+                    raise ValueError(f"Ребро {fr}-{to}: узел не найден")
+                # Длину задают только существующему ребру: иначе между несмежными
+                # клетками появилось бы ребро, которого нет на складе
+                if _edge_key(fr, to) not in self._lengths:
+                    raise ValueError(f"Ребро {fr}-{to} не найдено")
+                if kind == "set_length":
+                    try:
+                        ln = float(op.get("length"))
+                    except (TypeError, ValueError):
+                        raise ValueError(f"Ребро {fr}-{to}: некорректная длина")
+                    if not ln > 0 or math.isinf(ln):
+                        raise ValueError(f"Ребро {fr}-{to}: длина должна быть > 0")
+            else:
+                raise ValueError(f"Неизвестная операция: {kind}")
+
+    @metrics.timed(metrics.STAGE_SECONDS, stage="graph_patch")
+    def apply(self, ops):
+        """Применяет правки (после validate) и чинит кэшированные деревья путей."""
+        with self._lock:
+            for op in ops:
+                kind = op["op"]
+                if kind in _NODE_OPS:
+                    self._apply_node(op["id"], kind == "disable_node")
+                else:
+                    key = _edge_key(op["from"], op["to"])
+                    if kind == "set_length":
+                        self._apply_length(key, float(op["length"]))
+                    else:
+                        self._apply_edge(key, kind == "disable_edge")
+            self.version += 1
+
+    def _apply_node(self, nid, disable):
+        if disable == (nid in self._disabled_nodes):
+            return
+        if disable:
+            self._disabled_nodes.add(nid)
+            for nb in list(self.adj[nid]):
+                del self.adj[nb][nid]
+            self.adj[nid] = {}
+            self._trees.pop(nid, None)
+            for tree in self._trees.values():
+                tree.detach(self.adj, [nid])
+        else:
+            self._disabled_nodes.discard(nid)
+            for a, b in self._incident[nid]:
+                if self._active((a, b)):
+                    ln = self._lengths[(a, b)]
+                    self._link(a, b, ln)
+                    for tree in self._trees.values():
+                        tree.edge_improved(self.adj, a, b, ln)
+
+    def _apply_edge(self, key, disable):
+        if disable == (key in self._disabled_edges):
+            return
+        a, b = key
+        if disable:
+            self._disabled_edges.add(key)
+            if b in self.adj[a]:
+                del self.adj[a][b]
+                del self.adj[b][a]
+                for tree in self._trees.values():
+                    tree.edge_worsened(self.adj, a, b)
+        else:
+            self._disabled_edges.discard(key)
+            if self._active(key):
+                ln = self._lengths[key]
+                self._link(a, b, ln)
+                for tree in self._trees.values():
+                    tree.edge_improved(self.adj, a, b, ln)
+
+    def _apply_length(self, key, ln):
+        old = self._lengths[key]
+        self._lengths[key] = ln
+        a, b = key
+        if not self._active(key):
+            return
+        self._link(a, b, ln)
+        for tree in self._trees.values():
+            if ln < old:
+                tree.edge_improved(self.adj, a, b, ln)
+            elif ln > old:
+                tree.edge_worsened(self.adj, a, b)
+
+    def annotate(self, graph):
+        """Отмечает в словаре графа заблокированные узлы/рёбра и изменённые длины (для UI)."""
+        for n in graph.get("nodes", []) or []:
+            if n.get("id") in self._disabled_nodes:
+                n["disabled"] = True
+            else:
+                n.pop("disabled", None)
+        seen = set()
+        for e in graph.get("edges", []) or []:
+            key = _edge_key(e.get("from"), e.get("to"))
+            if key not in self._lengths:
+                continue
+            seen.add(key)
+            e["length"] = self._lengths[key]
+            if key in self._disabled_edges:
+                e["disabled"] = True
+            else:
+                e.pop("disabled", None)
+        edges = graph.setdefault("edges", [])
+        for key, ln in self._lengths.items():
+            if key not in seen:
+                e = {"from": key[0], "to": key[1], "length": ln}
+                if key in self._disabled_edges:
+                    e["disabled"] = True
+                edges.append(e)
+        return graph
+
+
+_graph_json_path = None
+_graph_bin_path = None
+_graph_patch_path = None
+_current = None
+_current_key = None
+_state_lock = threading.Lock()
+
+
+def set_graph_paths(json_path, bin_path=None, patch_path=None):
+    global _graph_json_path, _graph_bin_path, _graph_patch_path, _current, _current_key
+    with _state_lock:
+        _graph_json_path = Path(json_path) if json_path else None
+        _graph_bin_path = Path(bin_path) if bin_path else None
+        _graph_patch_path = Path(patch_path) if patch_path else None
+        _current = None
+        _current_key = None
+
+
+def _stat_key(path):
+    if path is None:
+        return None
+    try:
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+def _files_key():
+    return (_stat_key(_graph_json_path), _stat_key(_graph_bin_path), _stat_key(_graph_patch_path))
+
+
+def _read_patches():
+    if _graph_patch_path is None or not _graph_patch_path.exists():
+        return []
+    batches = []
+    with open(_graph_patch_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                batches.append(json.loads(line).get("ops", []))
+            except Exception:
+                _log.warning("skip broken patch line: %r", line[:80])
+    return batches
+
+
+def _load_current():
+    base = open_graph(_graph_json_path, _graph_bin_path) if _graph_json_path else None
+    if base is None:
+        return None
+    rg = RoutingGraph(base)
+    for ops in _read_patches():
+        try:
+            rg.validate(ops)
+            rg.apply(ops)
+        except ValueError as e:
+            _log.warning("skip stale graph patch: %s", e)
+    return rg
+
+
+def get_routing_graph():
+    """
+    Текущий граф маршрутизации (база + журнал правок). Перечитывается, только если
+    файлы изменил кто-то другой (например, другой процесс сервера). None — графа нет.
+    """
+    global _current, _current_key
+    with _state_lock:
+        key = _files_key()
+        if _current is None or key != _current_key:
+            _current = _load_current()
+            _current_key = key
+        return _current
+
+
+def apply_graph_patch(ops):
+    """
+    Дописывает правки в журнал и применяет их к графу в памяти. Возвращает RoutingGraph.
+    Сначала журнал (с fsync): если запись не удалась, граф в памяти не меняется и
+    маршруты совпадают с тем, что восстановится после перезапуска.
+    """
+    global _current_key
+    rg = get_routing_graph()
+    if rg is None:
+        raise ValueError("Граф не построен")
+    with _state_lock:
+        rg.validate(ops)
+        if _graph_patch_path is not None:
+            _graph_patch_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(_graph_patch_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"ts": time.time(), "ops": ops}, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        rg.apply(ops)
+        _current_key = _files_key()
+    return rg
+
+
+def reset_graph():
+    """Новый базовый граф: журнал правок больше не применим, состояние строится заново."""
+    global _current, _current_key
+    with _state_lock:
+        if _graph_patch_path is not None and _graph_patch_path.exists():
+            _graph_patch_path.unlink()
+        _current = None
+        _current_key = None
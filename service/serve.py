@@ -0,0 +1,94 @@
+"""
+Запуск сервиса в боевом режиме: многопоточный WSGI-сервер вместо отладочного Flask.
+
+    python serve.py --port 5002 --threads 16
+    python serve.py --backend gunicorn --threads 16
+
+Бэкенды: waitress (по умолчанию, работает везде) и gunicorn с gthread-воркерами
+(только Linux/macOS). Дрон, камера, флаг миссии, хранилища (qr_store,
+контрольные точки, журнал правок графа) и шина событий SSE — состояние одного
+процесса (одно подключение к дрону), поэтому воркер всегда один, а параллельность
+даёт пул потоков: --workers (WDR_WORKERS) больше 1 — ошибка запуска. Параметры
+можно задать и переменными окружения WDR_HOST, WDR_PORT, WDR_THREADS,
+WDR_WORKERS, WDR_BACKEND.
+
+Бюджет потоков: каждая открытая вкладка с push-каналом (/api/events, SSE) держит
+поток пула всё время, пока открыта. Потоков SSE не больше половины пула
+(events.MAX_STREAMS = threads // 2, или WDR_SSE_MAX_STREAMS); остальные вкладки
+получают 503 и опрашивают статус, а вторая половина пула остаётся для запросов API
+(в том числе долгих: отправка робота ждёт конца поездки). Больше вкладок — больше
+--threads.
+"""
+import argparse
+import logging
+import os
+import sys
+
+import events
+
+_log = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5002
+DEFAULT_THREADS = 8
+
+
+def _parse_args(argv):
+    p = argparse.ArgumentParser(description='Warehouse service (production WSGI)')
+    p.add_argument('--host', default=os.environ.get('WDR_HOST', '0.0.0.0'))
+    p.add_argument('--port', type=int, default=int(os.environ.get('WDR_PORT', DEFAULT_PORT)))
+    p.add_argument('--threads', type=int, default=int(os.environ.get('WDR_THREADS', DEFAULT_THREADS)))
+    p.add_argument('--workers', type=int, default=int(os.environ.get('WDR_WORKERS', 1)))
+    p.add_argument('--backend', choices=('auto', 'waitress', 'gunicorn'),
+                   default=os.environ.get('WDR_BACKEND', 'auto'))
+    args = p.parse_args(argv)
+    if args.workers != 1:
+        p.error(f'--workers/WDR_WORKERS={args.workers}: only 1 worker is supported. The drone connection, '
+                'stores (QR results, mission checkpoints, graph patches) and the SSE event bus live in '
+                'one process; a second worker would not see them. Use --threads for concurrency.')
+    return args
+
+
+def run_waitress(app, host, port, threads):
+    from waitress import serve
+    _log.info('waitress on %s:%s, threads=%s', host, port, threads)
+    serve(app, host=host, port=port, threads=threads)
+
+
+def run_gunicorn(app, host, port, threads, workers):
+    from gunicorn.app.base import BaseApplication
+
+    class _App(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            # Долгие запросы (отправка робота ждёт завершения поездки)
+            self.cfg.set('timeout', 600)
+
+        def load(self):
+            return app
+
+    _log.info('gunicorn on %s:%s, workers=%s, threads=%s', host, port, workers, threads)
+    _App().run()
+
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    args = _parse_args(argv if argv is not None else sys.argv[1:])
+    from app import app
+    threads = max(1, args.threads)
+    if 'WDR_SSE_MAX_STREAMS' not in os.environ:
+        events.MAX_STREAMS = max(1, threads // 2)
+    _log.info('SSE streams limited to %s of %s threads', events.MAX_STREAMS, threads)
+    backend = args.backend
+    if backend == 'auto':
+        backend = 'waitress'
+    if backend == 'gunicorn':
+        run_gunicorn(app, args.host, args.port, threads, args.workers)
+    else:
+        run_waitress(app, args.host, args.port, threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+"""Эмуляторы оборудования (робот, дрон) для локальных прогонов и бенчмарков."""
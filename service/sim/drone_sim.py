@@ -0,0 +1,176 @@
+"""
+Симулятор дрона Pioneer и его камеры для прогонов миссий без железа.
+
+SimPioneer — кинематическая модель: летит к цели по прямой с постоянной
+горизонтальной (speed) и вертикальной (climb_rate) скоростью; leg_overhead
+добавляет к каждому перелёту время на разгон, торможение и стабилизацию. point_reached(),
+как в pioneer_sdk, возвращает True один раз после прибытия в очередную точку.
+
+SimCamera рисует кадр «вниз» из текущей позиции дрона: QR-коды узлов, попавшие
+в поле зрения, выводятся белым полем с кодом в масштабе высоты полёта. Опционально
+добавляет шум и пропуски кадров, чтобы проверять устойчивость распознавания.
+
+    from sim.drone_sim import SimPioneer, SimCamera
+    pioneer = SimPioneer(speed=1.0)
+    dronecontroller.set_drone_backend(lambda: pioneer, lambda: SimCamera(pioneer, targets))
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+TAKEOFF_HEIGHT = 1.0
+ARRIVE_TOLERANCE = 0.05
+
+
+class SimPioneer:
+    def __init__(self, speed=1.0, climb_rate=0.5, time_scale=1.0, clock=time.monotonic, leg_overhead=0.0):
+        self.speed = speed
+        self.climb_rate = climb_rate
+        self.leg_overhead = leg_overhead
+        self.time_scale = time_scale
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pos = (0.0, 0.0, 0.0)
+        self._from = self._pos
+        self._target = self._pos
+        self._t0 = clock()
+        self._duration = 0.0
+        self._arrival_pending = False
+        self.armed = False
+        self.commands = []
+
+    def _now_pos(self, now):
+        if self._duration <= 0:
+            return self._target
+        k = min(1.0, (now - self._t0) / self._duration)
+        return tuple(a + (b - a) * k for a, b in zip(self._from, self._target))
+
+    def _set_target(self, x, y, z):
+        now = self._clock()
+        with self._lock:
+            self._from = self._now_pos(now)
+            self._target = (float(x), float(y), float(z))
+            dx = self._target[0] - self._from[0]
+            dy = self._target[1] - self._from[1]
+            dz = self._target[2] - self._from[2]
+            horizontal = math.hypot(dx, dy) / self.speed if self.speed > 0 else 0.0
+            vertical = abs(dz) / self.climb_rate if self.climb_rate > 0 else 0.0
+            duration = max(horizontal, vertical)
+            if duration > 0:
+                duration += self.leg_overhead
+            self._duration = duration * self.time_scale
+            self._t0 = now
+            self._arrival_pending = True
+
+    def arm(self):
+        self.commands.append(('arm',))
+        self.armed = True
+
+    def disarm(self):
+        self.commands.append(('disarm',))
+        self.armed = False
+
+    def takeoff(self):
+        self.commands.append(('takeoff',))
+        x, y, _ = self.get_local_position_lps()
+        self._set_target(x, y, TAKEOFF_HEIGHT)
+
+    def land(self):
+        self.commands.append(('land',))
+        x, y, _ = self.get_local_position_lps()
+        self._set_target(x, y, 0.0)
+
+    def go_to_local_point(self, x=0.0, y=0.0, z=0.0, yaw=0.0):
+        self.commands.append(('go_to_local_point', x, y, z))
+        self._set_target(x, y, z)
+
+    def point_reached(self):
+        now = self._clock()
+        with self._lock:
+            if not self._arrival_pending:
+                return False
+            pos = self._now_pos(now)
+            if math.dist(pos, self._target) <= ARRIVE_TOLERANCE or now - self._t0 >= self._duration:
+                self._arrival_pending = False
+                return True
+            return False
+
+    def get_local_position_lps(self, get_last_received=False):
+        with self._lock:
+            return list(self._now_pos(self._clock()))
+
+    def time_to_arrival(self):
+        """Сколько ещё лететь до текущей цели (для бенчмарков и отладки)."""
+        with self._lock:
+            return max(0.0, self._duration - (self._clock() - self._t0))
+
+
+class SimCamera:
+    """
+    targets — [(x, y, code), ...] в локальных координатах дрона (как у _cells_to_meters).
+    fov_deg — угол обзора по ширине кадра, qr_size — сторона QR-кода в метрах.
+    """
+
+    def __init__(self, pioneer, targets, width=640, height=480, fov_deg=60.0, qr_size=0.3,
+                 noise=0.0, drop_rate=0.0, frame_delay=0.0, seed=None):
+        self.pioneer = pioneer
+        self.targets = list(targets)
+        self.width = width
+        self.height = height
+        self.fov = math.radians(fov_deg)
+        self.qr_size = qr_size
+        self.noise = noise
+        self.drop_rate = drop_rate
+        self.frame_delay = frame_delay
+        self._rng = np.random.default_rng(seed)
+        self._qr_cache = {}
+        self.frames = 0
+
+    def _qr_image(self, code):
+        img = self._qr_cache.get(code)
+        if img is None:
+            if cv2 is None:
+                raise RuntimeError('SimCamera needs OpenCV to render QR codes')
+            img = cv2.QRCodeEncoder.create().encode(code)
+            # Тихая зона в 4 модуля, как на напечатанной этикетке
+            img = cv2.copyMakeBorder(img, 3, 3, 3, 3, cv2.BORDER_CONSTANT, value=255)
+            self._qr_cache[code] = img
+        return img
+
+    def get_cv_frame(self):
+        if self.frame_delay > 0:
+            time.sleep(self.frame_delay)
+        self.frames += 1
+        if self.drop_rate > 0 and self._rng.random() < self.drop_rate:
+            return None
+        frame = np.full((self.height, self.width, 3), 200, dtype=np.uint8)
+        x, y, z = self.pioneer.get_local_position_lps()
+        z = max(z, 0.1)
+        footprint = 2.0 * z * math.tan(self.fov / 2.0)
+        px_per_m = self.width / footprint
+        side = self.qr_size * px_per_m
+        if side >= 21:
+            for tx, ty, code in self.targets:
+                # Целое число пикселей на модуль: печатный код, снятый без размытия
+                img = self._qr_image(code)
+                module = max(1, int(round(side / img.shape[0])))
+                n = img.shape[0] * module
+                # Камера смотрит вниз: +x — вправо по кадру, +y — вверх по кадру
+                cx = self.width / 2 + (tx - x) * px_per_m
+                cy = self.height / 2 - (ty - y) * px_per_m
+                x0, y0 = int(cx - n / 2), int(cy - n / 2)
+                if x0 < 0 or y0 < 0 or x0 + n > self.width or y0 + n > self.height:
+                    continue
+                qr = cv2.resize(img, (n, n), interpolation=cv2.INTER_NEAREST)
+                frame[y0:y0 + n, x0:x0 + n] = qr[:, :, None]
+        if self.noise > 0:
+            n = self._rng.normal(0, self.noise * 255, frame.shape)
+            frame = np.clip(frame.astype(np.float32) + n, 0, 255).astype(np.uint8)
+        return frame
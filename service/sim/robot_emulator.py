@@ -0,0 +1,241 @@
+"""
+Эмулятор HTTP-прошивки робота (esp8266_robot_ap) на localhost.
+
+Поддерживает эндпоинты, которые использует robotcontroller: /drive_dist, /turn,
+/lift_up, /lift_down, /stop, /get_position, /reset_position. Ответы повторяют
+строки прошивки ("DRIVE_DIST 0.50", "TURN 90", "OK", ...).
+
+Одометрия: после /reset_position робот в (0, 0) и смотрит вдоль +Y, X — вправо
+(в координатах графа это +i / +j, курс 90°). Angle — поворот с момента сброса,
+положительный — влево (CCW), как у команды TURN.
+
+Параметры: speed (м/с), turn_rate (°/с), latency (с, добавляется к каждому
+запросу), loss (вероятность потери запроса: соединение рвётся без ответа или,
+при loss_mode='hang', зависает до таймаута клиента), wait_motion — отвечать
+после завершения движения (по умолчанию) или сразу, без времени движения;
+ack_early — как настоящая прошивка: ответ сразу, а робот едет дальше в фоне, и
+одометрия (/get_position) меняется по ходу движения; odometry=False — без
+/get_position и /reset_position (404), как у прошивки esp8266_robot_ap;
+time_scale — множитель времени движения (0.01 — в 100 раз быстрее); slow_zones —
+[(x0, y0, x1, y1, factor), ...]: проезд, середина которого в прямоугольнике
+(координаты одометрии, м), идёт в factor раз дольше (загруженный проход, плохой пол).
+
+    python -m sim.robot_emulator --port 8081 --speed 0.5 --latency 0.02
+    # затем base_url = "127.0.0.1:8081"
+"""
+import argparse
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Скорости по умолчанию взяты из прошивки main.ino при PWM 150:
+# 1 м за 2 с, 90° за 400 мс.
+DEFAULT_SPEED = 0.5
+DEFAULT_TURN_RATE = 225.0
+# Шаг обновления одометрии по ходу движения, с (реального времени)
+MOTION_TICK = 0.01
+
+
+class RobotEmulator:
+    def __init__(self, host='127.0.0.1', port=0, speed=DEFAULT_SPEED, turn_rate=DEFAULT_TURN_RATE,
+                 latency=0.0, loss=0.0, loss_mode='reset', wait_motion=True, time_scale=1.0, seed=None,
+                 slow_zones=(), ack_early=False, odometry=True):
+        self.speed = speed
+        self.turn_rate = turn_rate
+        self.latency = latency
+        self.loss = loss
+        self.loss_mode = loss_mode
+        self.wait_motion = wait_motion
+        self.ack_early = ack_early
+        self.odometry = odometry
+        self.time_scale = time_scale
+        self.slow_zones = list(slow_zones)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._motion_lock = threading.Lock()
+        self.x = 0.0
+        self.y = 0.0
+        self.angle = 0.0
+        self.lift_up = False
+        self.log = []
+        self.counts = {}
+        self.dropped = 0
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.log = []
+            self.counts = {}
+            self.dropped = 0
+
+    def position_text(self):
+        with self._lock:
+            return f'Position: X={self.x:.2f}, Y={self.y:.2f}, Angle={self.angle:.1f}°'
+
+    # --- движение ---
+
+    def _animate(self, seconds, step):
+        """Движение длительностью seconds (время модели): step(доля) под _lock по шагам."""
+        wall = seconds * self.time_scale if self.wait_motion or self.ack_early else 0.0
+        n = max(1, int(math.ceil(wall / MOTION_TICK)))
+        for _ in range(n):
+            if wall > 0:
+                time.sleep(wall / n)
+            with self._lock:
+                step(1.0 / n)
+
+    def _slowdown(self, x, y):
+        for x0, y0, x1, y1, factor in self.slow_zones:
+            if min(x0, x1) <= x <= max(x0, x1) and min(y0, y1) <= y <= max(y0, y1):
+                return factor
+        return 1.0
+
+    def _drive(self, d):
+        with self._motion_lock:
+            with self._lock:
+                heading = math.radians(90.0 + self.angle)
+                dx, dy = d * math.cos(heading), d * math.sin(heading)
+                factor = self._slowdown(self.x + dx / 2, self.y + dy / 2)
+
+            def step(f):
+                self.x += dx * f
+                self.y += dy * f
+            self._animate(abs(d) / self.speed * factor if self.speed > 0 else 0, step)
+
+    def _turn(self, a):
+        with self._motion_lock:
+            def step(f):
+                self.angle = (self.angle + a * f + 180.0) % 360.0 - 180.0
+            self._animate(abs(a) / self.turn_rate if self.turn_rate > 0 else 0, step)
+
+    def _start(self, motion, arg):
+        if self.ack_early:
+            threading.Thread(target=motion, args=(arg,), daemon=True).start()
+        else:
+            motion(arg)
+
+    def handle(self, path, params):
+        """Выполняет команду. Возвращает (HTTP-код, текст ответа)."""
+        if path == '/drive_dist':
+            if 'd' not in params:
+                return 400, 'd (meters) required'
+            d = float(params['d'])
+            if abs(d) < 0.01:
+                return 400, '|d| must be >= 0.01'
+            self._start(self._drive, d)
+            return 200, f'DRIVE_DIST {d:.2f}'
+        if path == '/turn':
+            if 'angle' not in params:
+                return 400, 'angle (degrees) required'
+            a = float(params['angle'])
+            self._start(self._turn, a)
+            return 200, f'TURN {a:.0f}'
+        if path == '/lift_up':
+            self.lift_up = True
+            return 200, 'LIFT_UP'
+        if path == '/lift_down':
+            self.lift_up = False
+            return 200, 'LIFT_DOWN'
+        if path == '/stop':
+            return 200, 'OK'
+        if not self.odometry and path in ('/get_position', '/reset_position'):
+            return 404, 'Not found'
+        if path == '/get_position':
+            return 200, self.position_text()
+        if path == '/reset_position':
+            with self._lock:
+                self.x = self.y = self.angle = 0.0
+            return 200, 'Position reset'
+        return 404, 'Not found'
+
+    def _make_handler(self):
+        emu = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                received = time.perf_counter()
+                url = urlparse(self.path)
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                with emu._lock:
+                    emu.counts[url.path] = emu.counts.get(url.path, 0) + 1
+                if emu.latency > 0:
+                    time.sleep(emu.latency / 2)
+                if emu.loss > 0 and emu._rng.random() < emu.loss:
+                    with emu._lock:
+                        emu.dropped += 1
+                    if emu.loss_mode == 'hang':
+                        time.sleep(60)
+                    self.close_connection = True
+                    return
+                try:
+                    code, text = emu.handle(url.path, params)
+                except ValueError as e:
+                    code, text = 400, str(e)
+                with emu._lock:
+                    emu.log.append((received, time.perf_counter(), url.path, params, code))
+                if emu.latency > 0:
+                    time.sleep(emu.latency / 2)
+                body = text.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', 'text/plain; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, fmt, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    p = argparse.ArgumentParser(description='ESP8266 robot firmware emulator')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8081)
+    p.add_argument('--speed', type=float, default=DEFAULT_SPEED)
+    p.add_argument('--turn-rate', type=float, default=DEFAULT_TURN_RATE)
+    p.add_argument('--latency', type=float, default=0.0)
+    p.add_argument('--loss', type=float, default=0.0)
+    p.add_argument('--loss-mode', choices=('reset', 'hang'), default='reset')
+    p.add_argument('--no-wait-motion', action='store_true')
+    p.add_argument('--ack-early', action='store_true')
+    p.add_argument('--time-scale', type=float, default=1.0)
+    args = p.parse_args()
+    emu = RobotEmulator(args.host, args.port, speed=args.speed, turn_rate=args.turn_rate,
+                        latency=args.latency, loss=args.loss, loss_mode=args.loss_mode,
+                        wait_motion=not args.no_wait_motion, time_scale=args.time_scale,
+                        ack_early=args.ack_early)
+    print(f'robot emulator on http://{emu.base_url}')
+    try:
+        emu._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -41,6 +41,23 @@
     var flyoverReturnStartIndex = null;
     var simulationInterval = null;
     var nodeQrData = {};
+    // Коды по уровням стеллажа: ключи «узел@уровень» из nodeQrData -> { узел: { уровень: код } }
+    var nodeQrLevels = {};
+    // Коды, замеченные камерой робота: ключи «узел#robot» -> { узел: код }
+    var nodeQrRobot = {};
+
+    function setNodeQr(key, code) {
+        nodeQrData[key] = code;
+        var hash = key.indexOf('#');
+        if (hash >= 0) {
+            nodeQrRobot[key.substring(0, hash)] = code;
+            return;
+        }
+        var at = key.indexOf('@');
+        if (at < 0) return;
+        var nodeId = key.substring(0, at);
+        (nodeQrLevels[nodeId] = nodeQrLevels[nodeId] || {})[key.substring(at + 1)] = code;
+    }
     var canSendRobot = false;
     var robotStartNode = null;
     var videoStreamInterval = null;
@@ -96,14 +113,20 @@
         var ctx = mapGraphOverlay.getContext('2d');
         ctx.clearRect(0, 0, mapGraphOverlay.width, mapGraphOverlay.height);
         if (!gridGeometry || !graphData || !graphData.nodes || !graphData.nodes.length) return;
-        drawGraph(ctx, gridGeometry, graphData, nodeQrData);
+        drawGraph(ctx, gridGeometry, graphData, nodeQrData, nodeQrLevels, nodeQrRobot);
     }
 
+    var nodeQrRev = 0;
     function fetchNodeQrData() {
-        fetch('/api/nodes/qr')
-            .then(function (res) { return res.ok ? res.json() : {}; })
+        fetch('/api/nodes/qr?since=' + nodeQrRev)
+            .then(function (res) { return res.ok ? res.json() : null; })
             .then(function (data) {
-                nodeQrData = data && typeof data === 'object' ? data : {};
+                if (!data || typeof data !== 'object' || !data.nodes) return;
+                if (data.full) { nodeQrData = {}; nodeQrLevels = {}; nodeQrRobot = {}; }
+                for (var id in data.nodes) {
+                    if (Object.prototype.hasOwnProperty.call(data.nodes, id)) setNodeQr(id, data.nodes[id]);
+                }
+                nodeQrRev = data.rev;
                 drawGraphLayer();
             })
             .catch(function () {});
@@ -330,7 +353,7 @@
         return graphData;
     }
 
-    function drawGraph(ctx, g, data, qrData) {
+    function drawGraph(ctx, g, data, qrData, qrLevels, qrRobot) {
         if (!ctx || !g || !data || !data.nodes || !data.nodes.length) return;
         var nodeMap = {};
         for (var n = 0; n < data.nodes.length; n++) {
@@ -371,7 +394,7 @@
             var u = data.nodes[n];
             if (u.i < 0 || u.i >= g.nx || u.j < 0 || u.j >= g.ny) continue;
             var p = cellCenterPX(g, u.i, u.j);
-            if (qrData && qrData[u.id]) {
+            if ((qrData && qrData[u.id]) || (qrLevels && qrLevels[u.id]) || (qrRobot && qrRobot[u.id])) {
                 ctx.fillStyle = 'rgba(240, 160, 40, 0.85)';
             } else {
                 ctx.fillStyle = 'rgba(33, 170, 190, 0.6)';
@@ -610,7 +633,14 @@
         var contentEl = document.getElementById('nodeQrModalContent');
         var modal = document.getElementById('nodeQrModal');
         if (titleEl) titleEl.textContent = 'Узел (' + ci + ', ' + cj + ')';
-        if (contentEl) contentEl.textContent = (nodeQrData[nodeId] && nodeQrData[nodeId].trim()) ? nodeQrData[nodeId] : 'QR не распознан';
+        var lines = [];
+        if (nodeQrData[nodeId] && nodeQrData[nodeId].trim()) lines.push(nodeQrData[nodeId]);
+        var levels = nodeQrLevels[nodeId] || {};
+        Object.keys(levels).sort(function (a, b) { return a - b; }).forEach(function (lv) {
+            if (levels[lv] && levels[lv].trim()) lines.push('Уровень ' + lv + ': ' + levels[lv]);
+        });
+        if (nodeQrRobot[nodeId] && nodeQrRobot[nodeId].trim()) lines.push('Камера робота: ' + nodeQrRobot[nodeId]);
+        if (contentEl) contentEl.textContent = lines.length ? lines.join('\n') : 'QR не распознан';
         if (modal) modal.classList.remove('hidden');
     }
 
@@ -654,12 +684,26 @@
     }
 
     var videoStreamActive = false;
+    // id зрителя для адаптивного потока (/api/drone/frame-with-qr?client=...)
+    var videoStreamClient = 'v' + Date.now().toString(36) + Math.random().toString(36).slice(2, 8);
 
     function startVideoStream() {
         var canvas = document.getElementById('videoStreamFrame');
         if (!canvas) return;
         var ctx = canvas.getContext('2d');
         videoStreamActive = true;
+        // Замеры для сервера: доставка прошлого кадра (от запроса до отрисовки), время
+        // сервера на него и кадры, которые ждут отрисовки дольше интервала кадра
+        var lastLatency = null;
+        var lastServerMs = null;
+        var pendingSince = [];
+        var frameIntervalMs = 100;
+
+        function staleImages() {
+            // Кадр, декодируемый меньше интервала, — обычный конвейер, а не очередь
+            var now = performance.now();
+            return pendingSince.filter(function (t) { return now - t > frameIntervalMs; }).length;
+        }
 
         function drawQrBoxes(qrList) {
             if (!qrList || !qrList.length) return;
@@ -702,6 +746,7 @@
             if (d.cv_version) lines.push('OpenCV: ' + d.cv_version);
             if (d.original_size) lines.push('Кадр (ориг.): ' + d.original_size[0] + '×' + d.original_size[1]);
             if (d.resized) lines.push('Кадр (вывод): ' + d.resized[0] + '×' + d.resized[1]);
+            if (d.jpeg_quality) lines.push('JPEG: ' + d.jpeg_quality);
             if (d.detector_used) lines.push('Детектор: ' + d.detector_used);
             if (d.detector) lines.push('Детектор (старый): ' + d.detector);
             if (d.pyzbar_available !== undefined) lines.push('pyzbar: ' + (d.pyzbar_available ? 'да' : 'нет'));
@@ -733,27 +778,52 @@
             else el.classList.remove('modal-video-debug--error');
         }
 
+        function updateStreamDebug(st) {
+            var el = document.getElementById('videoStreamDebug');
+            if (!el || !st) return;
+            el.textContent += ' | Поток: ' + st.width + 'px, q' + st.quality + ', ' + st.fps + ' к/с' +
+                (st.skip ? ', пропуск ' + st.skip : '') +
+                (st.latency_ms !== null ? ', задержка ' + Math.round(st.latency_ms) + ' мс' : '');
+        }
+
         function tick() {
             if (!videoStreamActive) return;
             var qrToggle = document.getElementById('videoStreamQrToggle');
             var withQr = qrToggle ? qrToggle.checked : false;
-            var url = '/api/drone/frame-with-qr?t=' + Date.now() + (withQr ? '&fast=0' : '&fast=1');
+            var url = '/api/drone/frame-with-qr?t=' + Date.now() + (withQr ? '&fast=0' : '&fast=1') +
+                '&client=' + videoStreamClient + '&backlog=' + staleImages() +
+                (lastLatency !== null ? '&lat=' + Math.round(lastLatency) : '') +
+                (lastServerMs !== null ? '&srv=' + Math.round(lastServerMs) : '');
+            var started = performance.now();
             fetch(url)
                 .then(function (res) { return res.ok ? res.json() : null; })
                 .then(function (data) {
                     if (!videoStreamActive) return;
                     if (data && data.debug) updateDebug(data.debug);
-                    setTimeout(tick, 0);
+                    if (data && data.stream) {
+                        updateStreamDebug(data.stream);
+                        if (data.stream.fps) frameIntervalMs = 1000 / data.stream.fps;
+                    }
+                    setTimeout(tick, data && data.stream ? data.stream.next_ms : 0);
                     if (!data || !data.image || !canvas) return;
                     var img = new Image();
+                    var since = performance.now();
+                    pendingSince.push(since);
+                    var done = function () {
+                        var k = pendingSince.indexOf(since);
+                        if (k >= 0) pendingSince.splice(k, 1);
+                    };
                     img.onload = function () {
+                        done();
+                        lastLatency = performance.now() - started;
+                        lastServerMs = data.server_ms !== undefined ? data.server_ms : null;
                         if (!videoStreamActive) return;
                         canvas.width = data.width;
                         canvas.height = data.height;
                         ctx.drawImage(img, 0, 0);
                         drawQrBoxes(data.qr || []);
                     };
-                    img.onerror = function () { };
+                    img.onerror = done;
                     img.src = 'data:image/jpeg;base64,' + data.image;
                 })
                 .catch(function (err) {
@@ -1114,6 +1184,11 @@
             if (flyoverReturnStartIndex != null) {
                 payload.return_start_index = flyoverReturnStartIndex;
             }
+            var storage = getStorageSettings();
+            if (storage.storageType === 'shelves' && storage.levelHeights) {
+                // Все уровни стеллажей — одной миссией (сервер строит порядок облёта уровней)
+                payload.levelHeights = storage.levelHeights;
+            }
             startDroneBtn.disabled = true;
             fetch('/api/drone/start', {
                 method: 'POST',
@@ -1157,37 +1232,77 @@
     }
 
     var wasMissionActive = false;
-    setInterval(function () {
-        fetch('/api/drone/status')
-            .then(function (res) { return res.json(); })
-            .then(function (data) {
-                if (wasMissionActive && !data.mission_active) {
-                    wasMissionActive = false;
-                    canSendRobot = true;
-                    resetDroneButton();
-                    fetchNodeQrData();
-                } else if (data.mission_active) {
-                    wasMissionActive = true;
+    function handleDroneStatus(data) {
+        if (wasMissionActive && !data.mission_active) {
+            wasMissionActive = false;
+            canSendRobot = true;
+            resetDroneButton();
+            fetchNodeQrData();
+        } else if (data.mission_active) {
+            wasMissionActive = true;
+        }
+        if (data.mission_active && flyoverRoute && graphData && graphData.nodes) {
+            var nodeIdx = data.current_waypoint_index >= 0 ? data.current_waypoint_index : data.current_node_index;
+            if (nodeIdx >= 0 && nodeIdx < flyoverRoute.length) {
+                var nodeMap = {};
+                for (var n = 0; n < graphData.nodes.length; n++) {
+                    var u = graphData.nodes[n];
+                    nodeMap[u.id] = u;
                 }
-                if (data.mission_active && flyoverRoute && graphData && graphData.nodes) {
-                    var nodeIdx = data.current_waypoint_index >= 0 ? data.current_waypoint_index : data.current_node_index;
-                    if (nodeIdx >= 0 && nodeIdx < flyoverRoute.length) {
-                        var nodeMap = {};
-                        for (var n = 0; n < graphData.nodes.length; n++) {
-                            var u = graphData.nodes[n];
-                            nodeMap[u.id] = u;
-                        }
-                        var nodeId_ = flyoverRoute[nodeIdx];
-                        var node = nodeMap[nodeId_];
-                        if (node) {
-                            droneCell = { i: node.i, j: node.j };
-                            drawOverlay();
-                        }
-                    }
+                var nodeId_ = flyoverRoute[nodeIdx];
+                var node = nodeMap[nodeId_];
+                if (node) {
+                    droneCell = { i: node.i, j: node.j };
+                    drawOverlay();
                 }
-            })
-            .catch(function () {});
-    }, 200);
+            }
+        }
+    }
+
+    // Статус миссии и новые QR-коды приходят по SSE; опрос — только запасной вариант.
+    var statusPollTimer = null;
+    function startStatusPolling() {
+        if (statusPollTimer) return;
+        statusPollTimer = setInterval(function () {
+            fetch('/api/drone/status')
+                .then(function (res) { return res.json(); })
+                .then(handleDroneStatus)
+                .catch(function () {});
+        }, 200);
+    }
+    function stopStatusPolling() {
+        if (statusPollTimer) {
+            clearInterval(statusPollTimer);
+            statusPollTimer = null;
+        }
+    }
+    // Сервер держит не больше половины пула потоков под push-каналы: сверх лимита
+    // /api/events отвечает 503, EventSource закрывается, и статус опрашивается,
+    // а push-канал переоткрывается раз в EVENTS_RETRY_MS
+    var EVENTS_RETRY_MS = 30000;
+    function connectEvents() {
+        var droneEvents = new EventSource('/api/events?topics=drone,qr');
+        droneEvents.onopen = stopStatusPolling;
+        droneEvents.onerror = function () {
+            startStatusPolling();
+            if (droneEvents.readyState === EventSource.CLOSED) setTimeout(connectEvents, EVENTS_RETRY_MS);
+        };
+        droneEvents.addEventListener('drone', function (e) {
+            handleDroneStatus(JSON.parse(e.data));
+        });
+        droneEvents.addEventListener('qr', function (e) {
+            var d = JSON.parse(e.data);
+            if (!d.node_id) return;
+            setNodeQr(d.node_id, d.code);
+            // Ревизию не двигаем: пропущенные при переподключении изменения догрузит ?since
+            drawGraphLayer();
+        });
+    }
+    if (typeof EventSource !== 'undefined') {
+        connectEvents();
+    } else {
+        startStatusPolling();
+    }
 
     if (mapWrapper && typeof ResizeObserver !== 'undefined') {
         var ro = new ResizeObserver(function () { resizeOverlay(); });
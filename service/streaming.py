@@ -0,0 +1,164 @@
+"""
+Адаптивное качество видеопотока с камеры дрона — отдельно для каждого зрителя.
+
+Клиент (/api/drone/frame-with-qr?client=...) запрашивает кадры в цикле и в каждом
+запросе сообщает, сколько доставлялся предыдущий кадр (lat — от запроса до
+отрисовки, мс; srv — сколько из них кадр готовился на сервере, клиент берёт его из
+ответа) и сколько полученных кадров дольше интервала кадра ждут отрисовки
+(backlog). Время сервера (захват кадра и распознавание QR в полном разрешении) из
+задержки вычитается: ширина и качество кадра на него почти не влияют, и с
+включённым распознаванием поток иначе сползал бы на нижнюю ступень. По
+оставшейся задержке (передача и декодирование) StreamController держит целевую
+частоту кадров fps:
+  - не успеваем (сглаженная задержка больше 1/fps с запасом или есть очередь) —
+    шаг вниз по лестнице LADDER (ширина кадра и качество JPEG), а на нижней
+    ступени — пропуск кадров: клиент ждёт next_ms перед следующим запросом;
+  - успеваем с запасом UPGRADE_AFTER кадров подряд — шаг обратно вверх.
+После каждого шага HOLD_FRAMES кадров новых решений не принимается, пока замеры не
+отразят новые настройки.
+
+Распознавание QR не зависит от настроек потока: оно идёт по кадру в исходном
+разрешении (см. dronecontroller.get_camera_frame_with_qr).
+"""
+import math
+import threading
+import time
+
+# (ширина, качество JPEG) — от самого лёгкого к самому тяжёлому
+LADDER = (
+    (240, 50),
+    (320, 60),
+    (480, 65),
+    (480, 75),
+    (640, 75),
+    (800, 80),
+    (960, 85),
+    (1280, 85),
+)
+# Ступень по умолчанию — прежние STREAM_MAX_WIDTH = 480, STREAM_JPEG_QUALITY = 75
+START_LEVEL = 3
+TARGET_FPS = 10.0
+MAX_FPS = 30.0
+SLOW_FACTOR = 1.15
+FAST_FACTOR = 0.7
+UPGRADE_AFTER = 5
+HOLD_FRAMES = 3
+MAX_SKIP = 10
+EWMA_ALPHA = 0.3
+CLIENT_IDLE_SEC = 60.0
+
+
+class StreamController:
+    def __init__(self, client_id, fps=TARGET_FPS):
+        self.client_id = client_id
+        self.fps = fps
+        self.level = START_LEVEL
+        # Сколько интервалов 1/fps клиент пропускает между запросами
+        self.skip = 0
+        self.latency = None
+        self.server_ms = None
+        self._last_server_ms = None
+        self.frames = 0
+        self.changes = 0
+        self._fast_streak = 0
+        self._hold = 0
+        self.last_seen = time.monotonic()
+
+    @property
+    def interval_ms(self):
+        return 1000.0 / self.fps
+
+    def report(self, latency_ms=None, backlog=0, fps=None, server_ms=None):
+        """
+        Замеры клиента по предыдущему кадру; решает, менять ли настройки. server_ms —
+        время сервера на этот кадр (без него — на последний отданный кадр).
+        """
+        self.last_seen = time.monotonic()
+        if fps:
+            self.fps = max(1.0, min(MAX_FPS, float(fps)))
+        if latency_ms is None or latency_ms < 0 or not math.isfinite(latency_ms):
+            return
+        if server_ms is None or server_ms < 0 or not math.isfinite(server_ms):
+            server_ms = self._last_server_ms or 0.0
+        latency_ms = max(0.0, latency_ms - server_ms)
+        self.latency = latency_ms if self.latency is None else (
+            EWMA_ALPHA * latency_ms + (1 - EWMA_ALPHA) * self.latency)
+        if self._hold > 0:
+            self._hold -= 1
+            return
+        budget = self.interval_ms
+        if self.latency > budget * SLOW_FACTOR or backlog > 0:
+            self._fast_streak = 0
+            if self.level > 0:
+                self.level -= 1
+            elif self.skip < MAX_SKIP:
+                self.skip += 1
+            else:
+                return
+            self._changed()
+        elif self.latency < budget * FAST_FACTOR:
+            self._fast_streak += 1
+            if self._fast_streak < UPGRADE_AFTER:
+                return
+            self._fast_streak = 0
+            if self.skip > 0:
+                self.skip -= 1
+            elif self.level < len(LADDER) - 1:
+                self.level += 1
+            else:
+                return
+            self._changed()
+        else:
+            self._fast_streak = 0
+
+    def _changed(self):
+        self.changes += 1
+        self._hold = HOLD_FRAMES
+
+    def settings(self):
+        """(ширина, качество JPEG, пауза перед следующим запросом в мс)."""
+        width, quality = LADDER[self.level]
+        return width, quality, round(self.skip * self.interval_ms)
+
+    def delivered(self, server_ms):
+        self.frames += 1
+        self._last_server_ms = server_ms
+        self.server_ms = server_ms if self.server_ms is None else (
+            EWMA_ALPHA * server_ms + (1 - EWMA_ALPHA) * self.server_ms)
+
+    def state(self):
+        width, quality, next_ms = self.settings()
+        return {
+            'client': self.client_id,
+            'width': width,
+            'quality': quality,
+            'next_ms': next_ms,
+            'level': self.level,
+            'skip': self.skip,
+            'fps': self.fps,
+            'latency_ms': round(self.latency, 1) if self.latency is not None else None,
+            'server_ms': round(self.server_ms, 1) if self.server_ms is not None else None,
+            'frames': self.frames,
+            'changes': self.changes,
+        }
+
+
+_controllers = {}
+_lock = threading.Lock()
+
+
+def get_controller(client_id):
+    """Контроллер потока клиента (создаётся при первом запросе; забытые — удаляются)."""
+    now = time.monotonic()
+    with _lock:
+        for cid in [c for c, ctl in _controllers.items() if now - ctl.last_seen > CLIENT_IDLE_SEC]:
+            del _controllers[cid]
+        ctl = _controllers.get(client_id)
+        if ctl is None:
+            ctl = _controllers[client_id] = StreamController(client_id)
+        return ctl
+
+
+def stats():
+    with _lock:
+        return [ctl.state() for ctl in _controllers.values()]
@@ -0,0 +1,250 @@
+"""
+Телеметрия робота: фоновый опрос /get_position и кэш разобранной позиции.
+
+На каждого робота (base_url) — один поток, который спрашивает позицию раз в
+POLL_INTERVAL (WDR_TELEMETRY_INTERVAL) секунд, пока её кто-то читает, и
+засыпает, если читателей нет IDLE_STOP_SEC. Все читатели (UI, возврат к старту)
+получают позицию из кэша вместе с её возрастом, так что нагрузка на HTTP-сервер
+робота не зависит от числа клиентов: чаще MIN_REQUEST_INTERVAL запросов нет.
+
+Пока роботу отправлена команда движения, опрос приостанавливается (hold), а после
+неё кэш помечается устаревшим — следующий fresh() дождётся нового замера.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple, Optional
+
+import events
+
+_log = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.environ.get('WDR_TELEMETRY_INTERVAL', '0.5'))
+MIN_REQUEST_INTERVAL = 0.1
+IDLE_STOP_SEC = 30.0
+# Позиция старше stale_after считается устаревшей (робот не отвечает)
+STALE_FACTOR = 4.0
+STALE_MIN_SEC = 2.0
+
+_POSITION_RE = re.compile(
+    r'X\s*=\s*(?P<x>[-+]?\d+(?:\.\d*)?)\s*,?\s*'
+    r'Y\s*=\s*(?P<y>[-+]?\d+(?:\.\d*)?)\s*,?\s*'
+    r'Angle\s*=\s*(?P<angle>[-+]?\d+(?:\.\d*)?)')
+
+
+class Position(NamedTuple):
+    x: float
+    y: float
+    angle: float
+
+
+def parse_position(text) -> Optional[Position]:
+    """'Position: X=1.23, Y=2.45, Angle=90.0°' -> Position или None."""
+    m = _POSITION_RE.search(text or '')
+    if m is None:
+        return None
+    return Position(float(m.group('x')), float(m.group('y')), float(m.group('angle')))
+
+
+def normalize_base_url(base_url, default):
+    base_url = (base_url or default).strip()
+    if '://' in base_url:
+        base_url = base_url.split('://', 1)[1]
+    return base_url.rstrip('/')
+
+
+class TelemetryPoller:
+    """fetch() -> (текст ответа /get_position, ошибка) — запрос к роботу."""
+
+    def __init__(self, base_url, fetch, interval=None):
+        self.base_url = base_url
+        self._fetch = fetch
+        self.interval = max(MIN_REQUEST_INTERVAL, interval or POLL_INTERVAL)
+        self._cond = threading.Condition()
+        self._position = None
+        self._raw = None
+        self._ts = None
+        self._error = None
+        # Последний опрос удался: /get_position у робота есть и отвечает
+        self._last_ok = False
+        self._error_at = None
+        # Меняется при каждой команде движения: ответ, запрошенный до неё, отбрасывается
+        self._gen = 0
+        self._polls = 0
+        self._errors = 0
+        self._holds = 0
+        self._last_request = 0.0
+        self._last_read = time.monotonic()
+        self._wanted = False
+        self._thread = None
+
+    @property
+    def healthy(self):
+        """Последний опрос вернул позицию (у прошивки без /get_position — никогда)."""
+        return self._last_ok
+
+    def failed_within(self, seconds):
+        """Последний опрос не удался, и было это не раньше seconds секунд назад."""
+        at = self._error_at
+        return not self._last_ok and at is not None and time.monotonic() - at <= seconds
+
+    @property
+    def stale_after(self):
+        return max(STALE_MIN_SEC, self.interval * STALE_FACTOR)
+
+    def _ensure_running(self):
+        self._last_read = time.monotonic()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f'telemetry-{self.base_url}', daemon=True)
+            self._thread.start()
+        else:
+            self._cond.notify_all()
+
+    def snapshot(self):
+        """Последняя позиция из кэша с метаданными свежести (без запроса к роботу)."""
+        with self._cond:
+            self._ensure_running()
+            return self._snapshot_locked()
+
+    def _snapshot_locked(self):
+        age = None if self._ts is None else time.time() - self._ts
+        pos = self._position
+        return {
+            'base_url': self.base_url,
+            'position': pos._asdict() if pos is not None else None,
+            'raw': self._raw,
+            'ts': self._ts,
+            'age_sec': round(age, 3) if age is not None else None,
+            'stale': age is None or age > self.stale_after,
+            'error': self._error,
+            'polls': self._polls,
+            'errors': self._errors,
+        }
+
+    def fresh(self, max_age, timeout=5.0):
+        """
+        Позиция не старше max_age секунд: при необходимости будит поток опроса и
+        ждёт нового замера до timeout. (Position, raw, None) или (None, None, ошибка);
+        если опрос за время ожидания не удался, ошибка возвращается сразу.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._ensure_running()
+            polls = self._polls
+            while True:
+                if self._ts is not None and time.time() - self._ts <= max_age and self._position is not None:
+                    return self._position, self._raw, None
+                if self._polls > polls and not self._last_ok:
+                    return None, None, self._error
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, None, self._error or 'Нет свежих данных о позиции робота'
+                self._wanted = True
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+
+    def wait_newer(self, after_ts, timeout=5.0):
+        """
+        Ждёт замер новее after_ts (time.time()) — без кэша, сразу за следующим опросом.
+        (Position, ts, None) или (None, None, ошибка); при ошибке опроса не ждёт до timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._ensure_running()
+            polls = self._polls
+            while True:
+                if self._ts is not None and self._ts > after_ts and self._position is not None:
+                    return self._position, self._ts, None
+                if self._polls > polls and not self._last_ok:
+                    return None, None, self._error
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None, None, self._error or 'Нет свежих данных о позиции робота'
+                self._wanted = True
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+
+    def invalidate(self):
+        """Кэш больше не отражает положение робота (он поехал или сброшен)."""
+        with self._cond:
+            self._ts = None
+            self._gen += 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def hold(self):
+        """Не опрашивать робота, пока выполняется команда движения; после — замерить заново."""
+        with self._cond:
+            self._holds += 1
+            self._gen += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._holds -= 1
+                self._ts = None
+                self._gen += 1
+                self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if now - self._last_read > IDLE_STOP_SEC and not self._wanted:
+                        self._thread = None
+                        return
+                    wait = self._last_request + (MIN_REQUEST_INTERVAL if self._wanted else self.interval) - now
+                    if self._holds == 0 and wait <= 0:
+                        break
+                    self._cond.wait(wait if self._holds == 0 else self.interval)
+                self._wanted = False
+                self._last_request = time.monotonic()
+                gen = self._gen
+            text, err = self._fetch()
+            pos = parse_position(text) if err is None else None
+            with self._cond:
+                self._polls += 1
+                self._last_ok = pos is not None
+                if pos is None:
+                    self._errors += 1
+                    self._error_at = time.monotonic()
+                    self._error = err or f'Неверный формат позиции: {text!r}'
+                elif gen == self._gen:
+                    changed = pos != self._position
+                    self._position, self._raw, self._ts, self._error = pos, text, time.time(), None
+                    if changed:
+                        events.publish('telemetry', self._snapshot_locked(), retain=True)
+                self._cond.notify_all()
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def get_poller(base_url, fetch, interval=None):
+    """Поток телеметрии робота base_url (создаётся при первом обращении)."""
+    with _pollers_lock:
+        poller = _pollers.get(base_url)
+        if poller is None:
+            poller = _pollers[base_url] = TelemetryPoller(base_url, fetch, interval)
+        return poller
+
+
+def find_poller(base_url):
+    with _pollers_lock:
+        return _pollers.get(base_url)
+
+
+def set_poll_interval(seconds):
+    """Меняет частоту опроса для всех роботов."""
+    global POLL_INTERVAL
+    POLL_INTERVAL = max(MIN_REQUEST_INTERVAL, float(seconds))
+    with _pollers_lock:
+        for poller in _pollers.values():
+            with poller._cond:
+                poller.interval = POLL_INTERVAL
+                poller._cond.notify_all()
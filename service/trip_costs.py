@@ -0,0 +1,252 @@
+"""
+Выученное время поездок наземного робота: сколько на деле занимает каждое ребро
+графа и каждый поворот.
+
+robotcontroller засекает каждую команду /drive_dist и /turn от отправки до конца
+движения по телеметрии (одометрия перестала меняться, _motion_finished) и передаёт
+замер сюда: по ребру (в направлении движения) и по углу поворота ведётся экспоненциально
+сглаженная оценка (EWMA_ALPHA), по всем рёбрам — общая скорость в с/м для рёбер,
+где робот ещё не ездил. Маршрут строится по ожидаемому времени (edge_time +
+turn_time, см. robotcontroller._time_path), а каждая поездка сохраняется с
+предсказанным и фактическим временем для отчёта report().
+
+Прошивка esp8266_robot_ap отвечает на команду сразу, не дожидаясь конца движения, и
+/get_position не отдаёт: время ответа — только подтверждение приёма, поэтому без
+телеметрии команда не измеряется (None), в оценки не идёт и фактическое время такой
+поездки в отчёте не считается. Маршрут по времени включается явно (WDR_ROUTE_BY_TIME=1),
+замеры без него — WDR_TRIP_TIMING=1.
+Замер быстрее, чем физически может двигаться робот (MAX_SPEED, MAX_TURN_RATE), тоже
+отбрасывается.
+
+Оценки хранятся в data/trip_costs.json (запись отложенная и атомарная, как у qr_store).
+"""
+import atexit
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+_log = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+# Начальные оценки — прошивка main.ino при PWM 150: 1 м за 2 с, 90° за 400 мс
+DEFAULT_SEC_PER_M = 2.0
+DEFAULT_SEC_PER_DEG = 0.4 / 90
+# Постоянная часть каждой команды (запрос, разгон и торможение)
+DEFAULT_COMMAND_SEC = 0.1
+MAX_SPEED = 3.0
+MAX_TURN_RATE = 1000.0
+MAX_TRIPS = 200
+# Оценка сдвинулась больше чем на эту долю — маршруты пересчитываются (revision)
+REVISION_TOLERANCE = 0.05
+PERSIST_DELAY = 1.0
+
+
+def _ewma(old, value):
+    return value if old is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * old
+
+
+def _turn_key(angle):
+    """Углы поворота на сетке — кратные 90°; ключ оценки — угол, округлённый до 45°."""
+    return str(int(round(float(angle) / 45.0) * 45))
+
+
+class TripCosts:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._timer = None
+        self._dirty = False
+        # "from|to" -> [EWMA секунд, число замеров]
+        self._edges = {}
+        # ключ угла -> [EWMA секунд, число замеров]
+        self._turns = {}
+        self._sec_per_m = None
+        self._trips = deque(maxlen=MAX_TRIPS)
+        # Меняется, когда оценки заметно сдвинулись (ключ кэша маршрутов)
+        self.revision = 0
+        self._shifted = False
+        self.rejected = 0
+
+    def load(self, path):
+        """Задаёт файл сохранения и загружает из него оценки."""
+        path = Path(path) if path else None
+        data = {}
+        if path is not None and path.exists():
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except Exception:
+                _log.exception("failed to load %s", path)
+        with self._lock:
+            self._path = path
+            self._edges = {k: list(v) for k, v in (data.get("edges") or {}).items()}
+            self._turns = {k: list(v) for k, v in (data.get("turns") or {}).items()}
+            self._sec_per_m = data.get("sec_per_m")
+            self._trips = deque(data.get("trips") or [], maxlen=MAX_TRIPS)
+            self.revision += 1
+
+    # --- оценки ---
+
+    def edge_time(self, a, b, length):
+        """Ожидаемое время проезда ребра a -> b длиной length (м), с."""
+        est = self._edges.get(f"{a}|{b}")
+        if est is not None:
+            return est[0]
+        return DEFAULT_COMMAND_SEC + abs(length) * (self._sec_per_m or DEFAULT_SEC_PER_M)
+
+    def turn_time(self, angle):
+        """Ожидаемое время поворота на angle градусов, с (0 — без поворота)."""
+        if abs(angle) <= 1:
+            return 0.0
+        est = self._turns.get(_turn_key(angle))
+        if est is not None:
+            return est[0]
+        return DEFAULT_COMMAND_SEC + abs(angle) * DEFAULT_SEC_PER_DEG
+
+    def predict(self, steps):
+        """Ожидаемое время шагов [(тип, из узла, в узел, длина | угол)] (robotcontroller._command_steps), с."""
+        total = 0.0
+        for kind, a, b, value in steps:
+            total += self.edge_time(a, b, value) if kind == "drive" else self.turn_time(value)
+        return total
+
+    # --- замеры ---
+
+    def observe(self, kind, a, b, value, sec):
+        """Замер одного шага. False — замер отброшен (подтверждение без движения)."""
+        if kind == "drive":
+            plausible = sec > 0 and abs(value) / sec <= MAX_SPEED
+        else:
+            plausible = sec > 0 and abs(value) / sec <= MAX_TURN_RATE
+        with self._lock:
+            if not plausible:
+                self.rejected += 1
+                return False
+            if kind == "drive":
+                key = f"{a}|{b}"
+                est = self._edges.setdefault(key, [None, 0])
+                if abs(value) > 0.01:
+                    self._sec_per_m = _ewma(self._sec_per_m, sec / abs(value))
+            else:
+                est = self._turns.setdefault(_turn_key(value), [None, 0])
+            old = est[0]
+            est[0] = _ewma(old, sec)
+            est[1] += 1
+            if old is None or abs(est[0] - old) > REVISION_TOLERANCE * old:
+                self._shifted = True
+        return True
+
+    def record_trip(self, start, target, steps, durations, predicted, ok=True):
+        """
+        Поездка закончена: steps — шаги, durations — время выполненных (по порядку, None —
+        не измерено), predicted — предсказанное до поездки время. Учитывает замеры и пишет
+        поездку в отчёт; actual_sec — None, если измерены не все шаги.
+        """
+        learned = sum(1 for step, sec in zip(steps, durations)
+                      if sec is not None and self.observe(*step, sec))
+        measured = [sec for sec in durations if sec is not None]
+        complete = len(durations) == len(steps) and len(measured) == len(durations)
+        trip = {
+            "ts": round(time.time(), 3),
+            "start": start,
+            "target": target,
+            "ok": bool(ok and len(durations) == len(steps)),
+            "commands": len(steps),
+            "turns": sum(1 for s in steps if s[0] == "turn"),
+            "predicted_sec": round(predicted, 3),
+            "actual_sec": round(sum(measured), 3) if complete else None,
+            "measured": len(measured),
+            "learned": learned,
+        }
+        with self._lock:
+            self._trips.append(trip)
+            if self._shifted:
+                self._shifted = False
+                self.revision += 1
+        self._schedule_persist()
+        return trip
+
+    # --- отчёт ---
+
+    def report(self, limit=50):
+        """
+        Предсказанное и фактическое время поездок: последние limit поездок (0 — все
+        сохранённые) и сводка по завершённым и измеренным целиком (средняя абсолютная
+        ошибка, относительная, смещение).
+        """
+        with self._lock:
+            trips = list(self._trips)
+            summary = {
+                "edges_learned": len(self._edges),
+                "turns_learned": {k: round(v[0], 3) for k, v in sorted(self._turns.items())},
+                "sec_per_m": round(self._sec_per_m, 3) if self._sec_per_m is not None else None,
+                "rejected_samples": self.rejected,
+                "revision": self.revision,
+            }
+        done = [t for t in trips if t["ok"] and (t["actual_sec"] or 0) > 0]
+        if done:
+            errors = [t["predicted_sec"] - t["actual_sec"] for t in done]
+            summary.update({
+                "trips": len(done),
+                "mean_abs_error_sec": round(sum(abs(e) for e in errors) / len(done), 3),
+                "mean_abs_pct_error": round(100 * sum(abs(e) / t["actual_sec"]
+                                                      for e, t in zip(errors, done)) / len(done), 1),
+                "bias_sec": round(sum(errors) / len(done), 3),
+            })
+        else:
+            summary["trips"] = 0
+        return {"summary": summary, "trips": trips[-limit:] if limit else trips}
+
+    def reset(self):
+        with self._lock:
+            self._edges.clear()
+            self._turns.clear()
+            self._sec_per_m = None
+            self._trips.clear()
+            self.rejected = 0
+            self.revision += 1
+        self._schedule_persist()
+
+    # --- сохранение ---
+
+    def _schedule_persist(self):
+        with self._lock:
+            if self._path is None:
+                return
+            self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(PERSIST_DELAY, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        with self._lock:
+            self._timer = None
+            if not self._dirty or self._path is None:
+                return
+            self._dirty = False
+            text = json.dumps({
+                "edges": {k: [round(v[0], 4), v[1]] for k, v in self._edges.items()},
+                "turns": {k: [round(v[0], 4), v[1]] for k, v in self._turns.items()},
+                "sec_per_m": self._sec_per_m,
+                "trips": list(self._trips),
+            }, ensure_ascii=False)
+            path = self._path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+        except Exception:
+            _log.exception("failed to save %s", path)
+
+
+costs = TripCosts()
+atexit.register(costs.flush)
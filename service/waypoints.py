@@ -0,0 +1,88 @@
+"""
+Компиляция маршрута облёта (клетки графа) в точки полёта дрона.
+
+Маршрут из UI проходит каждую клетку по пути, включая уже осмотренные и обратный
+путь после return_start_index. Снимать QR нужно только на узлах осмотра — первом
+посещении узла до начала возврата (или где в элементе маршрута явно задано
+'scan'). Остальные клетки — транзитные: подряд идущие транзитные клетки на одной
+прямой сливаются в один отрезок, и на транзите дрон не зависает.
+"""
+import numpy as np
+
+
+def cells_to_meters(route, scale_x, scale_y, axis_y=None):
+    """
+    Центры клеток маршрута в метрах, массив (n, 2). С axis_y ({di, dj} — куда
+    смотрит ось Y дрона) — в локальных координатах дрона относительно первой клетки.
+    """
+    if not route:
+        return np.empty((0, 2))
+    ij = np.array([(item.get('i', 0), item.get('j', 0)) for item in route], dtype=float)
+    grid = (ij + 0.5) * (scale_x, scale_y)
+
+    if axis_y is None or (axis_y.get('di') == 0 and axis_y.get('dj') == 0):
+        return grid
+
+    di = int(axis_y.get('di', 0))
+    dj = int(axis_y.get('dj', 1))
+    x_vec = np.array((-dj * scale_x, di * scale_y))
+    y_vec = np.array((di * scale_x, dj * scale_y))
+    lx = np.hypot(*x_vec) or 1.0
+    ly = np.hypot(*y_vec) or 1.0
+    basis = np.column_stack((x_vec / lx, y_vec / ly))
+    return (grid - grid[0]) @ basis
+
+
+def scan_mask(route, return_start_index=None):
+    """
+    True для узлов, где снимается QR: явный 'scan' или первое посещение до возврата.
+    Первая клетка снимается всегда (без явного 'scan': False), даже при
+    return_start_index == 0, — как и до компиляции маршрута.
+    """
+    end = len(route) if return_start_index is None else max(1, min(len(route), return_start_index))
+    seen = set()
+    mask = np.zeros(len(route), dtype=bool)
+    for idx, item in enumerate(route):
+        node_id = item.get('id', f"{item.get('i', 0)}_{item.get('j', 0)}")
+        if 'scan' in item:
+            mask[idx] = bool(item['scan'])
+        elif idx < end:
+            mask[idx] = node_id not in seen
+        seen.add(node_id)
+    return mask
+
+
+def compile_waypoints(route, points, return_start_index=None):
+    """
+    Список точек полёта: {'index', 'x', 'y', 'scan', 'hover'}, где index — номер
+    клетки маршрута (для прогресса), scan — снимать QR, hover — зависнуть после
+    снимка. Транзитная клетка выбрасывается, если маршрут идёт через неё прямо
+    (без поворота), — дрон пролетает её в составе более длинного отрезка.
+    """
+    n = len(route)
+    if n == 0:
+        return []
+    pts = np.asarray(points, dtype=float).reshape(n, 2)
+    scan = scan_mask(route, return_start_index)
+    keep = scan.copy()
+    keep[0] = keep[-1] = True
+    if n > 2:
+        cells = np.array([(item.get('i', 0), item.get('j', 0)) for item in route], dtype=np.int64)
+        d = np.diff(cells, axis=0)
+        d_in, d_out = d[:-1], d[1:]
+        cross = d_in[:, 0] * d_out[:, 1] - d_in[:, 1] * d_out[:, 0]
+        dot = (d_in * d_out).sum(axis=1)
+        # Поворот или разворот — точку оставляем; прямо (или стоим на месте) — сливаем
+        keep[1:-1] |= (cross != 0) | (dot < 0)
+    forward_end = n if return_start_index is None else return_start_index
+    out = []
+    for idx in np.flatnonzero(keep):
+        idx = int(idx)
+        out.append({
+            'index': idx,
+            'x': float(pts[idx, 0]),
+            'y': float(pts[idx, 1]),
+            'scan': bool(scan[idx]),
+            'hover': bool(scan[idx]) and idx < forward_end,
+        })
+    return out